@@ -0,0 +1,331 @@
+import time
+import random
+import asyncio
+import threading
+import contextlib
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from tracing import span
+
+# Chat session of the current request, so queued requests are admitted fairly per session
+current_session: ContextVar[Optional[Hashable]] = ContextVar("upstream_session", default=None)
+
+# Async callback (upstream name, queue position) told while the current request waits for a slot;
+# position 0 means it was admitted after waiting
+queue_listener: ContextVar[Optional[Callable[[str, int], Awaitable[None]]]] = ContextVar("queue_listener", default=None)
+
+# Seconds between queue position updates of a waiting request
+POSITION_INTERVAL = 1.0
+
+WAITING, GRANTED, REJECTED = "waiting", "granted", "rejected"
+
+
+class UpstreamBusy(Exception):
+    """Raised when an upstream's wait queue is full or a request waited too long for a slot"""
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """Whether an OpenAI or Gemini client error is a 429 (rate limit or exhausted quota)"""
+    if getattr(exc, "status_code", None) == 429 or getattr(exc, "code", None) == 429:
+        return True
+    return type(exc).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds from the Retry-After header of a 429 response, if the client exposes it"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class _Waiter:
+    __slots__ = ("session", "state", "event", "loop", "future")
+
+    def __init__(self, session: Optional[Hashable], loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.session = session
+        self.state = WAITING
+        self.event = threading.Event()
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class UpstreamLimiter:
+    """Caps concurrent requests to one upstream (OpenAI, Gemini) with a bounded wait queue.
+
+    Requests over max_concurrent wait in a queue of at most max_queue. Slots
+    are handed to waiting sessions in round-robin order, so one busy session
+    cannot starve the others. When the queue is full, the newest request of
+    the session with the most queued requests is shed in favour of a session
+    with fewer; otherwise the new request is refused with UpstreamBusy, as is
+    one that waits longer than max_wait. Calls that get a 429 are retried
+    with exponential backoff (or the provider's Retry-After) while keeping
+    their slot, which lowers the request rate until the provider recovers.
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 16, max_queue: int = 64, max_wait: float = 30.0,
+                 max_retries: int = 3, backoff_base: float = 1.0, backoff_max: float = 30.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._queues: "OrderedDict[Optional[Hashable], Deque[_Waiter]]" = OrderedDict()
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.shed = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _enqueue_locked(self, waiter: _Waiter) -> Optional[_Waiter]:
+        """Queue waiter, returning a waiter shed to make room; raises UpstreamBusy when it cannot be queued"""
+        shed = None
+        if self._queued >= self.max_queue:
+            own = len(self._queues.get(waiter.session, ()))
+            heaviest = max(self._queues, key=lambda session: len(self._queues[session]), default=None)
+            if heaviest is None or len(self._queues[heaviest]) <= own + 1:
+                self.rejected += 1
+                raise UpstreamBusy(f"{self.name}: {self._queued} requests already waiting")
+            shed = self._queues[heaviest][-1]
+            self._remove_locked(shed)
+            shed.state = REJECTED
+            self.shed += 1
+        self._queues.setdefault(waiter.session, deque()).append(waiter)
+        self._queued += 1
+        return shed
+
+    def _remove_locked(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.session]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.session]
+        self._queued -= 1
+
+    def _position_locked(self, waiter: _Waiter) -> int:
+        """1-based turn of a waiter under round-robin admission, 0 if it is no longer queued"""
+        queue = self._queues.get(waiter.session)
+        if not queue or waiter.state != WAITING:
+            return 0
+        turn = queue.index(waiter)
+        position = turn + 1
+        before = True
+        for session, other in self._queues.items():
+            if session == waiter.session:
+                before = False
+                continue
+            # Sessions ahead in the rotation are served once more in the waiter's own round
+            position += min(len(other), turn + 1 if before else turn)
+        return position
+
+    def _signal(self, waiter: Optional[_Waiter]) -> None:
+        if waiter is None:
+            return
+        waiter.event.set()
+        if waiter.future is not None:
+            waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+
+    def _admit_or_queue(self, session: Optional[Hashable], loop=None) -> Optional[_Waiter]:
+        """Take a free slot (None) or the queued waiter to wait on"""
+        with self._lock:
+            if self._active < self.max_concurrent and not self._queued:
+                self._active += 1
+                self.admitted += 1
+                return None
+            waiter = _Waiter(session, loop)
+            shed = self._enqueue_locked(waiter)
+        self._signal(shed)
+        return waiter
+
+    def _settle(self, waiter: _Waiter, started: float) -> None:
+        """After waiting: record the wait, or raise UpstreamBusy for a shed or timed out waiter"""
+        with self._lock:
+            if waiter.state == WAITING:
+                self._remove_locked(waiter)
+                waiter.state = REJECTED
+                self.rejected += 1
+                raise UpstreamBusy(f"{self.name}: no free slot within {self.max_wait:g} seconds")
+            if waiter.state == REJECTED:
+                raise UpstreamBusy(f"{self.name}: shed to make room for other sessions")
+            waited = time.perf_counter() - started
+            self.admitted += 1
+            self.waited += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """A waiter was cancelled: leave the queue, or pass on a slot handed to it meanwhile"""
+        with self._lock:
+            state = waiter.state
+            if state == WAITING:
+                self._remove_locked(waiter)
+                waiter.state = REJECTED
+        if state == GRANTED:
+            self.release()
+
+    def acquire(self, session: Optional[Hashable] = None) -> None:
+        """Wait for a slot (blocking); raises UpstreamBusy instead of waiting when the queue is full"""
+        session = current_session.get() if session is None else session
+        waiter = self._admit_or_queue(session)
+        if waiter is None:
+            return
+        started = time.perf_counter()
+        with span("upstream.wait", upstream=self.name):
+            waiter.event.wait(self.max_wait)
+            self._settle(waiter, started)
+
+    async def aacquire(self, session: Optional[Hashable] = None) -> None:
+        """Async version of acquire, telling queue_listener the queue position while waiting"""
+        session = current_session.get() if session is None else session
+        waiter = self._admit_or_queue(session, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        started = time.perf_counter()
+        listener = queue_listener.get()
+        shown = 0
+        with span("upstream.wait", upstream=self.name) as wait_span:
+            try:
+                while not waiter.future.done():
+                    remaining = self.max_wait - (time.perf_counter() - started)
+                    if remaining <= 0:
+                        break
+                    with self._lock:
+                        position = self._position_locked(waiter)
+                    if position and "position" not in wait_span.attributes:
+                        wait_span.set(position=position)
+                    if listener and position and position != shown:
+                        await listener(self.name, position)
+                        shown = position
+                    try:
+                        await asyncio.wait_for(asyncio.shield(waiter.future), min(remaining, POSITION_INTERVAL))
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._abandon(waiter)
+                raise
+            self._settle(waiter, started)
+        if listener and shown:
+            try:
+                await listener(self.name, 0)
+            except BaseException:
+                # The slot is already ours; give it back if the listener fails or we are cancelled
+                self.release()
+                raise
+
+    def release(self) -> None:
+        """Free a slot, handing it to the next session in the rotation if any is waiting"""
+        with self._lock:
+            if not self._queues:
+                self._active -= 1
+                return
+            session, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+            waiter.state = GRANTED
+        self._signal(waiter)
+
+    @contextlib.contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        delay = retry_after(exc)
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+            # Jitter, so requests limited together do not retry together
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+    def _count_rate_limit(self, attempt: int, exc: BaseException) -> bool:
+        """Count a 429 and tell whether to retry it"""
+        if not is_rate_limited(exc):
+            return False
+        with self._lock:
+            self.rate_limited += 1
+            if attempt >= self.max_retries:
+                return False
+            self.retries += 1
+        return True
+
+    def retry(self, call: Callable[[], Any]) -> Any:
+        """Run call, retrying 429s with backoff"""
+        attempt = 0
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                if not self._count_rate_limit(attempt, e):
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    async def aretry(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of retry; call returns an awaitable"""
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                if not self._count_rate_limit(attempt, e):
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    def call(self, call: Callable[[], Any]) -> Any:
+        """Run call within a slot, retrying 429s"""
+        with self.slot():
+            return self.retry(call)
+
+    async def acall(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of call"""
+        async with self.aslot():
+            return await self.aretry(call)
+
+    def stats(self) -> Dict[str, Any]:
+        """Slots in use, queue depth, admissions, refusals and wait time"""
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": self._queued,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "waited": self.waited,
+                "rejected": self.rejected,
+                "shed": self.shed,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "avg_wait_ms": self.wait_seconds / self.waited * 1000 if self.waited else 0.0,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+            }
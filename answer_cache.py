@@ -0,0 +1,195 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, AsyncIterator, Optional
+
+from single_flight import SingleFlight
+
+# Trailing punctuation does not change what is asked
+TRAILING_PUNCTUATION = "?!.,;: "
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query for cache keys"""
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip(TRAILING_PUNCTUATION)
+
+
+class AnswerCache:
+    """LRU cache with TTL for Gemini answers, with one generation in flight per key.
+
+    Concurrent requests for a key that is being generated wait for that
+    generation and are served its answer. Answers are only stored when the
+    generation succeeds; a failed one lets the next waiter try again.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._flights: Dict[Hashable, SingleFlight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tool: Optional[str] = None) -> int:
+        """Drop all answers, or those of one tool (the first element of its keys)"""
+        with self._lock:
+            keys = [key for key in self._entries if tool is None or key[0] == tool]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def _flight(self, key: Hashable) -> SingleFlight:
+        with self._lock:
+            return self._flights.setdefault(key, SingleFlight())
+
+    def _land(self, key: Hashable, flight: SingleFlight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.release()
+
+    def _hit(self, key: Hashable, started: float) -> Optional[str]:
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+                self.hit_seconds += time.perf_counter() - started
+        return value
+
+    def _miss(self, started: float) -> None:
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += time.perf_counter() - started
+
+    def _wait(self, flight: SingleFlight) -> None:
+        with self._lock:
+            self.coalesced += 1
+        flight.wait()
+
+    async def _await(self, flight: SingleFlight) -> None:
+        with self._lock:
+            self.coalesced += 1
+        await flight.await_idle()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], str]) -> str:
+        """Cached answer for key, or compute() it; exceptions from compute are not cached"""
+        started = time.perf_counter()
+        while True:
+            value = self._hit(key, started)
+            if value is not None:
+                return value
+            flight = self._flight(key)
+            if flight.try_acquire():
+                try:
+                    value = compute()
+                    self.put(key, value)
+                    self._miss(started)
+                    return value
+                finally:
+                    self._land(key, flight)
+            self._wait(flight)
+
+    async def aget_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> str:
+        """Async version of get_or_compute; compute returns an awaitable"""
+        started = time.perf_counter()
+        while True:
+            value = self._hit(key, started)
+            if value is not None:
+                return value
+            flight = self._flight(key)
+            if flight.try_acquire():
+                try:
+                    value = await compute()
+                    self.put(key, value)
+                    self._miss(started)
+                    return value
+                finally:
+                    self._land(key, flight)
+            await self._await(flight)
+
+    def stream(self, key: Hashable, generate: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """Yield the cached answer for key as one chunk, or stream generate() and cache the result"""
+        started = time.perf_counter()
+        while True:
+            value = self._hit(key, started)
+            if value is not None:
+                yield value
+                return
+            flight = self._flight(key)
+            if flight.try_acquire():
+                try:
+                    parts = []
+                    for chunk in generate():
+                        parts.append(chunk)
+                        yield chunk
+                    self.put(key, "".join(parts))
+                    self._miss(started)
+                    return
+                finally:
+                    self._land(key, flight)
+            self._wait(flight)
+
+    async def astream(self, key: Hashable, generate: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Async version of stream"""
+        started = time.perf_counter()
+        while True:
+            value = self._hit(key, started)
+            if value is not None:
+                yield value
+                return
+            flight = self._flight(key)
+            if flight.try_acquire():
+                try:
+                    parts = []
+                    async for chunk in generate():
+                        parts.append(chunk)
+                        yield chunk
+                    self.put(key, "".join(parts))
+                    self._miss(started)
+                    return
+                finally:
+                    self._land(key, flight)
+            await self._await(flight)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate and average latency of hits and misses"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_hit_ms": self.hit_seconds / self.hits * 1000 if self.hits else 0.0,
+                "avg_miss_ms": self.miss_seconds / self.misses * 1000 if self.misses else 0.0,
+            }
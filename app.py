@@ -1,6 +1,8 @@
 import os
 import chainlit as cl
 import json
+import time
+import asyncio
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
@@ -8,16 +10,76 @@ from datetime import datetime, timedelta
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize OpenAI client (OPENAI_BASE_URL points it at another server, e.g. benchmarks.stub_llm)
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL") or None)
 
 # Import GeminiTools class
 from gemini_tools import GeminiTools
+from history import HistoryManager
+from prefetch import SpeculativePrefetcher
+from tool_calls import ToolCallAssembler
+from admission import UpstreamLimiter, UpstreamBusy, current_session, queue_listener
+from tracing import tracer, span, start_span, JsonlExporter, OtlpExporter
+from structured_log import LogWriter, process_path
+from metrics import registry as metrics_registry, MetricsExporter, stats_samples, mount as mount_metrics
+
+# JSON-lines logs written by a background thread, rotated by size (LOG_MAX_BYTES) and/or age (LOG_ROTATE_HOURS)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "0"))
+# Processes sharing a corpus (SHARED_CORPUS_DIR) may share a working directory too; each one then
+# writes and rotates its own files, named with its process id
+def log_path(path):
+    return process_path(path) if os.getenv("SHARED_CORPUS_DIR") else path
+
+log_writer = LogWriter(log_path(os.getenv("LOG_FILE", "gemini_log.jsonl")), LOG_MAX_BYTES, LOG_BACKUPS,
+                       LOG_ROTATE_HOURS * 3600, level=os.getenv("LOG_LEVEL", "DEBUG"))
+
+def log(level, message, **fields):
+    """Log an app record for the current request, also printed to the console"""
+    log_writer.write(level, "APP", message, console=True, **fields)
+
+# Trace every chat turn to a JSONL file (TRACE_FILE, empty to disable) and/or an OpenTelemetry
+# collector (OTEL_EXPORTER_OTLP_ENDPOINT); see `python -m tracing` for latency percentiles
+trace_exporters = []
+if os.getenv("TRACE_FILE", "traces.jsonl"):
+    trace_exporters.append(JsonlExporter(LogWriter(log_path(os.getenv("TRACE_FILE", "traces.jsonl")), LOG_MAX_BYTES,
+                                                   LOG_BACKUPS, LOG_ROTATE_HOURS * 3600)))
+if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+    trace_exporters.append(OtlpExporter(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")))
+# Prometheus metrics served at METRICS_PATH next to the Chainlit app (empty to disable); stage latencies,
+# tool requests, token counts and refreshes are recorded from the trace spans
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+if METRICS_PATH:
+    trace_exporters.append(MetricsExporter(metrics_registry))
+tracer.configure(trace_exporters)
+
+# Concurrency limits per upstream, with a bounded wait queue (visitors see their place in it)
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "64"))
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT", "30"))
+openai_limiter = UpstreamLimiter("openai", int(os.getenv("OPENAI_MAX_CONCURRENT", "16")),
+                                 UPSTREAM_MAX_QUEUE, UPSTREAM_MAX_WAIT)
+gemini_limiter = UpstreamLimiter("gemini", int(os.getenv("GEMINI_MAX_CONCURRENT", "16")),
+                                 UPSTREAM_MAX_QUEUE, UPSTREAM_MAX_WAIT)
 
 # Initialize GeminiTools
 gemini_tools = GeminiTools(
     google_api_key=os.getenv("GOOGLE_API_KEY"),
-    cms_url="https://cms.falkenberg.se/graphql"
+    cms_url=os.getenv("CMS_URL", "https://cms.falkenberg.se/graphql"),
+    # Gemini API host other than Google's (e.g. benchmarks.stub_llm for load tests)
+    gemini_endpoint=os.getenv("GEMINI_API_ENDPOINT") or None,
+    context_encoding=os.getenv("GEMINI_CONTEXT_ENCODING", "json"),
+    reduce_workers=int(os.getenv("REDUCE_WORKERS", "0")),
+    gemini_limiter=gemini_limiter,
+    log_writer=log_writer,
+    # Several app processes on one host share one corpus here, refreshed by one of them
+    shared_corpus_dir=os.getenv("SHARED_CORPUS_DIR") or None
+)
+
+# Keep the history sent to GPT-4o within a token budget, so long sessions do not grow every prompt
+history_manager = HistoryManager(
+    count_tokens=gemini_tools.count_tokens,
+    budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "12000"))
 )
 
 # Schedule regular refresh of events data (every 3 hours)
@@ -52,7 +114,7 @@ function_schemas = [
                 "properties": {
                     "query": {
                         "type": "string",
-                        "description": "The website-related query or question about Falkenberg tourism"
+                        "description": "The website-related query or question about Falkenberg tourism. Write it in Swedish, since the website content is in Swedish."
                     }
                 },
                 "required": ["query"]
@@ -63,10 +125,70 @@ function_schemas = [
 
 # Map function names to their implementations
 available_functions = {
-    "ask_gemini_about_events": gemini_tools.ask_gemini_about_events,
-    "ask_gemini_about_pages": gemini_tools.ask_gemini_about_pages
+    "ask_gemini_about_events": gemini_tools.aask_gemini_about_events,
+    "ask_gemini_about_pages": gemini_tools.aask_gemini_about_pages
+}
+
+# Streaming versions of the tools, for answers sent straight to the visitor
+streaming_functions = {
+    "ask_gemini_about_events": gemini_tools.astream_gemini_about_events,
+    "ask_gemini_about_pages": gemini_tools.astream_gemini_about_pages
 }
 
+# Tools whose answer needs no further reasoning: when one of them is the only tool call,
+# Gemini's answer is streamed directly to the visitor and the second GPT-4o call is skipped
+# (comma separated tool names, e.g. "ask_gemini_about_events,ask_gemini_about_pages")
+DIRECT_ANSWER_TOOLS = {name.strip() for name in os.getenv("DIRECT_ANSWER_TOOLS", "").split(",") if name.strip()}
+
+# Start the likely tool for each message while GPT-4o is still deciding which tool to call
+# (SPECULATIVE_PREFETCH=1); a wrong guess is cancelled, at the cost of one extra Gemini call
+prefetcher = None
+if os.getenv("SPECULATIVE_PREFETCH", "").lower() in ("1", "true", "yes"):
+    # A call claims the prefetch when it asks about the same dates, once its query is resolved like the prefetch's
+    prefetcher = SpeculativePrefetcher(available_functions, resolve_query=lambda query: process_date_references(query))
+
+active_sessions = metrics_registry.gauge("chat_sessions_active", "Open chat sessions")
+
+@metrics_registry.collector
+def service_metrics():
+    """Corpus size and age, upstream slots, cache and prefetch hit rates and logging, read when scraped"""
+    samples = []
+    for name, stats in gemini_tools.corpus_stats().items():
+        labels = {"corpus": name}
+        samples.append(("corpus_records", "gauge", "Records in each corpus", labels, stats["records"]))
+        samples.append(("corpus_context_tokens", "gauge", "Tokens of each corpus context sent to Gemini", labels, stats["tokens"]))
+        samples.append(("corpus_expired", "gauge", "1 if a corpus is due for a refresh", labels, int(stats["expired"])))
+        if stats["age_seconds"] is not None:
+            samples.append(("corpus_age_seconds", "gauge", "Seconds since each corpus was refreshed", labels, stats["age_seconds"]))
+    for limiter in (openai_limiter, gemini_limiter):
+        samples += stats_samples("upstream", limiter.stats(), ("admitted", "waited", "rejected", "shed", "rate_limited", "retries"),
+                                 ("active", "queued", "max_concurrent"), {"upstream": limiter.name})
+    samples += stats_samples("answer_cache", gemini_tools.answer_cache.stats(), ("hits", "misses", "coalesced"), ("entries", "hit_rate"))
+    if prefetcher:
+        samples += stats_samples("prefetch", prefetcher.stats(), ("started", "hits", "unclaimed", "window_mismatches", "wasted_seconds"),
+                                  ("hit_rate",))
+    samples += stats_samples("log", log_writer.stats(), ("written", "dropped", "rotations", "write_errors"), ("queued",))
+    return samples
+
+if METRICS_PATH:
+    from chainlit.server import app as chainlit_server
+    mount_metrics(chainlit_server, metrics_registry, METRICS_PATH)
+
+# Maximum time in seconds for a single tool call, so one slow call cannot hold back the rest
+TOOL_CALL_TIMEOUT = 60
+
+# Shown while a request waits for a free upstream slot, and when none frees up in time
+QUEUE_MESSAGE = "⏳ Många frågar just nu, du är nummer {position} i kön... / Many visitors right now, you are number {position} in the queue..."
+BUSY_MESSAGE = """Det är väldigt många som använder assistenten just nu. Försök igen om en liten stund.
+It is very busy right now. Please try again in a moment."""
+
+async def stream_completion(**kwargs):
+    """Stream a GPT-4o completion within the OpenAI concurrency limit, retrying rate limits"""
+    async with openai_limiter.aslot():
+        stream = await openai_limiter.aretry(lambda: openai_client.chat.completions.create(**kwargs))
+        async for chunk in stream:
+            yield chunk
+
 # Process query to be more specific about dates
 def process_date_references(query):
     # Get next weekend dates
@@ -82,11 +204,109 @@ def process_date_references(query):
         return f"{query} (referring to dates {next_weekend})"
     return query
 
+def parse_tool_arguments(tool_call):
+    """Parse the arguments of a tool call, making date references in the query explicit"""
+    function_args = json.loads(tool_call["function"]["arguments"])
+    
+    # Process the query to be more explicit about dates
+    if "query" in function_args:
+        function_args["query"] = process_date_references(function_args["query"])
+    return function_args
+
+async def call_tool(tool_call, prefetch=None):
+    """Run a single tool call, or await its claimed prefetch, and return its tool message
+    (None if it could not be run)"""
+    function_name = tool_call["function"]["name"]
+    
+    # Only process functions we know about
+    if function_name not in available_functions:
+        return None
+    
+    function_to_call = available_functions[function_name]
+    try:
+        # Parse arguments and call function
+        with span(f"tool.{function_name}", prefetched=prefetch is not None):
+            if prefetch is not None:
+                function_response = await asyncio.wait_for(prefetcher.result(prefetch), timeout=TOOL_CALL_TIMEOUT)
+            else:
+                function_args = parse_tool_arguments(tool_call)
+                function_response = await asyncio.wait_for(function_to_call(**function_args), timeout=TOOL_CALL_TIMEOUT)
+    except json.JSONDecodeError as e:
+        log("ERROR", f"Error parsing function arguments: {e}")
+        return None
+    except asyncio.TimeoutError:
+        function_response = f"Error calling function {function_name}: timed out after {TOOL_CALL_TIMEOUT} seconds"
+        log("ERROR", function_response)
+    except Exception as e:
+        function_response = f"Error calling function {function_name}: {str(e)}"
+        log("ERROR", function_response)
+    
+    return {
+        "tool_call_id": tool_call["id"],
+        "role": "tool",
+        "name": function_name,
+        "content": function_response
+    }
+
+async def stream_tool(tool_call, msg, on_first_chunk=None, prefetch=None):
+    """Run a single tool call, streaming its answer into msg as it is generated,
+    and return its tool message (None if it could not be run). A claimed prefetch
+    is sent as one chunk when it is done."""
+    function_name = tool_call["function"]["name"]
+    if function_name not in streaming_functions:
+        return None
+    
+    try:
+        function_args = parse_tool_arguments(tool_call)
+    except json.JSONDecodeError as e:
+        log("ERROR", f"Error parsing function arguments: {e}")
+        return None
+    
+    chunks = []
+    
+    async def stream_chunk(chunk):
+        if not chunks:
+            # Replace the loading text with the answer
+            msg.content = ""
+            await msg.send()
+            if on_first_chunk:
+                on_first_chunk()
+        chunks.append(chunk)
+        await msg.stream_token(chunk)
+    
+    async def stream_answer():
+        if prefetch is not None:
+            await stream_chunk(await prefetcher.result(prefetch))
+            return
+        async for chunk in streaming_functions[function_name](**function_args):
+            await stream_chunk(chunk)
+    
+    try:
+        with span(f"tool.{function_name}", prefetched=prefetch is not None, streamed=True):
+            await asyncio.wait_for(stream_answer(), timeout=TOOL_CALL_TIMEOUT)
+    except asyncio.TimeoutError:
+        error = f"Error calling function {function_name}: timed out after {TOOL_CALL_TIMEOUT} seconds"
+        log("ERROR", error)
+        await stream_chunk(error)
+    except Exception as e:
+        error = f"Error calling function {function_name}: {str(e)}"
+        log("ERROR", error)
+        await stream_chunk(error)
+    
+    return {
+        "tool_call_id": tool_call["id"],
+        "role": "tool",
+        "name": function_name,
+        "content": "".join(chunks)
+    }
+
 @cl.on_chat_start
 async def start_chat():
+    active_sessions.inc()
+    
     # Check if we have any events and pages data
-    events_data = gemini_tools.get_events_data()
-    pages_data = gemini_tools.get_pages_data()
+    events_data = await gemini_tools.aget_events_data()
+    pages_data = await gemini_tools.aget_pages_data()
     events_status = "active" if events_data else "unavailable"
     pages_status = "active" if pages_data else "unavailable"
     
@@ -138,21 +358,73 @@ Hur kan jag hjälpa dig idag? / How can I help you today? / Wie kann ich Ihnen h
     # Welcome message
     await cl.Message(content=welcome_message).send()
 
+@cl.on_chat_end
+async def end_chat():
+    active_sessions.dec()
+
 @cl.on_message
 async def main(message: cl.Message):
+    # Each chat turn is one trace; its trace id is the request id in the timing log
+    with span("chat_turn", new_trace=True, session=cl.user_session.get("id")) as turn:
+        await answer_message(message, turn)
+
+async def answer_message(message, turn):
     # Get message history from session
     message_history = cl.user_session.get("message_history")
     
-    # Add user message to history
+    # Add user message to history, trimming older turns to the token budget
     message_history.append({"role": "user", "content": message.content})
+    message_history = history_manager.trim(message_history)
+    turn.set(history_tokens=history_manager.history_tokens(message_history))
+    
+    # Time to first answer token and total time, logged for each answer path
+    request_start = time.perf_counter()
+    timing = {"first_token": None, "path": "without tools"}
+    
+    def mark_first_token():
+        if timing["first_token"] is None:
+            timing["first_token"] = time.perf_counter() - request_start
+            turn.set(first_token_ms=round(timing["first_token"] * 1000, 1))
+    
+    # Spans of the GPT-4o stages, ended with the error if the turn fails
+    stage_spans = []
+    
+    def start_stage(name, **attributes):
+        stage = start_span(name, **attributes)
+        stage_spans.append(stage)
+        return stage
     
     # Create empty message for streaming
     msg = cl.Message(content="")
     await msg.send()
     
+    # Queue fairly per session, and show the visitor their place while waiting for a slot
+    current_session.set(cl.user_session.get("id"))
+    queued_content = []
+    
+    async def show_queue_position(upstream, position):
+        if not queued_content:
+            queued_content.append(msg.content)
+        if position:
+            msg.content = "\n\n".join(filter(None, [queued_content[0], QUEUE_MESSAGE.format(position=position)]))
+        else:
+            msg.content = queued_content.pop()
+        await msg.update()
+    
+    # Guess the tool from the visitor's message and start it alongside the first GPT-4o call
+    # (before the queue listener is set: a speculative call waits without showing a queue position)
+    prefetch = prefetcher.start(message.content, process_date_references(message.content)) if prefetcher else None
+    
+    queue_listener.set(show_queue_position)
+    
+    # Tool calls started while the first GPT-4o call is still streaming, with their tasks
+    started_calls = []
+    
     # First call to get either a direct response or tool calls
     try:
-        stream = await openai_client.chat.completions.create(
+        first_call = start_stage("gpt4o.first_call", messages=len(message_history))
+        assemble = None
+        stream = stream_completion(
             model="gpt-4o",
             messages=message_history,
             tools=function_schemas,
@@ -161,28 +433,54 @@ async def main(message: cl.Message):
         )
         
         response_text = ""
-        tool_calls = []
+        assembler = ToolCallAssembler()
+        # A completed call to a direct-answer tool waits until it is known whether it is the only call
+        held_back = []
+        
+        def claimed(tool_call):
+            # The speculative prefetch, if it answers this call
+            return prefetch if prefetcher and prefetcher.claim(prefetch, tool_call) else None
+        
+        def start_completed(completed):
+            held_back.extend(completed)
+            if len(assembler.tool_calls) == 1 and held_back and held_back[0]["function"]["name"] in DIRECT_ANSWER_TOOLS:
+                return
+            for tool_call in held_back:
+                started_calls.append(asyncio.ensure_future(call_tool(tool_call, claimed(tool_call))))
+            held_back.clear()
         
         async for chunk in stream:
             delta = chunk.choices[0].delta
+            if "first_chunk_ms" not in first_call.attributes:
+                first_call.set(first_chunk_ms=round((time.perf_counter() - first_call.started) * 1000, 1))
             
             if delta.content:
+                mark_first_token()
                 await msg.stream_token(delta.content)
                 response_text += delta.content
                 
             elif delta.tool_calls:
-                tcchunks = delta.tool_calls
-                for tcchunk in tcchunks:
-                    if len(tool_calls) <= tcchunk.index:
-                        tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
-                    tc = tool_calls[tcchunk.index]
-                    
-                    if tcchunk.id:
-                        tc["id"] += tcchunk.id
-                    if tcchunk.function and tcchunk.function.name:
-                        tc["function"]["name"] += tcchunk.function.name
-                    if tcchunk.function and tcchunk.function.arguments:
-                        tc["function"]["arguments"] += tcchunk.function.arguments
+                if assemble is None:
+                    assemble = start_stage("tool_calls.assemble")
+                # Run each tool call as soon as its arguments are complete
+                for tcchunk in delta.tool_calls:
+                    start_completed(assembler.add(tcchunk))
+        
+        start_completed(assembler.finish())
+        tool_calls = assembler.tool_calls
+        first_call.set(tool_calls=len(tool_calls))
+        first_call.end()
+        if assemble is not None:
+            assemble.set(tool_calls=len(tool_calls))
+            assemble.end()
+        
+        # A single tool call whose answer needs no further reasoning is streamed straight to the visitor
+        direct_call = held_back[0] if held_back else None
+        direct_prefetch = claimed(direct_call) if direct_call else None
+        
+        # All tool calls are known: cancel the prefetch if none of them used it
+        if prefetcher:
+            prefetcher.settle(prefetch)
         
         # If we got a direct text response
         if response_text:
@@ -199,98 +497,125 @@ async def main(message: cl.Message):
             loading_text = "Söker information"  # "Searching for information" in Swedish
             await msg.stream_token(loading_text)
             
-            # Process each tool call
-            for tool_call in tool_calls:
-                function_name = tool_call["function"]["name"]
+            direct_answer = None
+            if direct_call:
+                direct_answer = await stream_tool(direct_call, msg, mark_first_token, direct_prefetch)
+            
+            if direct_answer:
+                tool_results = [direct_answer]
+            else:
+                if direct_call:
+                    started_calls.append(asyncio.ensure_future(call_tool(direct_call, direct_prefetch)))
                 
-                # Show loading animation by adding dots
-                await msg.stream_token(".")
+                # Wait for the tool calls, adding a loading dot as each one finishes
+                async def call_tool_with_feedback(task):
+                    result = await task
+                    await msg.stream_token(".")
+                    return result
                 
-                # Only process functions we know about
-                if function_name in available_functions:
-                    function_to_call = available_functions[function_name]
-                    try:
-                        # Parse arguments and call function
-                        function_args = json.loads(tool_call["function"]["arguments"])
-                        
-                        # Process the query to be more explicit about dates
-                        if "query" in function_args:
-                            function_args["query"] = process_date_references(function_args["query"])
-                        
-                        # Add another dot for loading animation
-                        await msg.stream_token(".")
-                        
-                        function_response = function_to_call(**function_args)
-                        
-                        # Add function response to message history
-                        message_history.append({
-                            "tool_call_id": tool_call["id"],
-                            "role": "tool",
-                            "name": function_name,
-                            "content": function_response
-                        })
-                        
-                        # Update the data status in the system message if needed
-                        if "Sorry, I couldn't retrieve any event data" in function_response:
-                            # Update the system message with current data status
-                            system_msg = message_history[0]["content"]
-                            updated_system_msg = system_msg.replace("Events data: active", 
-                                                                     "Events data: unavailable")
-                            message_history[0]["content"] = updated_system_msg
-                        
-                        if "Sorry, I couldn't retrieve any page data" in function_response:
-                            # Update the system message with current data status
-                            system_msg = message_history[0]["content"]
-                            updated_system_msg = system_msg.replace("Website data: active", 
-                                                                     "Website data: unavailable")
-                            message_history[0]["content"] = updated_system_msg
-                        
-                    except json.JSONDecodeError as e:
-                        print(f"Error parsing function arguments: {e}")
-                        continue
-                    except Exception as e:
-                        error_message = f"Error calling function {function_name}: {str(e)}"
-                        print(error_message)
-                        message_history.append({
-                            "tool_call_id": tool_call["id"],
-                            "role": "tool",
-                            "name": function_name,
-                            "content": error_message
-                        })
-            
-            # Make a second call to process the tool results
-            second_stream = await openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=message_history,
-                stream=True
-            )
-            
-            # Reset content by creating a new message
-            # msg = cl.Message(content="")
-            msg.content=""
-            await msg.send()
+                tool_results = await asyncio.gather(*(call_tool_with_feedback(task) for task in started_calls))
             
-            # Stream the final response
-            final_response = ""
-            async for chunk in second_stream:
-                if chunk.choices[0].delta.content:
-                    token = chunk.choices[0].delta.content
-                    await msg.stream_token(token)
-                    final_response += token
+            # Add function responses to message history in the original tool call order
+            for tool_result in tool_results:
+                if tool_result is None:
+                    continue
+                message_history.append(tool_result)
+                function_response = tool_result["content"]
+                
+                # Update the data status in the system message if needed
+                if "Sorry, I couldn't retrieve any event data" in function_response:
+                    # Update the system message with current data status
+                    system_msg = message_history[0]["content"]
+                    updated_system_msg = system_msg.replace("Events data: active", 
+                                                             "Events data: unavailable")
+                    message_history[0]["content"] = updated_system_msg
+                
+                if "Sorry, I couldn't retrieve any page data" in function_response:
+                    # Update the system message with current data status
+                    system_msg = message_history[0]["content"]
+                    updated_system_msg = system_msg.replace("Website data: active", 
+                                                             "Website data: unavailable")
+                    message_history[0]["content"] = updated_system_msg
             
-            # Add final response to message history
-            if final_response:
-                message_history.append({"role": "assistant", "content": final_response})
+            if direct_answer:
+                # The tool's answer already is the final response
+                timing["path"] = f"direct from {direct_answer['name']}"
+                message_history.append({"role": "assistant", "content": direct_answer["content"]})
+            else:
+                timing["path"] = "via GPT-4o"
+                # Make a second call to process the tool results
+                message_history = history_manager.trim(message_history)
+                second_call = start_stage("gpt4o.second_call", messages=len(message_history))
+                second_stream = stream_completion(
+                    model="gpt-4o",
+                    messages=message_history,
+                    stream=True
+                )
+                
+                # Reset content by creating a new message
+                # msg = cl.Message(content="")
+                msg.content=""
+                await msg.send()
+                
+                # Stream the final response
+                final_response = ""
+                async for chunk in second_stream:
+                    if chunk.choices[0].delta.content:
+                        token = chunk.choices[0].delta.content
+                        if not final_response:
+                            second_call.set(first_token_ms=round((time.perf_counter() - second_call.started) * 1000, 1))
+                        mark_first_token()
+                        await msg.stream_token(token)
+                        final_response += token
+                second_call.end()
+                
+                # Add final response to message history
+                if final_response:
+                    message_history.append({"role": "assistant", "content": final_response})
             
             # IMPORTANT: Properly finish streaming to remove the pulsating dot
             await msg.update()
+        
+        turn.set(path=timing["path"], tool_calls=len(tool_calls))
+        if timing["first_token"] is not None:
+            total = time.perf_counter() - request_start
+            log("INFO", f"Answer {timing['path']} (request {turn.trace_id}): time to first token {timing['first_token']:.2f} s, "
+                        f"total {total:.2f} s",
+                path=timing["path"], first_token_ms=round(timing["first_token"] * 1000, 1), total_ms=round(total * 1000, 1))
+        if prefetch is not None:
+            turn.set(prefetch=prefetch.tool, prefetch_hit=prefetch.claimed)
+            stats = prefetcher.stats()
+            log("INFO", f"Prefetch of {prefetch.tool}: {'hit' if prefetch.claimed else 'miss'}; "
+                        f"hit rate {stats['hit_rate']:.0%} of {stats['started']}, "
+                        f"{stats['avg_saved_ms']:.0f} ms saved per hit, {stats['unclaimed']} unclaimed "
+                        f"({stats['wasted_seconds']:.1f} s of Gemini time)",
+                prefetch=prefetch.tool, prefetch_hit=prefetch.claimed)
+    
+    except UpstreamBusy as e:
+        # No slot freed up in time: tell the visitor instead of letting the request time out
+        log("WARNING", f"Upstream busy: {str(e)}")
+        turn.set(path="busy")
+        for stage in stage_spans:
+            stage.end(e)
+        await cl.Message(content=BUSY_MESSAGE).send()
+        if prefetcher:
+            prefetcher.cancel(prefetch)
+        for task in started_calls:
+            task.cancel()
     
     except Exception as e:
         error_message = f"An error occurred: {str(e)}"
         # Create a new message with the error instead of updating
         error_msg = cl.Message(content=error_message)
         await error_msg.send()
-        print(error_message)
+        log("ERROR", error_message)
+        turn.set(path="error")
+        for stage in stage_spans:
+            stage.end(e)
+        if prefetcher:
+            prefetcher.cancel(prefetch)
+        for task in started_calls:
+            task.cancel()
     
     # Update the message history in session
     cl.user_session.set("message_history", message_history)
@@ -0,0 +1,4 @@
+"""Offline benchmarks and load tests for the Falkenberg guide.
+
+Run from the repository root, e.g. ``python -m benchmarks.concurrent_sessions``.
+"""
@@ -0,0 +1,66 @@
+"""Time to first token and total time of a tool answer, rephrased by GPT-4o
+vs. streamed directly from Gemini.
+
+Gemini is replaced by a stub that streams its answer over a fixed latency,
+and the second GPT-4o call by a stream with a fixed time to first token and
+duration. The numbers show how the two paths in app.py compose; app.py logs
+the real ones for every answer.
+
+    python -m benchmarks.answer_latency --gemini-latency 4 --gpt-first-token 0.6 --gpt-duration 3
+"""
+import time
+import asyncio
+import argparse
+
+from benchmarks.stubs import OfflineGeminiTools, StubModel
+
+ANSWER = " ".join(["**Evenemang:** - **Konsert på torget**: sommarkonsert med lokala band."] * 20)
+
+
+async def stub_gpt_stream(text: str, first_token: float, duration: float, chunks: int = 40):
+    await asyncio.sleep(first_token)
+    size = max(len(text) // chunks, 1)
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+        await asyncio.sleep(duration / chunks)
+
+
+async def via_gpt(tools, query: str, first_token: float, duration: float):
+    start = time.perf_counter()
+    answer = await tools.aask_gemini_about_events(query)
+    first = None
+    async for _ in stub_gpt_stream(answer, first_token, duration):
+        first = first if first is not None else time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def direct(tools, query: str):
+    start = time.perf_counter()
+    first = None
+    async for _ in tools.astream_gemini_about_events(query):
+        first = first if first is not None else time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gemini-latency", type=float, default=4.0, help="Stub Gemini generation time in seconds")
+    parser.add_argument("--chunks", type=int, default=20, help="Chunks Gemini streams its answer in")
+    parser.add_argument("--gpt-first-token", type=float, default=0.6, help="Second GPT-4o call time to first token")
+    parser.add_argument("--gpt-duration", type=float, default=3.0, help="Second GPT-4o call streaming time")
+    args = parser.parse_args()
+
+    tools = OfflineGeminiTools(events=500, pages=50, latency=0)
+    tools.model = StubModel(args.gemini_latency, text=ANSWER, chunks=args.chunks)
+    query = "Vad händer i helgen?"
+
+    for label, run in (("Gemini + GPT-4o rephrase", via_gpt(tools, query, args.gpt_first_token, args.gpt_duration)),
+                       ("Gemini streamed directly", direct(tools, query))):
+        # Both paths must generate, not reuse the other's cached answer
+        tools.answer_cache.invalidate()
+        first, total = asyncio.run(run)
+        print(f"{label:26} time to first token {first:5.2f} s, total {total:5.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""Drive many simulated Chainlit chat sessions against the running app and report
+throughput, time to first token and tail latency.
+
+Each session connects over the Chainlit websocket (socket.io, Chainlit 1.x
+and later), then sends `--turns` questions one after another, waiting
+`--think` seconds between them. A turn lasts until Chainlit reports its task
+ended; its first token is the first streamed token of the answer. Turns
+answered with the busy message (no upstream slot freed up in time) or an
+error are counted apart, and so are turns that saw a queue position. With
+`--expect TEXT` a turn whose answer does not contain TEXT counts as failed
+(unexpected), e.g. the stubs' ANSWER_MARKER to check that the answers
+really came through GPT-4o and Gemini.
+
+With the app pointed at the stubs of benchmarks.stub_llm, e.g.
+
+    python -m benchmarks.stub_llm --first-token 0.5 --tokens-per-second 80 --cms-events 2000 --cms-pages 400
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8766/v1 GOOGLE_API_KEY=stub \\
+        GEMINI_API_ENDPOINT=http://127.0.0.1:8767 CMS_URL=http://127.0.0.1:8765/graphql \\
+        chainlit run app.py --headless --port 8000
+    python -m benchmarks.chat_load --url http://127.0.0.1:8000 --sessions 10,50,100,200 --turns 3 --expect Stub-svar:
+
+prints one row per concurrency level.
+"""
+import os
+import ssl
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from tracing import percentile
+
+QUESTIONS = [
+    "Vad händer i Falkenberg i helgen?",
+    "Finns det några konserter i juli?",
+    "Vilka restauranger finns vid Skrea strand?",
+    "Vad har museet för öppettider?",
+    "What events are there for families this weekend?",
+    "Var kan man fiska lax i Ätran?",
+    "Tips på vandringsleder nära Falkenberg?",
+    "Vilka festivaler är det i sommar?",
+]
+
+# Texts of app.py's busy message, error messages and queue position, to classify turns
+BUSY_MARKER = "Försök igen om en liten stund"
+ERROR_PREFIX = "An error occurred"
+QUEUE_MARKER = "i kön"
+
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _mask(data: bytes, key: bytes) -> bytes:
+    size = len(data)
+    masked = int.from_bytes(data, "big") ^ int.from_bytes((key * (size // 4 + 1))[:size], "big")
+    return masked.to_bytes(size, "big")
+
+
+class WebSocket:
+    """Minimal websocket client (RFC 6455 text frames), enough for socket.io"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, url: str, headers: Optional[Dict[str, str]] = None) -> "WebSocket":
+        parts = urlsplit(url)
+        secure = parts.scheme in ("wss", "https")
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or (443 if secure else 80),
+                                                       ssl=ssl.create_default_context() if secure else None)
+        key = base64.b64encode(os.urandom(16)).decode()
+        lines = [f"GET {parts.path}{'?' + parts.query if parts.query else ''} HTTP/1.1", f"Host: {parts.netloc}",
+                 "Upgrade: websocket", "Connection: Upgrade", f"Sec-WebSocket-Key: {key}",
+                 "Sec-WebSocket-Version: 13"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("utf-8"))
+        response = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        status, *header_lines = response.split("\r\n")
+        accept = base64.b64encode(hashlib.sha1((key + _WEBSOCKET_GUID).encode()).digest()).decode()
+        received = {line.split(":", 1)[0].strip().lower(): line.split(":", 1)[1].strip()
+                    for line in header_lines if ":" in line}
+        if status.split(" ")[1:2] != ["101"] or received.get("sec-websocket-accept") != accept:
+            writer.close()
+            raise ConnectionError(f"Websocket upgrade refused: {status}")
+        return cls(reader, writer)
+
+    def _send_frame(self, opcode: int, payload: bytes) -> None:
+        # Client frames are masked; the whole frame is written at once so frames never interleave
+        header = bytearray([0x80 | opcode])
+        if len(payload) < 126:
+            header.append(0x80 | len(payload))
+        elif len(payload) < 65536:
+            header.append(0x80 | 126)
+            header += len(payload).to_bytes(2, "big")
+        else:
+            header.append(0x80 | 127)
+            header += len(payload).to_bytes(8, "big")
+        key = os.urandom(4)
+        self.writer.write(bytes(header) + key + _mask(payload, key))
+
+    async def send(self, text: str) -> None:
+        self._send_frame(0x1, text.encode("utf-8"))
+        await self.writer.drain()
+
+    async def recv(self) -> Optional[str]:
+        """The next text message, or None when the connection closes"""
+        fragments = []
+        try:
+            while True:
+                head = await self.reader.readexactly(2)
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await self.reader.readexactly(2), "big")
+                elif length == 127:
+                    length = int.from_bytes(await self.reader.readexactly(8), "big")
+                key = await self.reader.readexactly(4) if head[1] & 0x80 else None
+                payload = await self.reader.readexactly(length)
+                if key:
+                    payload = _mask(payload, key)
+                if opcode == 0x8:
+                    return None
+                if opcode == 0x9:
+                    self._send_frame(0xA, payload)
+                    continue
+                if opcode == 0xA:
+                    continue
+                fragments.append(payload)
+                if head[0] & 0x80:
+                    return b"".join(fragments).decode("utf-8")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    async def close(self) -> None:
+        try:
+            self._send_frame(0x8, b"")
+            self.writer.close()
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+class TurnResult:
+    __slots__ = ("outcome", "latency", "first_token", "queued", "answer")
+
+    def __init__(self, outcome: str, latency: float, first_token: Optional[float], queued: bool, answer: str = ""):
+        # ok, busy, error, unexpected, timeout or disconnected
+        self.outcome = outcome
+        self.latency = latency
+        self.first_token = first_token
+        self.queued = queued
+        self.answer = answer
+
+
+class ChainlitSession:
+    """One visitor: a socket.io connection to Chainlit that sends questions and times the answers"""
+
+    def __init__(self, base_url: str, socket_path: str = "/ws/socket.io"):
+        parts = urlsplit(base_url)
+        scheme = "wss" if parts.scheme == "https" else "ws"
+        self.url = f"{scheme}://{parts.netloc}{socket_path.rstrip('/')}/?EIO=4&transport=websocket"
+        self.session_id = str(uuid.uuid4())
+        self.thread_id = str(uuid.uuid4())
+        self.events: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+        self.ws: Optional[WebSocket] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def connect(self, timeout: float) -> None:
+        # Chainlit 1.x reads the session from headers, later versions from the socket.io auth payload
+        headers = {"X-Chainlit-Client-Type": "webapp", "X-Chainlit-Session-Id": self.session_id,
+                   "X-Chainlit-Thread-Id": self.thread_id, "user-env": "{}"}
+        auth = {"clientType": "webapp", "sessionId": self.session_id, "threadId": self.thread_id, "userEnv": "{}"}
+        self.ws = await asyncio.wait_for(WebSocket.connect(self.url, headers), timeout)
+        opened = await asyncio.wait_for(self.ws.recv(), timeout)
+        if not opened or not opened.startswith("0"):
+            raise ConnectionError(f"No engine.io handshake: {opened!r}")
+        await self.ws.send("40" + json.dumps(auth))
+        self._reader = asyncio.ensure_future(self._read())
+        name, data = await asyncio.wait_for(self.events.get(), timeout)
+        if name != "connect":
+            raise ConnectionError(f"Chainlit refused the session: {data!r}")
+        await self.emit("connection_successful")
+
+    async def emit(self, event: str, *data: Any) -> None:
+        await self.ws.send("42" + json.dumps([event, *data], ensure_ascii=False))
+
+    async def _read(self) -> None:
+        while True:
+            packet = await self.ws.recv()
+            if packet is None or packet.startswith("41"):
+                self.events.put_nowait(("disconnect", None))
+                return
+            if packet == "2":
+                # engine.io ping from the server
+                await self.ws.send("3")
+            elif packet.startswith("40"):
+                self.events.put_nowait(("connect", packet[2:]))
+            elif packet.startswith("44"):
+                self.events.put_nowait(("connect_error", packet[2:]))
+            elif packet.startswith("42"):
+                # Strip the ack id, if any, before the event array
+                event = json.loads(packet[2:].lstrip("0123456789"))
+                self.events.put_nowait((event[0], event[1] if len(event) > 1 else None))
+
+    async def ask(self, question: str, timeout: float, expect: str = "") -> TurnResult:
+        # Drop what arrived between turns (e.g. the welcome message)
+        while not self.events.empty():
+            self.events.get_nowait()
+        message = {"id": str(uuid.uuid4()), "threadId": self.thread_id, "name": "User", "type": "user_message",
+                   "output": question, "content": question,
+                   "createdAt": datetime.now(timezone.utc).isoformat()}
+        sent = time.perf_counter()
+        await self.emit("client_message", {"message": message, "fileReferences": []})
+        outcome, first_token, queued = "ok", None, False
+        tokens, texts = [], []
+        while True:
+            try:
+                name, data = await asyncio.wait_for(self.events.get(), max(sent + timeout - time.perf_counter(), 0))
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                break
+            if name == "stream_token":
+                if first_token is None:
+                    first_token = time.perf_counter() - sent
+                if isinstance(data, dict):
+                    tokens.append(data.get("token") or "")
+            elif name in ("new_message", "update_message") and isinstance(data, dict):
+                text = data.get("output") or data.get("content") or ""
+                texts.append(text)
+                if BUSY_MARKER in text:
+                    outcome = "busy"
+                elif text.startswith(ERROR_PREFIX):
+                    outcome = "error"
+                elif QUEUE_MARKER in text:
+                    queued = True
+            elif name == "task_end":
+                break
+            elif name == "disconnect":
+                outcome = "disconnected"
+                break
+        latency = time.perf_counter() - sent
+        # The last message text is the whole answer; streamed tokens cover apps that never send it
+        answer = next((text for text in reversed(texts) if text and QUEUE_MARKER not in text), "") or "".join(tokens)
+        if outcome == "ok" and expect and expect not in answer and expect not in "".join(tokens):
+            outcome = "unexpected"
+        return TurnResult(outcome, latency, first_token, queued, answer)
+
+    async def close(self) -> None:
+        if self._reader:
+            self._reader.cancel()
+        if self.ws:
+            await self.ws.close()
+
+
+async def run_session(args, delay: float, rng: random.Random, results: List[TurnResult], failures: List[str]) -> None:
+    await asyncio.sleep(delay)
+    session = ChainlitSession(args.url, args.socket_path)
+    try:
+        await session.connect(args.timeout)
+        for turn in range(args.turns):
+            if turn:
+                await asyncio.sleep(args.think)
+            result = await session.ask(rng.choice(QUESTIONS), args.timeout, args.expect)
+            results.append(result)
+            if result.outcome == "disconnected":
+                break
+    except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+        failures.append(f"{type(e).__name__}: {e}")
+    finally:
+        await session.close()
+
+
+async def run_level(args, sessions: int) -> Dict[str, Any]:
+    rng = random.Random(sessions)
+    results: List[TurnResult] = []
+    failures: List[str] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(args, args.ramp * i / sessions, random.Random(rng.random()), results, failures)
+                           for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    ok = [r for r in results if r.outcome == "ok"]
+    latencies = sorted(r.latency for r in ok)
+    first_tokens = sorted(r.first_token for r in ok if r.first_token is not None)
+    return {
+        "sessions": sessions,
+        "connect_failures": failures,
+        "turns": len(results),
+        "ok": len(ok),
+        "busy": sum(r.outcome == "busy" for r in results),
+        "failed": sum(r.outcome in ("error", "unexpected", "timeout", "disconnected") for r in results),
+        "unexpected": [r.answer for r in results if r.outcome == "unexpected"],
+        "queued": sum(r.queued for r in results),
+        "turns_per_s": len(ok) / elapsed if elapsed else 0.0,
+        "first_token": [percentile(first_tokens, f) if first_tokens else float("nan") for f in (0.5, 0.95, 0.99)],
+        "latency": [percentile(latencies, f) if latencies else float("nan") for f in (0.5, 0.95, 0.99)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the Chainlit app")
+    parser.add_argument("--socket-path", default="/ws/socket.io")
+    parser.add_argument("--sessions", default="10,50,100", help="Comma separated numbers of concurrent sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Questions per session")
+    parser.add_argument("--think", type=float, default=2.0, help="Seconds between a session's turns")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Seconds over which the sessions connect")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds before a turn counts as timed out")
+    parser.add_argument("--expect", default="", help="Text every answer must contain (e.g. the stubs' Stub-svar:)")
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8} {'turns':>6} {'ok':>6} {'busy':>5} {'failed':>6} {'queued':>6} {'turns/s':>8} "
+          f"{'ttft p50':>9} {'p95':>6} {'p99':>6} {'latency p50':>12} {'p95':>6} {'p99':>6}")
+    for sessions in [int(n) for n in args.sessions.split(",") if n.strip()]:
+        level = asyncio.run(run_level(args, sessions))
+        print(f"{sessions:8} {level['turns']:6} {level['ok']:6} {level['busy']:5} {level['failed']:6} "
+              f"{level['queued']:6} {level['turns_per_s']:8.2f} "
+              f"{level['first_token'][0]:9.2f} {level['first_token'][1]:6.2f} {level['first_token'][2]:6.2f} "
+              f"{level['latency'][0]:12.2f} {level['latency'][1]:6.2f} {level['latency'][2]:6.2f}")
+        if level["connect_failures"]:
+            print(f"         {len(level['connect_failures'])} sessions failed to connect, "
+                  f"e.g. {level['connect_failures'][0]}")
+        if level["unexpected"]:
+            print(f"         {len(level['unexpected'])} answers without {args.expect!r}, "
+                  f"e.g. {level['unexpected'][0][:200]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Startup time of GeminiTools with and without an on-disk corpus snapshot.
+
+The CMS is simulated with synthetic payloads and a fixed download latency.
+Without a snapshot, startup fetches and reduces both corpora before serving;
+with one, the snapshot is loaded and no refresh is needed while it is fresh.
+
+    python -m benchmarks.cold_start --events 10000 --pages 2000 --cms-latency 5
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from benchmarks.stubs import OfflineGeminiTools
+from benchmarks.synthetic import generate_events, generate_pages
+
+
+def timed_start(events, pages, snapshot_dir, cms_latency):
+    start = time.perf_counter()
+    tools = OfflineGeminiTools(events=events, pages=pages, latency=0,
+                               snapshot_dir=snapshot_dir, cms_latency=cms_latency)
+    return time.perf_counter() - start, tools
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--cms-latency", type=float, default=0.0, help="Simulated CMS download time per fetch in seconds")
+    args = parser.parse_args()
+
+    snapshot_dir = tempfile.mkdtemp(prefix="corpus-snapshots-")
+    try:
+        # Payload generation is not part of startup, so time only the constructor
+        events, pages = generate_events(args.events), generate_pages(args.pages)
+        cold, _ = timed_start(events, pages, snapshot_dir, args.cms_latency)
+        warm, tools = timed_start(events, pages, snapshot_dir, args.cms_latency)
+        size = sum(os.path.getsize(os.path.join(snapshot_dir, f)) for f in os.listdir(snapshot_dir))
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    print(f"Corpus: {len(tools.events_cache['data'])} events, {len(tools.pages_cache['data'])} pages, "
+          f"snapshots {size / 1e6:.1f} MB")
+    print(f"Cold start without snapshot: {cold:7.3f} s")
+    print(f"Cold start with snapshot:    {warm:7.3f} s ({cold / warm:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
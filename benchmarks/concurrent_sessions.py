@@ -0,0 +1,55 @@
+"""Load test: N chat sessions asking a tool question at the same time.
+
+Gemini is replaced by a stub with a fixed latency. The blocking path calls
+ask_gemini_about_* from the event loop, as app.py used to, so sessions queue
+up behind each other. The async path awaits aask_gemini_about_* and should
+finish N sessions in about the time of one.
+
+    python -m benchmarks.concurrent_sessions --sessions 20 --latency 1.0
+"""
+import time
+import asyncio
+import argparse
+
+from benchmarks.stubs import OfflineGeminiTools
+
+
+async def run_blocking(tools, sessions: int) -> float:
+    async def session(i):
+        # Synchronous call inside a coroutine blocks every other session
+        return tools.ask_gemini_about_events(f"Vad händer i helgen? ({i})")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    return time.perf_counter() - start
+
+
+async def run_async(tools, sessions: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(tools.aask_gemini_about_events(f"Vad händer i helgen? ({i})")
+                           for i in range(sessions)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=1.0, help="Stub Gemini latency in seconds")
+    parser.add_argument("--events", type=int, default=500)
+    args = parser.parse_args()
+
+    # Every session asks a different question, and no answers are cached between runs
+    tools = OfflineGeminiTools(events=args.events, pages=50, latency=args.latency)
+    tools.answer_cache.max_entries = 0
+
+    single = asyncio.run(run_async(tools, 1))
+    blocking = asyncio.run(run_blocking(tools, args.sessions))
+    concurrent = asyncio.run(run_async(tools, args.sessions))
+
+    print(f"1 session:                 {single:6.2f} s")
+    print(f"{args.sessions} sessions, blocking:    {blocking:6.2f} s ({blocking / single:.1f}x single)")
+    print(f"{args.sessions} sessions, async:       {concurrent:6.2f} s ({concurrent / single:.1f}x single)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Which Gemini requests reuse a cached corpus prefix, against a local stand-in.
+
+Page queries that match no passage send the whole pages corpus. With a
+cached-content handle per corpus version, they only send the question.
+Changing the corpus creates a handle for the new version and deletes the
+old one.
+
+    python -m benchmarks.context_caching --pages 500
+"""
+import argparse
+
+from benchmarks.stubs import OfflineGeminiTools
+
+# Words that are in no synthetic page, so these fall back to the whole corpus
+FALLBACK_QUERIES = ["Kan jag ta med hunden på tåget?", "Finns det parkering för husbilar?"]
+MATCHING_QUERIES = ["restauranger vid Skrea strand"]
+
+
+def ask_all(tools, queries):
+    for query in queries:
+        tools.ask_gemini_about_pages(query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=500)
+    args = parser.parse_args()
+
+    tools = OfflineGeminiTools(events=0, pages=args.pages, latency=0)
+    backend = tools.cache_backend
+    print(f"Version {tools.get_pages_corpus().version}: handles created {[h.name for h in backend.created]}")
+    ask_all(tools, FALLBACK_QUERIES + MATCHING_QUERIES)
+
+    # An editor changes a page; the next full sync builds a new corpus version
+    tools._pages[0]["title"] += " (uppdaterad)"
+    tools.pages_cache["sync"].last_full_sync = 0
+    tools.refresh_pages_data()
+    print(f"Version {tools.get_pages_corpus().version}: handles created {[h.name for h in backend.created]}, "
+          f"deleted {backend.deleted}")
+    ask_all(tools, FALLBACK_QUERIES)
+
+    print()
+    print(f"{'request':8} {'cache handle':20} {'prompt tokens sent':>18}")
+    for i, (handle, prompt) in enumerate(backend.requests, 1):
+        print(f"{i:<8} {handle or '-':20} {tools.count_tokens(prompt):18}")
+    corpus_tokens = tools.count_tokens(backend.created[-1].contents)
+    print(f"\nCached prefix: {corpus_tokens} tokens, no longer sent with each fallback query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Prompt tokens per context encoding on a fixed synthetic corpus, and
+optionally Gemini latency per encoding.
+
+    python -m benchmarks.context_encoding --events 2000 --pages 500
+    GOOGLE_API_KEY=... python -m benchmarks.context_encoding --live --repeat 3
+"""
+import os
+import time
+import argparse
+import statistics
+from datetime import date, timedelta
+
+from context_encoding import CONTEXT_ENCODERS
+from benchmarks.stubs import OfflineGeminiTools
+
+PAGE_QUERY = "restauranger och bad vid Skrea strand"
+
+
+def events_query() -> str:
+    start = date.today() + timedelta(days=7)
+    return f"Vad händer {start.isoformat()} to {(start + timedelta(days=13)).isoformat()}?"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--live", action="store_true", help="Measure latency against Gemini (needs GOOGLE_API_KEY)")
+    parser.add_argument("--repeat", type=int, default=3, help="Gemini calls per encoding and tool with --live")
+    args = parser.parse_args()
+
+    tools = OfflineGeminiTools(events=args.events, pages=args.pages, latency=0)
+    events, pages = tools.get_events_corpus(), tools.get_pages_corpus()
+    if args.live:
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        tools.model = genai.GenerativeModel(model_name="gemini-2.0-flash",
+                                            generation_config={"temperature": 0.2, "max_output_tokens": 1024})
+
+    query = events_query()
+    print(f"{len(events)} events, {len(pages)} pages; events query {query!r}, pages query {PAGE_QUERY!r}")
+    print(f"{'encoding':16} {'events':>8} {'pages':>8} {'all events':>11} {'all pages':>10}  (prompt tokens)")
+    for encoding in CONTEXT_ENCODERS:
+        counts = [
+            tools.count_tokens(tools._build_events_prompt(query, events, encoding).full),
+            tools.count_tokens(tools._build_pages_prompt(PAGE_QUERY, pages, encoding).full),
+            tools.count_tokens(tools._corpus_context(events, encoding)[0]),
+            tools.count_tokens(tools._corpus_context(pages, encoding)[0]),
+        ]
+        line = f"{encoding:16} {counts[0]:8} {counts[1]:8} {counts[2]:11} {counts[3]:10}"
+        if args.live:
+            latencies = []
+            for ask, text in ((tools.ask_gemini_about_events, query), (tools.ask_gemini_about_pages, PAGE_QUERY)):
+                for _ in range(args.repeat):
+                    tools.answer_cache.invalidate()
+                    start = time.perf_counter()
+                    ask(text, encoding)
+                    latencies.append(time.perf_counter() - start)
+            line += f"  median Gemini latency {statistics.median(latencies):.2f} s"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
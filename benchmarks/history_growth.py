@@ -0,0 +1,52 @@
+"""Prompt tokens per turn of a long chat session, with and without the
+token-budgeted history trimming of app.py.
+
+Every turn is a question answered through a tool call with a full Gemini
+answer as the tool result, as in app.py main().
+
+    python -m benchmarks.history_growth --turns 200 --budget 12000
+"""
+import argparse
+
+from history import HistoryManager
+from benchmarks.stubs import OfflineGeminiTools
+
+TOOL_RESULT = " ".join(["- **Konsert på torget**: sommarkonsert med lokala band. Datum: 2025-07-05. "
+                        "Plats: Stortorget. URI: /evenemang/konsert-pa-torget/"] * 30)
+
+
+def simulate(turns: int, history_manager, count_tokens):
+    history = [{"role": "system", "content": "You are a helpful tourism assistant for Falkenbergs kommun. " * 20}]
+    sizes = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"Vad händer i Falkenberg vecka {turn % 52 + 1}?"})
+        if history_manager:
+            history = history_manager.trim(history)
+        call_id = f"call_{turn}"
+        history.append({"role": "assistant", "tool_calls": [{"id": call_id, "type": "function", "function": {
+            "name": "ask_gemini_about_events", "arguments": '{"query": "evenemang"}'}}]})
+        history.append({"tool_call_id": call_id, "role": "tool", "name": "ask_gemini_about_events",
+                        "content": TOOL_RESULT})
+        if history_manager:
+            history = history_manager.trim(history)
+        # Size of the second completion call, the larger of the two
+        sizes.append(sum(count_tokens(m.get("content") or "") for m in history))
+        history.append({"role": "assistant", "content": TOOL_RESULT[:800]})
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=12000)
+    args = parser.parse_args()
+
+    count_tokens = OfflineGeminiTools(events=0, pages=0, latency=0).count_tokens
+    unbounded = simulate(args.turns, None, count_tokens)
+    bounded = simulate(args.turns, HistoryManager(count_tokens, budget=args.budget), count_tokens)
+    for turn in sorted({1, 5, 10, 25, 50, 100, args.turns} & set(range(1, args.turns + 1))):
+        print(f"turn {turn:4}: unbounded {unbounded[turn - 1]:8} tokens, trimmed {bounded[turn - 1]:6} tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Peak memory of a full events refresh, buffered vs. streamed page by page.
+
+Each mode runs in its own process against the local stub GraphQL server:
+
+- buffered: the whole connection in one response, parsed with response.json()
+  and serialized again to count tokens, as refreshes used to work
+- streaming: GeminiTools.refresh_events_data, which reduces each page of
+  CMS_PAGE_SIZE nodes as it arrives and drops the raw nodes
+
+    python -m benchmarks.ingest_memory --events 10000
+"""
+import os
+import sys
+import json
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+
+from benchmarks.stub_cms import StubCMS
+from benchmarks.stubs import StubModel
+
+# Nothing listens here, so constructing GeminiTools does not sync anything
+UNREACHABLE_CMS = "http://127.0.0.1:9/graphql"
+
+
+def _tools():
+    from gemini_tools import GeminiTools
+
+    log_file = os.path.join(tempfile.gettempdir(), "gemini_benchmark_log.jsonl")
+    tools = GeminiTools(google_api_key="offline", cms_url=UNREACHABLE_CMS, log_file=log_file, snapshot_dir=None)
+    tools.model = StubModel(0)
+    return tools
+
+
+def run_buffered(tools, url: str, count: int) -> int:
+    import requests
+
+    response = requests.post(
+        url,
+        json={"query": tools.EVENTS_QUERY, "variables": {"first": count, "after": None, "where": {}}},
+        headers={"Content-Type": "application/json"},
+        timeout=300
+    )
+    events = response.json()["data"]["allEvent"]["nodes"]
+    tools.count_tokens(json.dumps(events, ensure_ascii=False))
+    reduced = tools.process_events(events)
+    tools.count_tokens(json.dumps(reduced, ensure_ascii=False))
+    return len(reduced)
+
+
+def run_streaming(tools, url: str, count: int) -> int:
+    tools.cms_url = url
+    tools.refresh_events_data()
+    return len(tools.events_cache["data"])
+
+
+def child(mode: str, url: str, count: int) -> None:
+    tools = _tools()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    records = (run_buffered if mode == "buffered" else run_streaming)(tools, url, count)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux
+    print(json.dumps({"records": records, "peak": peak,
+                      "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--child", choices=("buffered", "streaming"), help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.url, args.events)
+        return
+
+    # Allow the buffered mode to fetch everything in a single response
+    stub = StubCMS(args.events, 0, max_page_size=args.events).start()
+    try:
+        print(f"Full refresh of {args.events} events")
+        for mode in ("buffered", "streaming"):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.ingest_memory", "--events", str(args.events),
+                 "--child", mode, "--url", stub.url],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:10} {result['records']:6} records  peak heap {result['peak'] / 1e6:7.1f} MB  "
+                  f"max RSS {result['maxrss'] / 1e6:7.1f} MB")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
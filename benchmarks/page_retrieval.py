@@ -0,0 +1,42 @@
+"""Prompt size and search latency of the BM25 page index vs. the full pages context.
+
+    python -m benchmarks.page_retrieval --pages 2000
+"""
+import json
+import time
+import argparse
+
+from benchmarks.stubs import OfflineGeminiTools
+from gemini_tools import PAGE_PASSAGES_TOP_K
+
+QUERIES = [
+    "restauranger vid Skrea strand",
+    "sagostund för barn på biblioteket",
+    "laxfiske i Ätran",
+    "guidad tur på museum",
+    "cykel och vandring längs havet",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--top-k", type=int, default=PAGE_PASSAGES_TOP_K)
+    args = parser.parse_args()
+
+    tools = OfflineGeminiTools(events=0, pages=args.pages, latency=0)
+    corpus = tools.get_pages_corpus()
+    index = corpus.index
+    print(f"{len(corpus)} pages, {len(index)} passages, {len(index.postings)} terms")
+    print(f"Full reduced context: {corpus.reduced_tokens} tokens")
+
+    for query in QUERIES:
+        start = time.perf_counter()
+        passages = index.search_context(query, args.top_k) or []
+        elapsed = (time.perf_counter() - start) * 1000
+        tokens = tools.count_tokens(json.dumps(passages, ensure_ascii=False))
+        print(f"{query!r:45} {len(passages)} passages, {tokens:6} tokens, {elapsed:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
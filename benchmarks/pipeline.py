@@ -0,0 +1,200 @@
+"""Time, allocations and peak memory of each stage of the GeminiTools data
+pipeline on synthetic CMS payloads, with saved baselines to compare commits.
+
+Each stage runs over the whole synthetic corpus. It is timed over several
+rounds, reporting the best and median round, and then run once more under
+tracemalloc for the peak memory above its input and the memory blocks and
+bytes its result keeps. Fetches go over HTTP to the local stub CMS.
+
+    python -m benchmarks.pipeline --events 2000 --pages 400 --save
+    python -m benchmarks.pipeline --events 2000 --pages 400 --compare --threshold 15
+
+--save and --compare default to benchmarks/baselines/pipeline.json; --compare
+exits with status 1 when a stage's median time regressed by more than the
+threshold percentage. Baselines depend on the machine, so none is committed:
+save one on the machine that runs the comparison.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from gemini_tools import GeminiTools
+from cms_sync import CorpusSync
+from html_reduce import extract_texts
+from record_store import encode_records
+from benchmarks.stub_cms import StubCMS
+from benchmarks.stubs import StubModel
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "pipeline.json")
+
+QUERIES = ["Vad händer i helgen?", "restauranger vid Skrea strand", "Öppettider för museet", "Konserter i juli"]
+
+
+def build_sync(tools: GeminiTools, nodes: List[Dict[str, Any]], sync_node) -> CorpusSync:
+    sync = CorpusSync()
+    run = sync.begin(True, time.time())
+    run.merge(nodes, tools._batch_reducer(sync_node), tools.count_tokens)
+    run.finish()
+    return sync
+
+
+def stages(tools: GeminiTools, events: List[Dict[str, Any]], pages: List[Dict[str, Any]]
+           ) -> List[Tuple[str, int, Callable[[], Any]]]:
+    """(name, items, function) of each stage, with the inputs each stage needs prepared up front"""
+    event_texts = extract_texts([event.get("content") or "" for event in events])
+    page_texts = extract_texts([page.get("content") or "" for page in pages])
+    schedules = [event.get("acfGroupEvent") or {} for event in events]
+    events_sync = build_sync(tools, events, tools._sync_event)
+    pages_sync = build_sync(tools, pages, tools._sync_page)
+    events_corpus = tools.build_events_corpus(events_sync)
+    pages_corpus = tools.build_pages_corpus(pages_sync)
+    event_records, page_records = events_sync.records(), pages_sync.records()
+    events_context = encode_records(event_records)
+    contents = [node.get("content") or "" for node in events + pages]
+
+    return [
+        ("fetch_events_data", len(events), tools.fetch_events_data),
+        ("fetch_pages_data", len(pages), tools.fetch_pages_data),
+        ("clean_html", len(contents), lambda: [tools.clean_html(content) for content in contents]),
+        ("format_dates", len(events),
+         lambda: [tools.format_dates(acf.get("occasions"), acf.get("rcrRules")) for acf in schedules]),
+        ("reduce_event", len(events),
+         lambda: [tools.reduce_event(event, text) for event, text in zip(events, event_texts)]),
+        ("reduce_page", len(pages),
+         lambda: [tools.reduce_page(page, text) for page, text in zip(pages, page_texts)]),
+        ("json_serialize", len(event_records) + len(page_records),
+         lambda: (encode_records(event_records), encode_records(page_records))),
+        ("count_tokens", len(event_records), lambda: tools.count_tokens(events_context)),
+        ("build_events_corpus", len(events), lambda: tools.build_events_corpus(events_sync)),
+        ("build_pages_corpus", len(pages), lambda: tools.build_pages_corpus(pages_sync)),
+        ("events_prompt", len(QUERIES),
+         lambda: [tools._build_events_prompt(query, events_corpus) for query in QUERIES]),
+        ("pages_prompt", len(QUERIES),
+         lambda: [tools._build_pages_prompt(query, pages_corpus) for query in QUERIES]),
+    ]
+
+
+def measure(function: Callable[[], Any], rounds: int) -> Dict[str, float]:
+    times = []
+    for _ in range(rounds):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    result = function()
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    kept_blocks = sys.getallocatedblocks() - blocks_before
+    del result
+    return {
+        "best_ms": min(times) * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "peak_kb": peak / 1024,
+        "kept_kb": kept / 1024,
+        "kept_blocks": kept_blocks,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Print the change of each stage against a baseline; True if any stage regressed"""
+    meta = baseline["meta"]
+    print(f"\nAgainst baseline of {meta['commit']} ({meta['created']}, {meta['events']} events, "
+          f"{meta['pages']} pages):")
+    if (meta["events"], meta["pages"]) != (results["meta"]["events"], results["meta"]["pages"]):
+        print("  (corpus sizes differ from the baseline, the comparison is not meaningful)")
+    regressed = False
+    print(f"{'stage':22} {'median ms':>10} {'baseline':>10} {'change':>8} {'peak KiB':>10} {'baseline':>10}")
+    for name, stage in results["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            print(f"{name:22} {stage['median_ms']:10.2f} {'-':>10}")
+            continue
+        change = (stage["median_ms"] / base["median_ms"] - 1) * 100 if base["median_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{name:22} {stage['median_ms']:10.2f} {base['median_ms']:10.2f} {change:+7.1f}% "
+              f"{stage['peak_kb']:10.0f} {base['peak_kb']:10.0f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--stages", default="", help="Comma separated stage names (default all)")
+    parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE, help="Save the results as a baseline")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="Compare with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Median time increase in %% that counts as a regression")
+    args = parser.parse_args()
+    if args.compare and not os.path.exists(args.compare):
+        parser.exit(2, f"No baseline at {args.compare}; run with --save first (with the same --events and --pages)\n")
+
+    stub = StubCMS(args.events, args.pages).start()
+    try:
+        log_file = os.path.join(tempfile.gettempdir(), "gemini_benchmark_log.jsonl")
+        tools = GeminiTools(google_api_key="offline", cms_url=stub.url, log_file=log_file, snapshot_dir=None)
+        tools.model = StubModel(0)
+        selected = {name.strip() for name in args.stages.split(",") if name.strip()}
+
+        results = {
+            "meta": {"commit": git_commit(), "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                     "python": platform.python_version(), "events": args.events, "pages": args.pages,
+                     "rounds": args.rounds},
+            "stages": {},
+        }
+        print(f"{args.events} events, {args.pages} pages, {args.rounds} rounds")
+        print(f"{'stage':22} {'items':>6} {'best ms':>9} {'median ms':>10} {'us/item':>9} "
+              f"{'peak KiB':>9} {'kept KiB':>9} {'blocks':>8}")
+        for name, items, function in stages(tools, stub.events, stub.pages):
+            if selected and name not in selected:
+                continue
+            stage = measure(function, args.rounds)
+            stage["items"] = items
+            # Print the stage's console log lines (prompt token counts) before its row
+            tools.log_writer.flush()
+            results["stages"][name] = stage
+            print(f"{name:22} {items:6} {stage['best_ms']:9.2f} {stage['median_ms']:10.2f} "
+                  f"{stage['median_ms'] * 1000 / max(items, 1):9.1f} {stage['peak_kb']:9.0f} "
+                  f"{stage['kept_kb']:9.0f} {stage['kept_blocks']:8}")
+    finally:
+        stub.stop()
+
+    regressed = False
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressed = compare(results, json.load(f), args.threshold)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Retained memory of reduced corpus records: plain dicts plus a serialized
+context string vs. slotted records with interned strings.
+
+    python -m benchmarks.record_memory --events 10000 --pages 2000
+"""
+import gc
+import json
+import argparse
+import tracemalloc
+
+from record_store import StringTable, compact_record
+from benchmarks.stubs import OfflineGeminiTools
+from benchmarks.synthetic import generate_events, generate_pages
+
+
+def retained(build):
+    """Bytes still allocated by whatever build() returns"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def dict_records(reduce, nodes):
+    records = reduce(nodes)
+    return records, json.dumps(records, ensure_ascii=False)
+
+
+def compact_records(reduce, nodes):
+    strings = StringTable()
+    return [compact_record(record, strings) for record in reduce(nodes)], strings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--pages", type=int, default=2000)
+    args = parser.parse_args()
+
+    tools = OfflineGeminiTools(events=[], pages=[], latency=0)
+    for kind, nodes, reduce in (("events", generate_events(args.events), tools.process_events),
+                                ("pages", generate_pages(args.pages), tools.process_pages)):
+        before = retained(lambda: dict_records(reduce, nodes))
+        after = retained(lambda: compact_records(reduce, nodes))
+        print(f"{kind:7} dicts + context {before / 1e6:7.2f} MB ({before / len(nodes):6.0f} B/record)  "
+              f"compact {after / 1e6:7.2f} MB ({after / len(nodes):6.0f} B/record)  "
+              f"saved {(1 - after / before) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
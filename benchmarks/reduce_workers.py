@@ -0,0 +1,74 @@
+"""Refresh wall time and event loop stalls against the number of HTML
+reduction worker processes, on a synthetic corpus.
+
+Each run re-reduces every node (as a full sync after a schema change would).
+The stall is the longest a ticking coroutine waited for the event loop
+while the async refresh ran, which is what streaming chat sessions feel.
+
+    python -m benchmarks.reduce_workers --events 10000 --pages 2000 --workers 0,1,2,4
+"""
+import time
+import asyncio
+import argparse
+
+from cms_sync import CorpusSync
+from benchmarks.stubs import OfflineGeminiTools
+
+
+def reset(tools):
+    # Forget every content hash so the next sync reduces all nodes again
+    for cache in (tools.events_cache, tools.pages_cache):
+        cache["sync"] = CorpusSync()
+
+
+def timed_refresh(tools) -> float:
+    reset(tools)
+    start = time.perf_counter()
+    tools.refresh_events_data()
+    tools.refresh_pages_data()
+    return time.perf_counter() - start
+
+
+async def max_stall(tools, interval: float = 0.01) -> float:
+    reset(tools)
+    stall = 0.0
+    done = asyncio.Event()
+
+    async def tick():
+        nonlocal stall
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            stall = max(stall, time.perf_counter() - start - interval)
+
+    ticker = asyncio.ensure_future(tick())
+    await tools.arefresh_events_data()
+    await tools.arefresh_pages_data()
+    done.set()
+    await ticker
+    return stall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--workers", default="0,1,2,4", help="Comma separated worker counts (0 = in-process)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.events} events, {args.pages} pages")
+    print(f"{'workers':>7} {'refresh (best)':>15} {'max loop stall':>15}")
+    for workers in (int(w) for w in args.workers.split(",")):
+        # The initial load also starts the worker processes
+        tools = OfflineGeminiTools(events=args.events, pages=args.pages, latency=0, reduce_workers=workers)
+        try:
+            best = min(timed_refresh(tools) for _ in range(args.repeat))
+            stall = asyncio.run(max_stall(tools))
+        finally:
+            tools.html_reducer.close()
+        print(f"{workers:7} {best:13.2f} s {stall * 1000:12.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""CMS syncs and corpus memory of N app processes, each building its own corpus
+vs. sharing the corpus refreshed and published by one leader process.
+
+Every process answers a few prompt-building queries after loading, then
+reports its CMS syncs and the Python memory still allocated by GeminiTools
+(tracemalloc, so the synthetic CMS payload is not counted). Followers map
+the published file, whose pages are shared through the page cache and are
+reported once as the file size.
+
+    python -m benchmarks.shared_corpus --processes 4 --events 10000 --pages 2000
+"""
+import gc
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+
+QUERIES = ["Vad händer i helgen?", "restauranger vid Skrea strand", "Öppettider för museet", "Konserter i juli"]
+
+
+def worker(events: int, pages: int, shared_dir, results, done) -> None:
+    from benchmarks.stubs import OfflineGeminiTools
+    from benchmarks.synthetic import generate_events, generate_pages
+
+    event_nodes, page_nodes = generate_events(events), generate_pages(pages)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tools = OfflineGeminiTools(events=event_nodes, pages=page_nodes, latency=0, shared_corpus_dir=shared_dir)
+    ready = time.perf_counter() - start
+    for query in QUERIES:
+        tools._build_events_prompt(query, tools.events_cache["corpus"])
+        tools._build_pages_prompt(query, tools.pages_cache["corpus"])
+    # The synthetic payload is held by the stub and is not part of the corpus
+    del event_nodes, page_nodes
+    tools._events = tools._pages = []
+    gc.collect()
+    live = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    results.put({
+        "leader": tools.shared is None or tools.shared.is_leader,
+        "cms_fetches": tools.cms_fetches,
+        "live_mb": live / 1e6,
+        "ready_s": ready,
+        "events": len(tools.events_cache["data"]),
+        "pages": len(tools.pages_cache["data"]),
+    })
+    # Stay alive (and keep the leader's lock) until every process has reported
+    done.wait()
+
+
+def run(processes: int, events: int, pages: int, shared: bool):
+    context = multiprocessing.get_context("spawn")
+    results, done = context.Queue(), context.Event()
+    shared_dir = tempfile.mkdtemp(prefix="shared-corpus-") if shared else None
+    workers = [context.Process(target=worker, args=(events, pages, shared_dir, results, done))
+               for _ in range(processes)]
+    try:
+        for process in workers:
+            process.start()
+        reports = [results.get(timeout=600) for _ in workers]
+        mapped = sum(os.path.getsize(os.path.join(shared_dir, name))
+                     for name in os.listdir(shared_dir) if name.endswith(".corpus")) if shared else 0
+    finally:
+        done.set()
+        for process in workers:
+            process.join()
+        if shared_dir:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+    return reports, mapped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--pages", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{args.processes} processes, {args.events} events, {args.pages} pages")
+    for label, shared in (("own corpus per process", False), ("shared corpus", True)):
+        reports, mapped = run(args.processes, args.events, args.pages, shared)
+        assert all(r["events"] == reports[0]["events"] and r["pages"] == reports[0]["pages"] for r in reports)
+        leaders = [r for r in reports if r["leader"]]
+        followers = [r for r in reports if not r["leader"]]
+        print(f"{label}:")
+        print(f"  CMS syncs {sum(r['cms_fetches'] for r in reports)}, "
+              f"corpus memory {sum(r['live_mb'] for r in reports):.1f} MB in total"
+              + (f" + {mapped / 1e6:.1f} MB mapped file" if shared else ""))
+        for role, group in (("leader", leaders), ("follower", followers)):
+            if group and (shared or role == "leader"):
+                print(f"  per {role if shared else 'process'}: {sum(r['live_mb'] for r in group) / len(group):6.1f} MB, "
+                      f"ready after {max(r['ready_s'] for r in group):.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Prefetch hit rate of the keyword guess, and tool latency saved by starting
+the guessed tool alongside the first GPT-4o call.
+
+Each message is labelled with the tool GPT-4o calls for it (None for a
+direct answer) and the query it writes for that call: GPT-4o rewrites the
+question, with dates spelled out and page queries in Swedish, so the claim
+compares dates as in the app. The first GPT-4o call is replaced by a fixed
+delay and Gemini by a stub with a fixed latency.
+
+    python -m benchmarks.speculative_prefetch --gpt-latency 1.2 --gemini-latency 3
+"""
+import json
+import time
+import asyncio
+import argparse
+from datetime import date, timedelta
+
+from prefetch import SpeculativePrefetcher
+from benchmarks.stubs import OfflineGeminiTools
+
+EVENTS, PAGES = "ask_gemini_about_events", "ask_gemini_about_pages"
+
+# (message, tool, GPT-4o's query); {today}, {saturday} and {sunday} are filled in with ISO dates
+MESSAGES = [
+    ("Vad händer i helgen?", EVENTS, "Evenemang i Falkenberg {saturday} till {sunday}"),
+    ("Finns det några konserter i juli?", EVENTS, "Konserter i Falkenberg i juli"),
+    ("What's on in Falkenberg this weekend?", EVENTS, "Evenemang i Falkenberg i helgen ({saturday} - {sunday})"),
+    ("Vilka evenemang finns för barn på lördag?", EVENTS, "Evenemang för barn i Falkenberg {saturday}"),
+    ("Gibt es am Wochenende ein Konzert?", EVENTS, "Konserter i Falkenberg {saturday} till {sunday}"),
+    ("Är det någon marknad på torget idag?", EVENTS, "Marknad på torget i Falkenberg {today}"),
+    ("Var kan man äta lunch vid hamnen?", PAGES, "Restauranger med lunch vid hamnen i Falkenberg"),
+    ("Bästa stranden för barnfamiljer?", PAGES, "Barnvänliga stränder i Falkenberg"),
+    ("Where can I park near Skrea strand?", PAGES, "Parkering vid Skrea strand"),
+    ("Finns det hotell nära centrum?", PAGES, "Hotell nära centrum i Falkenberg"),
+    ("Öppettider för museet?", PAGES, "Öppettider för Falkenbergs museum"),
+    ("Var finns cykeluthyrning?", PAGES, "Cykeluthyrning i Falkenberg"),
+    ("Hur tar jag mig till Ullared?", PAGES, "Resa till Ullared från Falkenberg"),
+    ("Kan jag ta med hunden?", PAGES, "Hundar på stränder och i naturen i Falkenberg"),
+    ("Tack för tipset om konserten!", None, None),
+    ("Tack så mycket!", None, None),
+    ("Hej!", None, None),
+]
+
+
+def weekend() -> tuple:
+    today = date.today()
+    saturday = today + timedelta(days=(5 - today.weekday()) % 7)
+    return today, saturday, saturday + timedelta(days=1)
+
+
+def resolve_query(query: str) -> str:
+    """Weekend references made explicit, as app.py's process_date_references does"""
+    _, saturday, sunday = weekend()
+    if any(term in query.lower() for term in ["helgen", "weekend", "helg", "veckoslut"]):
+        return f"{query} (referring to dates {saturday.isoformat()} to {sunday.isoformat()})"
+    return query
+
+
+async def answer(tools, prefetcher, message, tool, query, gpt_latency):
+    """Time from the message until the tool answer is ready (or GPT-4o has answered)"""
+    start = time.perf_counter()
+    prefetch = prefetcher.start(message, resolve_query(message)) if prefetcher else None
+    await asyncio.sleep(gpt_latency)
+    if query:
+        today, saturday, sunday = weekend()
+        query = query.format(today=today.isoformat(), saturday=saturday.isoformat(), sunday=sunday.isoformat())
+    tool_call = {"id": "call", "function": {"name": tool, "arguments": json.dumps({"query": query})}}
+    prefetched = bool(tool and prefetcher and prefetcher.claim(prefetch, tool_call))
+    if prefetcher:
+        prefetcher.settle(prefetch)
+    if prefetched:
+        await prefetcher.result(prefetch)
+    elif tool:
+        await getattr(tools, "a" + tool)(resolve_query(query))
+    return time.perf_counter() - start
+
+
+async def run(tools, prefetcher, gpt_latency):
+    total = 0.0
+    for message, tool, query in MESSAGES:
+        tools.answer_cache.invalidate()
+        total += await answer(tools, prefetcher, message, tool, query, gpt_latency)
+    return total / len(MESSAGES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gpt-latency", type=float, default=1.2, help="First GPT-4o call time until its tool call")
+    parser.add_argument("--gemini-latency", type=float, default=3.0, help="Stub Gemini latency in seconds")
+    args = parser.parse_args()
+
+    tools = OfflineGeminiTools(events=500, pages=100, latency=args.gemini_latency)
+    prefetcher = SpeculativePrefetcher({EVENTS: tools.aask_gemini_about_events, PAGES: tools.aask_gemini_about_pages},
+                                       resolve_query=resolve_query)
+
+    serial = asyncio.run(run(tools, None, args.gpt_latency))
+    calls_before = tools.model.calls
+    speculative = asyncio.run(run(tools, prefetcher, args.gpt_latency))
+
+    stats = prefetcher.stats()
+    print(f"{stats['started']} of {stats['messages']} messages prefetched, {stats['hits']} hits, "
+          f"{stats['unclaimed']} unclaimed ({stats['window_mismatches']} asked about other dates), "
+          f"hit rate {stats['hit_rate']:.0%}")
+    print(f"Latency saved per hit: {stats['avg_saved_ms']:.0f} ms; "
+          f"Gemini time spent on unclaimed prefetches: {stats['wasted_seconds']:.1f} s")
+    print(f"Mean time to tool answer: serial {serial:.2f} s, speculative {speculative:.2f} s")
+    print(f"Gemini calls: serial {calls_before}, speculative {tools.model.calls - calls_before}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Local stand-in for the cms.falkenberg.se GraphQL endpoint.
+
+Serves synthetic allEvent and pages connections with cursor pagination
+(first/after, pageInfo) and the WPGraphQL dateQuery modified filter, and
+counts requests and response bytes so syncs can be compared.
+
+    python -m benchmarks.stub_cms --events 10000 --pages 2000 --port 8765
+"""
+import json
+import base64
+import argparse
+import threading
+from datetime import date, datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from benchmarks.synthetic import generate_events, generate_pages
+
+
+def _cursor(offset: int) -> str:
+    return base64.b64encode(f"arrayconnection:{offset}".encode()).decode()
+
+
+def _offset(cursor) -> int:
+    if not cursor:
+        return 0
+    return int(base64.b64decode(cursor).decode().rsplit(":", 1)[1]) + 1
+
+
+class StubCMS:
+    def __init__(self, events=1000, pages=200, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 max_page_size: int = 100):
+        self.events = generate_events(events) if isinstance(events, int) else events
+        self.pages = generate_pages(pages) if isinstance(pages, int) else pages
+        # Simulated server time per GraphQL request
+        self.latency = latency
+        # WPGraphQL caps `first` at 100 by default
+        self.max_page_size = max_page_size
+        # Answer pages starting at or after this node offset with HTTP 500 (None: never)
+        self.fail_from = None
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/graphql"
+
+    def start(self) -> "StubCMS":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def touch(self, kind: str, count: int, modified: str = None) -> None:
+        """Edit the first `count` nodes of a corpus, as an editor would in the CMS"""
+        modified = modified or datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        for node in (self.events if kind == "events" else self.pages)[:count]:
+            node["modified"] = modified
+            node["content"] += "<p>Uppdaterad.</p>"
+
+    def respond(self, payload: dict) -> dict:
+        query = payload.get("query", "")
+        variables = payload.get("variables") or {}
+        root, nodes = ("allEvent", self.events) if "allEvent" in query else ("pages", self.pages)
+
+        date_query = (variables.get("where") or {}).get("dateQuery")
+        if date_query and date_query.get("after"):
+            after = date_query["after"]
+            since = date(after["year"], after["month"], after["day"]).isoformat()
+            nodes = [node for node in nodes if node.get("modified", "")[:10] >= since]
+
+        start = _offset(variables.get("after"))
+        first = min(int(variables.get("first") or 10), self.max_page_size)
+        page = nodes[start:start + first]
+        end = start + len(page) - 1
+        return {"data": {root: {
+            "pageInfo": {"endCursor": _cursor(end) if page else None, "hasNextPage": start + first < len(nodes)},
+            "nodes": page,
+        }}}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if stub.latency:
+                    threading.Event().wait(stub.latency)
+                after = (payload.get("variables") or {}).get("after")
+                if stub.fail_from is not None and _offset(after) >= stub.fail_from:
+                    self.send_error(500)
+                    return
+                body = json.dumps(stub.respond(payload), ensure_ascii=False).encode("utf-8")
+                with stub._lock:
+                    stub.requests += 1
+                    stub.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    stub = StubCMS(args.events, args.pages, host=args.host, port=args.port)
+    print(f"Stub CMS serving {len(stub.events)} events and {len(stub.pages)} pages at {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
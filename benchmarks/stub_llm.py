@@ -0,0 +1,368 @@
+"""Local stand-ins for the OpenAI chat completions API and the Gemini API, for
+load testing the running app without API keys or network.
+
+StubOpenAI serves POST /v1/chat/completions, streamed (server-sent events)
+or not. A request offering tools whose last message is the visitor's gets a
+streamed tool call (ask_gemini_about_events for event-like questions, else
+ask_gemini_about_pages), or a direct answer for a `direct_ratio` fraction of
+them; any other request gets a text answer. StubGemini serves generateContent,
+streamGenerateContent (JSON array or alt=sse) and cachedContents under
+/v1beta, as the google-generativeai REST transport calls them.
+
+Both answer after `first_token` seconds and then stream `answer_tokens`
+words at `tokens_per_second`, and count requests and concurrent requests.
+Every answer starts with ANSWER_MARKER. After tool results StubOpenAI
+relays the marker only if every result carries it (a Gemini answer), and
+otherwise answers with the first result that does not, so tool errors reach
+the visitor and `chat_load --expect` counts them as failed turns.
+
+    python -m benchmarks.stub_llm --first-token 0.5 --tokens-per-second 80 --cms-events 2000 --cms-pages 400
+
+prints the environment that points app.py at the stubs (OPENAI_BASE_URL,
+GEMINI_API_ENDPOINT, CMS_URL).
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from benchmarks.synthetic import WORDS
+from benchmarks.stub_cms import StubCMS
+
+# First word of every stub answer, for the load generator to tell real answers from errors
+ANSWER_MARKER = "Stub-svar:"
+
+EVENT_WORDS = ("evenemang", "händer", "konsert", "festival", "helg", "event", "weekend", "concert", "happening")
+
+
+def _timestamp(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class StubServer:
+    """Threaded HTTP server with a simulated token rate; each request is handled in its own thread"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, first_token: float = 0.5,
+                 tokens_per_second: float = 50.0, answer_tokens: int = 120, seed: int = 0):
+        # Seconds until the first token, then the answer streams at tokens_per_second
+        self.first_token = first_token
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "in_flight": self.in_flight, "peak_in_flight": self.peak_in_flight}
+
+    def answer_words(self) -> List[str]:
+        with self._lock:
+            return [ANSWER_MARKER] + [self.rng.choice(WORDS) for _ in range(self.answer_tokens - 1)]
+
+    def pace(self, pieces: List[str], tokens_per_piece: int = 1) -> Iterator[str]:
+        """Yield pieces after the first-token delay, spaced out at the token rate"""
+        time.sleep(self.first_token)
+        interval = tokens_per_piece / self.tokens_per_second if self.tokens_per_second else 0
+        for i, piece in enumerate(pieces):
+            if i and interval:
+                time.sleep(interval)
+            yield piece
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str, path: str, query: str,
+               payload: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _dispatch(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}") if length else {}
+                parts = urlsplit(self.path)
+                with stub._lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                try:
+                    stub.handle(self, method, parts.path, parts.query, payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away (e.g. a cancelled speculative call)
+                    pass
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PATCH(self):
+                self._dispatch("PATCH")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+            def send_json(self, body: Any, status: int = 200):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def start_stream(self, content_type: str):
+                # No Content-Length: the stream ends when the connection closes
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class StubOpenAI(StubServer):
+    """OpenAI chat completions (base URL: url + "/v1") with GPT-4o-like tool calls"""
+
+    def __init__(self, direct_ratio: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        # Fraction of tool-offering requests answered directly instead of with a tool call
+        self.direct_ratio = direct_ratio
+        self.tool_calls = 0
+
+    @property
+    def base_url(self) -> str:
+        return self.url + "/v1"
+
+    def _tool_call(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+        if not tools or not messages or messages[-1].get("role") != "user":
+            return None
+        with self._lock:
+            if self.rng.random() < self.direct_ratio:
+                return None
+            self.tool_calls += 1
+            call_id = f"call_{self.tool_calls}"
+        question = messages[-1].get("content") or ""
+        if not isinstance(question, str):
+            question = json.dumps(question, ensure_ascii=False)
+        names = [tool["function"]["name"] for tool in tools]
+        name = "ask_gemini_about_events" if any(word in question.lower() for word in EVENT_WORDS) else "ask_gemini_about_pages"
+        if name not in names:
+            name = names[0]
+        return {"id": call_id, "name": name, "arguments": json.dumps({"query": question}, ensure_ascii=False)}
+
+    def _answer(self, messages: List[Dict[str, Any]]) -> List[str]:
+        """Canned answer words, or the text of the first tool result of this turn that is not a stub answer"""
+        results = []
+        for message in reversed(messages):
+            if message.get("role") != "tool":
+                break
+            results.append(message.get("content") or "")
+        for content in reversed(results):
+            if not isinstance(content, str):
+                content = json.dumps(content, ensure_ascii=False)
+            if ANSWER_MARKER not in content:
+                return content.split() or ["(empty tool result)"]
+        return self.answer_words()
+
+    def handle(self, request, method, path, query, payload):
+        if method != "POST" or not path.endswith("/chat/completions"):
+            request.send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+            return
+        created = int(time.time())
+        completion_id = f"chatcmpl-stub{self.requests}"
+        messages = payload.get("messages") or []
+        tool_call = self._tool_call(messages, payload.get("tools") or [])
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+            body = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": payload.get("model", "gpt-4o"),
+                    "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(body, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        if not payload.get("stream"):
+            time.sleep(self.first_token)
+            if tool_call:
+                message = {"role": "assistant", "content": None, "tool_calls": [{
+                    "id": tool_call["id"], "type": "function",
+                    "function": {"name": tool_call["name"], "arguments": tool_call["arguments"]}}]}
+                finish_reason = "tool_calls"
+            else:
+                time.sleep(self.answer_tokens / self.tokens_per_second if self.tokens_per_second else 0)
+                message = {"role": "assistant", "content": " ".join(self._answer(messages))}
+                finish_reason = "stop"
+            request.send_json({"id": completion_id, "object": "chat.completion", "created": created,
+                               "model": payload.get("model", "gpt-4o"),
+                               "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                               "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+            return
+
+        request.start_stream("text/event-stream")
+        if tool_call:
+            arguments = tool_call["arguments"]
+            size = max(len(arguments) // 4, 1)
+            pieces = [arguments[i:i + size] for i in range(0, len(arguments), size)]
+            request.wfile.write(chunk({"role": "assistant", "content": None, "tool_calls": [{
+                "index": 0, "id": tool_call["id"], "type": "function",
+                "function": {"name": tool_call["name"], "arguments": ""}}]}))
+            for piece in self.pace(pieces):
+                request.wfile.write(chunk({"tool_calls": [{"index": 0, "function": {"arguments": piece}}]}))
+            request.wfile.write(chunk({}, "tool_calls"))
+        else:
+            request.wfile.write(chunk({"role": "assistant", "content": ""}))
+            words = self._answer(messages)
+            for i, word in enumerate(self.pace(words)):
+                request.wfile.write(chunk({"content": word if i == 0 else " " + word}))
+            request.wfile.write(chunk({}, "stop"))
+        request.wfile.write(b"data: [DONE]\n\n")
+
+
+class StubGemini(StubServer):
+    """Gemini generateContent, streamGenerateContent and cachedContents (API endpoint: url)"""
+
+    def __init__(self, chunk_tokens: int = 16, **kwargs):
+        super().__init__(**kwargs)
+        # Gemini streams its answer in chunks of several tokens
+        self.chunk_tokens = chunk_tokens
+        self.cached_contents: Dict[str, Dict[str, Any]] = {}
+
+    def _response(self, text: str, prompt_tokens: int, final: bool) -> Dict[str, Any]:
+        candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+        if final:
+            candidate["finishReason"] = "STOP"
+        return {"candidates": [candidate], "usageMetadata": {
+            "promptTokenCount": prompt_tokens, "candidatesTokenCount": self.answer_tokens,
+            "totalTokenCount": prompt_tokens + self.answer_tokens}}
+
+    def _cached_content(self, request, method, path, payload):
+        name = path.split("/v1beta/", 1)[1]
+        if method == "POST" and name == "cachedContents":
+            with self._lock:
+                name = f"cachedContents/stub-{len(self.cached_contents) + 1}"
+            now = datetime.now(timezone.utc)
+            ttl = float(str(payload.get("ttl") or "3600s").rstrip("s"))
+            self.cached_contents[name] = {
+                "name": name, "model": payload.get("model", ""), "displayName": payload.get("displayName", ""),
+                "createTime": _timestamp(now), "updateTime": _timestamp(now),
+                "expireTime": _timestamp(now + timedelta(seconds=ttl)),
+                "usageMetadata": {"totalTokenCount": len(json.dumps(payload.get("contents", ""))) // 4},
+            }
+            request.send_json(self.cached_contents[name])
+        elif name not in self.cached_contents:
+            request.send_json({"error": {"code": 404, "message": f"{name} not found", "status": "NOT_FOUND"}}, 404)
+        elif method == "DELETE":
+            del self.cached_contents[name]
+            request.send_json({})
+        else:
+            if method == "PATCH" and payload.get("ttl"):
+                expire = datetime.now(timezone.utc) + timedelta(seconds=float(str(payload["ttl"]).rstrip("s")))
+                self.cached_contents[name]["expireTime"] = _timestamp(expire)
+            request.send_json(self.cached_contents[name])
+
+    def handle(self, request, method, path, query, payload):
+        if path.startswith("/v1beta/cachedContents"):
+            self._cached_content(request, method, path, payload)
+            return
+        prompt_tokens = len(json.dumps(payload.get("contents", ""), ensure_ascii=False)) // 4
+        words = self.answer_words()
+        if path.endswith(":generateContent"):
+            time.sleep(self.first_token + (len(words) / self.tokens_per_second if self.tokens_per_second else 0))
+            request.send_json(self._response(" ".join(words), prompt_tokens, True))
+            return
+        if not path.endswith(":streamGenerateContent"):
+            request.send_json({"error": {"code": 404, "message": f"Unknown path {path}", "status": "NOT_FOUND"}}, 404)
+            return
+
+        size = self.chunk_tokens
+        pieces = [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+                  for i in range(0, len(words), size)]
+        sse = "alt=sse" in query
+        request.start_stream("text/event-stream" if sse else "application/json")
+        if not sse:
+            # The REST transport reads a streamed JSON array of responses
+            request.wfile.write(b"[")
+        for i, piece in enumerate(self.pace(pieces, size)):
+            body = json.dumps(self._response(piece, prompt_tokens, i == len(pieces) - 1), ensure_ascii=False)
+            if sse:
+                request.wfile.write(f"data: {body}\r\n\r\n".encode("utf-8"))
+            else:
+                request.wfile.write(((",\n" if i else "") + body).encode("utf-8"))
+        if not sse:
+            request.wfile.write(b"]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=8766)
+    parser.add_argument("--gemini-port", type=int, default=8767)
+    parser.add_argument("--first-token", type=float, default=0.5, help="Seconds until the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--gemini-first-token", type=float, default=None, help="Defaults to --first-token")
+    parser.add_argument("--direct-ratio", type=float, default=0.0,
+                        help="Fraction of GPT-4o first calls answered without a tool call")
+    parser.add_argument("--cms-port", type=int, default=8765)
+    parser.add_argument("--cms-events", type=int, default=0, help="Also serve a stub CMS with this many events")
+    parser.add_argument("--cms-pages", type=int, default=200)
+    args = parser.parse_args()
+
+    rate = {"tokens_per_second": args.tokens_per_second, "answer_tokens": args.answer_tokens, "host": args.host}
+    openai = StubOpenAI(direct_ratio=args.direct_ratio, port=args.openai_port, first_token=args.first_token,
+                        **rate).start()
+    gemini_first_token = args.first_token if args.gemini_first_token is None else args.gemini_first_token
+    gemini = StubGemini(port=args.gemini_port, first_token=gemini_first_token, **rate).start()
+    cms = StubCMS(args.cms_events, args.cms_pages, host=args.host, port=args.cms_port).start() if args.cms_events else None
+
+    print("Point app.py at the stubs with:")
+    print(f"  OPENAI_API_KEY=stub OPENAI_BASE_URL={openai.base_url}")
+    print(f"  GOOGLE_API_KEY=stub GEMINI_API_ENDPOINT={gemini.url}")
+    if cms:
+        print(f"  CMS_URL={cms.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for name, stub in (("OpenAI", openai), ("Gemini", gemini)):
+            stats = stub.stats()
+            print(f"{name}: {stats['requests']} requests, at most {stats['peak_in_flight']} at once")
+        if cms:
+            print(f"CMS: {cms.requests} requests")
+            cms.stop()
+        openai.stop()
+        gemini.stop()
+
+
+if __name__ == "__main__":
+    main()
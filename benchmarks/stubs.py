@@ -0,0 +1,148 @@
+"""Offline stand-ins for Gemini and the CMS used by the benchmarks"""
+import os
+import time
+import asyncio
+import tempfile
+from typing import List, Dict, Any, Iterator, AsyncIterator
+
+from gemini_tools import GeminiTools, CMS_PAGE_SIZE
+from benchmarks.synthetic import generate_events, generate_pages
+
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubModel:
+    """Mimics GenerativeModel with a fixed generation latency.
+
+    With stream=True the text is returned in `chunks` pieces spread evenly
+    over the latency, like Gemini streaming its answer.
+    """
+
+    def __init__(self, latency: float = 1.0, text: str = "**Evenemang:**\n- **Stub**: svar.", chunks: int = 8,
+                 requests: list = None, cached_content=None):
+        self.latency = latency
+        self.text = text
+        self.chunks = chunks
+        self.calls = 0
+        # Shared log of (cached content name or None, prompt) per request
+        self.requests = requests if requests is not None else []
+        self.cached_content = cached_content
+
+    def _record(self, prompt) -> None:
+        self.calls += 1
+        self.requests.append((self.cached_content.name if self.cached_content else None, prompt))
+
+    def _pieces(self) -> List[str]:
+        words = self.text.split(" ")
+        size = max(-(-len(words) // self.chunks), 1)
+        return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+                for i in range(0, len(words), size)]
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        self._record(prompt)
+        if stream:
+            return self._stream()
+        time.sleep(self.latency)
+        return StubResponse(self.text)
+
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        self._record(prompt)
+        if stream:
+            return self._astream()
+        await asyncio.sleep(self.latency)
+        return StubResponse(self.text)
+
+    def _stream(self) -> Iterator[StubResponse]:
+        pieces = self._pieces()
+        for piece in pieces:
+            time.sleep(self.latency / len(pieces))
+            yield StubResponse(piece)
+
+    async def _astream(self) -> AsyncIterator[StubResponse]:
+        pieces = self._pieces()
+        for piece in pieces:
+            await asyncio.sleep(self.latency / len(pieces))
+            yield StubResponse(piece)
+
+
+class StubCachedContent:
+    def __init__(self, name: str, display_name: str, contents: str):
+        self.name = name
+        self.display_name = display_name
+        self.contents = contents
+
+
+class StubCacheBackend:
+    """Stand-in for Gemini context caching that records created and deleted handles.
+
+    Models generating from a handle log their requests to `requests`, shared
+    with the plain StubModel, so it shows which requests reused a handle.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = []
+        self.created: List[StubCachedContent] = []
+        self.deleted: List[str] = []
+
+    def create(self, display_name: str, contents: str, ttl: float) -> StubCachedContent:
+        handle = StubCachedContent(f"cachedContents/{len(self.created) + 1}", display_name, contents)
+        self.created.append(handle)
+        return handle
+
+    def model(self, handle: StubCachedContent) -> StubModel:
+        return StubModel(self.latency, requests=self.requests, cached_content=handle)
+
+    def delete(self, handle: StubCachedContent) -> None:
+        self.deleted.append(handle.name)
+
+
+class OfflineGeminiTools(GeminiTools):
+    """GeminiTools fed from synthetic payloads instead of the CMS"""
+
+    def __init__(self, events=1000, pages=200, latency: float = 1.0, log_file: str = None,
+                 snapshot_dir: str = None, cms_latency: float = 0.0, reduce_workers: int = 0,
+                 shared_corpus_dir: str = None):
+        # Either a node count to generate or pre-generated nodes
+        self._events = generate_events(events) if isinstance(events, int) else events
+        self._pages = generate_pages(pages) if isinstance(pages, int) else pages
+        # Simulated CMS download time per fetch
+        self._cms_latency = cms_latency
+        # Number of (simulated) CMS syncs, one per corpus refresh
+        self.cms_fetches = 0
+        if log_file is None:
+            log_file = os.path.join(tempfile.gettempdir(), "gemini_benchmark_log.jsonl")
+        self.cache_backend = StubCacheBackend(latency)
+        super().__init__(google_api_key="offline", cms_url="http://localhost/graphql", log_file=log_file,
+                         snapshot_dir=snapshot_dir, context_cache_backend=self.cache_backend,
+                         reduce_workers=reduce_workers, shared_corpus_dir=shared_corpus_dir)
+        self.model = StubModel(latency, requests=self.cache_backend.requests)
+
+    def _pages_of(self, nodes):
+        for start in range(0, len(nodes), CMS_PAGE_SIZE):
+            yield nodes[start:start + CMS_PAGE_SIZE]
+
+    def stream_events_data(self, modified_since=None) -> Iterator[List[Dict[str, Any]]]:
+        self.cms_fetches += 1
+        time.sleep(self._cms_latency)
+        yield from self._pages_of(self._events)
+
+    async def astream_events_data(self, modified_since=None) -> AsyncIterator[List[Dict[str, Any]]]:
+        self.cms_fetches += 1
+        await asyncio.sleep(self._cms_latency)
+        for nodes in self._pages_of(self._events):
+            yield nodes
+
+    def stream_pages_data(self, modified_since=None) -> Iterator[List[Dict[str, Any]]]:
+        self.cms_fetches += 1
+        time.sleep(self._cms_latency)
+        yield from self._pages_of(self._pages)
+
+    async def astream_pages_data(self, modified_since=None) -> AsyncIterator[List[Dict[str, Any]]]:
+        self.cms_fetches += 1
+        await asyncio.sleep(self._cms_latency)
+        for nodes in self._pages_of(self._pages):
+            yield nodes
@@ -0,0 +1,95 @@
+"""Synthetic CMS payloads shaped like the cms.falkenberg.se GraphQL responses"""
+import random
+from datetime import date, timedelta
+from typing import List, Dict, Any
+
+LOCATIONS = [
+    "Falkenbergs Museum", "Skrea strand", "Stortorget", "Falkenbergs Sporthall",
+    "Tullbron", "Ugglarps havsbad", "Olofsdals strand", "Falkenbergs bibliotek",
+    "Hertings", "Vallarnas friluftsteater", "Ätran", "Glommens hamn",
+]
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+WORDS = (
+    "sommar konsert festival marknad barn familj utställning musik teater "
+    "strand havet laxfiske cykel vandring mat restaurang kafé hamn museum "
+    "guidad tur bibliotek sagostund loppis konst hantverk dans yoga"
+).split()
+
+
+def _sentence(rng: random.Random, words: int = 12) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text.capitalize() + "."
+
+
+def _html(rng: random.Random, paragraphs: int) -> str:
+    parts = []
+    for _ in range(paragraphs):
+        sentences = " ".join(_sentence(rng) for _ in range(rng.randint(2, 5)))
+        parts.append(f"<p>{sentences} <strong>Fri entré</strong> &amp; <a href=\"/info/\">mer info</a></p>")
+    return "\n".join(parts)
+
+
+def make_event(i: int, rng: random.Random, today: date) -> Dict[str, Any]:
+    start = today + timedelta(days=rng.randint(-180, 180))
+    occasions = []
+    rcr_rules = []
+    if rng.random() < 0.3:
+        end = start + timedelta(weeks=rng.randint(2, 12))
+        rcr_rules.append({
+            "rcrStartDate": start.isoformat(),
+            "rcrEndDate": end.isoformat(),
+            "rcrStartTime": f"{rng.randint(9, 20):02d}:00",
+            "rcrEndTime": f"{rng.randint(21, 23):02d}:00",
+            "rcrWeekDay": rng.choice(WEEKDAYS),
+            "rcrWeeklyInterval": rng.choice([1, 1, 2]),
+            "rcrExceptions": [{"rcrExcDate": (start + timedelta(days=7)).isoformat()}] if rng.random() < 0.3 else None,
+        })
+    else:
+        for _ in range(rng.randint(1, 3)):
+            occ_start = start + timedelta(days=rng.randint(0, 30))
+            occ_end = occ_start + timedelta(days=rng.choice([0, 0, 1, 2]))
+            occasions.append({"startDate": occ_start.isoformat(), "endDate": occ_end.isoformat()})
+
+    title = f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {i}"
+    slug = title.lower().replace(" ", "-")
+    return {
+        "databaseId": i + 1,
+        "modified": "2024-01-01T08:00:00",
+        "content": _html(rng, rng.randint(1, 4)),
+        "location": {"active": True, "name": rng.choice(LOCATIONS)},
+        "slug": slug,
+        "title": title,
+        "uri": f"/evenemang/{slug}/",
+        "acfGroupEvent": {
+            "bookingLink": f"https://falkenberg.se/boka/{slug}" if rng.random() < 0.4 else None,
+            "occasions": occasions,
+            "rcrRules": rcr_rules,
+        },
+        "date": start.isoformat() + "T10:00:00",
+    }
+
+
+def generate_events(count: int, seed: int = 0, today: date = None) -> List[Dict[str, Any]]:
+    """Generate event nodes as returned by the allEvent query"""
+    rng = random.Random(seed)
+    today = today or date.today()
+    return [make_event(i, rng, today) for i in range(count)]
+
+
+def generate_pages(count: int, seed: int = 0, paragraphs: int = 8) -> List[Dict[str, Any]]:
+    """Generate page nodes as returned by the pages query"""
+    rng = random.Random(seed)
+    pages = []
+    for i in range(count):
+        title = f"{rng.choice(WORDS).capitalize()} i Falkenberg {i}"
+        pages.append({
+            "databaseId": 100000 + i,
+            "modified": "2024-01-01T08:00:00",
+            "content": _html(rng, rng.randint(2, paragraphs)),
+            "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T08:00:00",
+            "title": title,
+            "uri": f"/uppleva-och-gora/{title.lower().replace(' ', '-')}/",
+        })
+    return pages
@@ -0,0 +1,79 @@
+"""Time until each tool answer is ready when GPT-4o emits several tool calls,
+running them at the end of the stream vs. as soon as each call's arguments
+are complete.
+
+The first GPT-4o call is replaced by a stream of tool call deltas at a fixed
+rate and Gemini by a stub with a fixed latency. Earlier calls finish sooner
+by the part of the stream that follows them; the last answer only comes
+sooner when an earlier call is the slower one.
+
+    python -m benchmarks.tool_dispatch --calls 3 --delta-interval 0.05 --gemini-latency 2
+"""
+import time
+import json
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+from tool_calls import ToolCallAssembler
+from benchmarks.stubs import OfflineGeminiTools
+
+QUERIES = ["Vad händer i helgen?", "restauranger vid Skrea strand", "Öppettider för museet", "Konserter i juli"]
+
+
+def tool_call_deltas(calls: int):
+    """Deltas of `calls` tool calls, the arguments split into a few pieces each like GPT-4o streams them"""
+    for index in range(calls):
+        tool = "ask_gemini_about_events" if index % 2 == 0 else "ask_gemini_about_pages"
+        arguments = json.dumps({"query": QUERIES[index % len(QUERIES)]}, ensure_ascii=False)
+        pieces = [arguments[i:i + 6] for i in range(0, len(arguments), 6)]
+        for i, piece in enumerate(pieces):
+            yield SimpleNamespace(index=index, id=f"call_{index}" if i == 0 else None,
+                                  function=SimpleNamespace(name=tool if i == 0 else None, arguments=piece))
+
+
+async def timed(started: float, answer) -> float:
+    await answer
+    return time.perf_counter() - started
+
+
+async def run(tools, calls: int, interval: float, incremental: bool):
+    start = time.perf_counter()
+    assembler = ToolCallAssembler()
+    tasks = []
+
+    def dispatch(completed):
+        for tool_call in completed:
+            query = json.loads(tool_call["function"]["arguments"])["query"]
+            answer = getattr(tools, "a" + tool_call["function"]["name"])(query)
+            tasks.append(asyncio.ensure_future(timed(start, answer)))
+
+    for delta in tool_call_deltas(calls):
+        await asyncio.sleep(interval)
+        completed = assembler.add(delta)
+        if incremental:
+            dispatch(completed)
+    dispatch(assembler.finish() if incremental else assembler.tool_calls)
+    return await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2, help="Tool calls in the GPT-4o response")
+    parser.add_argument("--delta-interval", type=float, default=0.05, help="Seconds between streamed deltas")
+    parser.add_argument("--gemini-latency", type=float, default=2.0, help="Stub Gemini latency in seconds")
+    args = parser.parse_args()
+
+    tools = OfflineGeminiTools(events=500, pages=100, latency=args.gemini_latency)
+    deltas = sum(1 for _ in tool_call_deltas(args.calls))
+    print(f"{args.calls} tool calls in {deltas} deltas, stream takes {deltas * args.delta_interval:.2f} s")
+    for label, incremental in (("at end of stream", False), ("as arguments complete", True)):
+        # Both runs must generate, not reuse the other's cached answers
+        tools.answer_cache.invalidate()
+        ready = asyncio.run(run(tools, args.calls, args.delta_interval, incremental))
+        print(f"Tool calls run {label:22} answers ready after {', '.join(f'{t:.2f}' for t in ready)} s "
+              f"(mean {sum(ready) / len(ready):.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
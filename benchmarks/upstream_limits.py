@@ -0,0 +1,106 @@
+"""A traffic spike against a rate-limited upstream, with and without the
+admission limiter.
+
+The upstream is a stub that takes a fixed time per request and answers 429
+when more than --capacity requests are in flight. Without the limiter every
+session calls it at once and retries 429s like the OpenAI client does by
+default (2 retries, 0.5 s then 1 s). With it, requests wait for one of
+--capacity slots in a bounded queue and 429s back off exponentially.
+
+    python -m benchmarks.upstream_limits --sessions 200 --capacity 16 --latency 1.0
+"""
+import time
+import asyncio
+import argparse
+import statistics
+
+from admission import UpstreamLimiter, UpstreamBusy, current_session
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+class StubUpstream:
+    """Answers after a fixed latency, or 429 at once when over capacity"""
+
+    def __init__(self, capacity: int, latency: float):
+        self.capacity = capacity
+        self.latency = latency
+        self.in_flight = 0
+        self.rate_limited = 0
+
+    async def request(self) -> str:
+        if self.in_flight >= self.capacity:
+            self.rate_limited += 1
+            raise RateLimited()
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency)
+            return "ok"
+        finally:
+            self.in_flight -= 1
+
+
+async def client_retries(upstream: StubUpstream) -> str:
+    for delay in (0.5, 1.0, None):
+        try:
+            return await upstream.request()
+        except RateLimited:
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+
+async def run(sessions: int, upstream: StubUpstream, limiter=None):
+    latencies, failed, busy = [], 0, 0
+
+    async def session(i):
+        nonlocal failed, busy
+        current_session.set(i)
+        start = time.perf_counter()
+        try:
+            if limiter:
+                await limiter.acall(upstream.request)
+            else:
+                await client_retries(upstream)
+            latencies.append(time.perf_counter() - start)
+        except UpstreamBusy:
+            busy += 1
+        except RateLimited:
+            failed += 1
+
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    return latencies, failed, busy
+
+
+def report(label, latencies, failed, busy, upstream):
+    p = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else latencies * 19
+    print(f"{label:16} {len(latencies):9} {failed:10} {busy:6} {upstream.rate_limited:8} "
+          f"{statistics.median(latencies):7.2f} s {p[18]:7.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200, help="Sessions sending a request at the same moment")
+    parser.add_argument("--capacity", type=int, default=16, help="Concurrent requests the upstream accepts")
+    parser.add_argument("--latency", type=float, default=1.0, help="Upstream time per request in seconds")
+    parser.add_argument("--max-queue", type=int, default=256)
+    parser.add_argument("--max-wait", type=float, default=30.0)
+    args = parser.parse_args()
+
+    print(f"{'':16} {'completed':>9} {'failed 429':>10} {'busy':>6} {'429s seen':>8} {'p50':>9} {'p95':>9}")
+    upstream = StubUpstream(args.capacity, args.latency)
+    report("no limiter", *asyncio.run(run(args.sessions, upstream)), upstream)
+
+    upstream = StubUpstream(args.capacity, args.latency)
+    limiter = UpstreamLimiter("stub", args.capacity, args.max_queue, args.max_wait)
+    report("limiter", *asyncio.run(run(args.sessions, upstream, limiter)), upstream)
+    stats = limiter.stats()
+    print(f"\nLimiter: {stats['waited']} of {stats['admitted']} admitted after queueing, "
+          f"avg wait {stats['avg_wait_ms']:.0f} ms, max wait {stats['max_wait_ms']:.0f} ms, "
+          f"{stats['rejected']} refused, {stats['shed']} shed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import json
+import hashlib
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+from record_store import StringTable, Record, compact_record
+
+# Run a full sync at least this often, so deleted or unpublished nodes are dropped
+FULL_SYNC_INTERVAL = 24 * 3600
+
+
+def node_key(node: Dict[str, Any]) -> str:
+    """Stable identity of a CMS node across syncs"""
+    for field in ("databaseId", "uri", "slug"):
+        if node.get(field):
+            return f"{field}:{node[field]}"
+    return "title:" + str(node.get("title", ""))
+
+
+class SyncedNode:
+    __slots__ = ("hash", "record", "index_source", "tokens")
+
+    def __init__(self, hash: str, record: Record, index_source: Any, tokens: int):
+        self.hash = hash
+        self.record = record
+        self.index_source = index_source
+        self.tokens = tokens
+
+
+class CorpusSync:
+    """Reduced nodes of one CMS corpus, kept current by incremental syncs.
+
+    Every fetched node is hashed; only nodes whose content hash changed are
+    reduced again, so a sync costs in proportion to the number of changes.
+    """
+
+    def __init__(self):
+        self.nodes: Dict[str, SyncedNode] = {}
+        # Interned locations and date labels shared by all records
+        self.strings = StringTable()
+        self.last_sync = 0.0
+        self.last_full_sync = 0.0
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def modified_since(self, now: float) -> Optional[date]:
+        """Date to fetch modified nodes from, or None when a full sync is due"""
+        if not self.nodes or now - self.last_full_sync > FULL_SYNC_INTERVAL:
+            return None
+        # WPGraphQL date queries have day granularity and use the site timezone,
+        # so go back a day; unchanged nodes are skipped by their hash anyway
+        return (datetime.fromtimestamp(self.last_sync) - timedelta(days=1)).date()
+
+    def begin(self, full: bool, started_at: float) -> "SyncRun":
+        """Start merging a sync; a full sync also removes nodes it does not see"""
+        return SyncRun(self, full, started_at)
+
+    def records(self) -> List[Record]:
+        return [node.record for node in self.nodes.values()]
+
+    def index_sources(self) -> List[Any]:
+        return [node.index_source for node in self.nodes.values()]
+
+    def original_tokens(self) -> int:
+        """Tokens of the raw CMS nodes, as if the whole payload were sent"""
+        return sum(node.tokens for node in self.nodes.values())
+
+
+class SyncRun:
+    """One sync in progress, merged a page of nodes at a time.
+
+    Raw nodes are reduced as they arrive and then dropped, so only the
+    compact records and content hashes stay in memory. Changed nodes are
+    staged in the run and only applied to the sync state by finish() (or
+    apply()), so a sync that fails part way leaves the state as it was and
+    the retry sees the same changes again.
+    """
+
+    def __init__(self, sync: CorpusSync, full: bool, started_at: float):
+        self.sync = sync
+        self.full = full
+        self.started_at = started_at
+        self.seen = set()
+        # Reduced nodes whose content hash changed, by key
+        self.updates: Dict[str, SyncedNode] = {}
+        self.fetched = 0
+        self.changed = 0
+        self.removed = 0
+
+    def merge(self, raw_nodes: List[Dict[str, Any]],
+              reduce_nodes: Callable[[List[Dict[str, Any]]], List[Tuple[Dict[str, Any], Any]]],
+              count_tokens: Callable[[str], int]) -> None:
+        """Apply a page of fetched nodes, reducing only those whose content hash changed.
+
+        The changed nodes are reduced together, in order, so their HTML can be
+        parsed as one batch.
+        """
+        nodes, updates = self.sync.nodes, self.updates
+        changed = []
+        for node in raw_nodes:
+            if not isinstance(node, dict):
+                continue
+            self.fetched += 1
+            key = node_key(node)
+            self.seen.add(key)
+            serialized = json.dumps(node, ensure_ascii=False, sort_keys=True)
+            digest = hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+            current = updates.get(key) or nodes.get(key)
+            if current is not None and current.hash == digest:
+                continue
+            changed.append((key, node, digest, count_tokens(serialized)))
+        if not changed:
+            return
+        reduced = reduce_nodes([node for _, node, _, _ in changed])
+        for (key, _, digest, tokens), (record, index_source) in zip(changed, reduced):
+            record = compact_record(record, self.sync.strings)
+            if key not in updates:
+                self.changed += 1
+            updates[key] = SyncedNode(digest, record, index_source, tokens)
+
+    def apply(self) -> None:
+        """Apply the changed nodes merged so far, e.g. the pages fetched before a failed first sync"""
+        self.sync.nodes.update(self.updates)
+        self.updates = {}
+
+    def finish(self) -> None:
+        """Complete the sync: apply the changes, prune unseen nodes after a full sync and record its time"""
+        self.apply()
+        if self.full:
+            for key in [key for key in self.sync.nodes if key not in self.seen]:
+                del self.sync.nodes[key]
+                self.removed += 1
+            self.sync.strings.retain(self.sync.records())
+            self.sync.last_full_sync = self.started_at
+        self.sync.last_sync = self.started_at
@@ -0,0 +1,154 @@
+import time
+import datetime
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from google.generativeai import caching
+from google.generativeai import GenerativeModel
+
+# Gemini only caches contents of at least this many tokens
+CONTEXT_CACHE_MIN_TOKENS = 4096
+
+
+class Prompt:
+    """A Gemini prompt split into a static prefix and the per-query rest.
+
+    The static part (system prompt, and the whole corpus when it is sent)
+    comes first so it can be reused across queries; cache_key is set when
+    it holds a whole corpus that may be served from a cached content.
+    """
+    __slots__ = ("static", "dynamic", "cache_key")
+
+    def __init__(self, static: str, dynamic: str, cache_key: Optional[Hashable] = None):
+        self.static = static
+        self.dynamic = dynamic
+        self.cache_key = cache_key
+
+    @property
+    def full(self) -> str:
+        return self.static + self.dynamic
+
+
+class GeminiCacheBackend:
+    """Creates Gemini cached contents and models that generate from them"""
+
+    def __init__(self, model_name: str, generation_config: Dict[str, Any]):
+        self.model_name = model_name
+        self.generation_config = generation_config
+
+    def create(self, display_name: str, contents: str, ttl: float) -> Any:
+        return caching.CachedContent.create(model=self.model_name, display_name=display_name, contents=[contents],
+                                            ttl=datetime.timedelta(seconds=ttl))
+
+    def model(self, handle: Any) -> Any:
+        return GenerativeModel.from_cached_content(cached_content=handle, generation_config=self.generation_config)
+
+    def delete(self, handle: Any) -> None:
+        handle.delete()
+
+
+class ContextCache:
+    """One cached-content handle per corpus version, kind and encoding.
+
+    Handles are created when a corpus is (re)built and replaced, deleting
+    the old one, when its version changes. They expire after ttl seconds
+    at the provider, so they are recreated before that.
+    """
+
+    def __init__(self, backend, ttl: float = 3 * 3600, min_tokens: int = CONTEXT_CACHE_MIN_TOKENS):
+        self.backend = backend
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self._handles: Dict[Hashable, Tuple[Any, float]] = {}
+        self._models: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def prepare(self, key: Hashable, contents: str, tokens: int) -> bool:
+        """Create a handle for key (kind, version, encoding) unless a live one exists.
+
+        Returns False when the contents are too small to be cached.
+        """
+        if tokens < self.min_tokens:
+            return False
+        with self._lock:
+            entry = self._handles.get(key)
+            # Recreate a little before the provider expires it
+            if entry is not None and time.time() < entry[1] - 60:
+                return True
+        handle = self.backend.create(f"{key[0]}-{key[1]}", contents, self.ttl)
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is not None and time.time() < entry[1] - 60:
+                # Another refresh created one meanwhile
+                stale_handles = [handle]
+            else:
+                stale = [k for k in self._handles if k[0] == key[0] and k != key]
+                stale_handles = [self._handles.pop(k)[0] for k in stale]
+                if entry is not None:
+                    stale_handles.append(entry[0])
+                for k in stale:
+                    self._models.pop(k, None)
+                self._handles[key] = (handle, time.time() + self.ttl)
+                self._models[key] = self.backend.model(handle)
+        for old in stale_handles:
+            self.discard_handle(old)
+        return True
+
+    def model(self, key: Hashable) -> Optional[Any]:
+        """Model generating from the cached content of key, if there is a live handle"""
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is None or time.time() >= entry[1]:
+                return None
+            return self._models[key]
+
+    def discard(self, key: Hashable) -> None:
+        """Forget the handle of key, e.g. after the provider rejected it"""
+        with self._lock:
+            entry = self._handles.pop(key, None)
+            self._models.pop(key, None)
+        if entry is not None:
+            self.discard_handle(entry[0])
+
+    def discard_handle(self, handle: Any) -> None:
+        # Deleting is best effort, the provider drops the handle at its ttl anyway
+        try:
+            self.backend.delete(handle)
+        except Exception:
+            pass
+
+
+class StaticPromptCache:
+    """Static corpus prompt prefixes and their token counts, per (kind, version, encoding).
+
+    Encoding the whole corpus and counting its tokens is done once per
+    corpus version and encoding instead of on every request that sends it.
+    Storing a new version of a kind drops the older versions of that kind.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Tuple[str, int]]) -> Tuple[str, int]:
+        """Cached (text, tokens) of key (kind, version, encoding), or build() and store them"""
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        # Concurrent first requests may both build it; the results are the same
+        entry = build()
+        with self._lock:
+            for stale in [k for k in self._entries if k[0] == key[0] and k[1] != key[1]]:
+                del self._entries[stale]
+            self._entries[key] = entry
+        return entry
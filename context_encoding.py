@@ -0,0 +1,106 @@
+import json
+from functools import partial
+from typing import List, Dict, Any, Callable
+
+
+def encode_json(records: List[Dict[str, Any]]) -> str:
+    """One JSON object per record, repeating every key (the original format)"""
+    return json.dumps(records, ensure_ascii=False)
+
+
+def _cell(value) -> str:
+    if isinstance(value, (list, tuple)):
+        value = "; ".join(str(item) for item in value)
+    elif value is None:
+        value = ""
+    # Tabs and newlines would break the row structure
+    return " ".join(str(value).split())
+
+
+def _uri_prefix(uris: List[str]) -> str:
+    """Longest shared path prefix of the uris, ending in a slash"""
+    uris = [uri for uri in uris if uri]
+    if len(uris) < 2:
+        return ""
+    first, last = min(uris), max(uris)
+    length = 0
+    while length < min(len(first), len(last)) and first[length] == last[length]:
+        length += 1
+    return first[:first.rfind("/", 0, length) + 1] if length else ""
+
+
+def encode_tabular(records: List[Dict[str, Any]], dictionary: bool = False, relative_uris: bool = False) -> str:
+    """Header-once, tab-separated rows; list values are joined with "; ".
+
+    With dictionary=True, columns whose values repeat (e.g. locations) are
+    listed once with short ids that the rows refer to, where that is shorter.
+    With relative_uris=True, the uri prefix shared by all records is stated once.
+    """
+    columns: List[str] = []
+    for record in records:
+        for key in record:
+            if key not in columns:
+                columns.append(key)
+    rows = [[_cell(record.get(column)) for column in columns] for record in records]
+
+    lines = []
+    if relative_uris and "uri" in columns:
+        position = columns.index("uri")
+        prefix = _uri_prefix([row[position] for row in rows])
+        if len(prefix) > 1:
+            lines.append(f"uri-prefix: {prefix}")
+            for row in rows:
+                if row[position].startswith(prefix):
+                    row[position] = row[position][len(prefix):]
+
+    if dictionary:
+        for position, column in enumerate(columns):
+            values = [row[position] for row in rows if row[position]]
+            distinct = list(dict.fromkeys(values))
+            ids = {value: f"{column[0].upper()}{i}" for i, value in enumerate(distinct, 1)}
+            listed = sum(len(ids[value]) + len(value) + 2 for value in distinct) + len(column) + 2
+            if listed + sum(len(ids[value]) for value in values) >= sum(len(value) for value in values):
+                continue
+            lines.append(f"{column}:")
+            lines.extend(f"{ids[value]}\t{value}" for value in distinct)
+            for row in rows:
+                row[position] = ids.get(row[position], "")
+
+    lines.append("\t".join(columns))
+    lines.extend("\t".join(row) for row in rows)
+    return "\n".join(lines)
+
+
+CONTEXT_ENCODERS: Dict[str, Callable[[List[Dict[str, Any]]], str]] = {
+    "json": encode_json,
+    "tabular": encode_tabular,
+    "tabular-compact": partial(encode_tabular, dictionary=True, relative_uris=True),
+}
+
+
+_TABULAR_FORMAT = ("Datan är en tabell: första raden innehåller kolumnnamnen och varje följande rad är en post, "
+                   "med kolumnerna separerade av tabbar. Flera värden i samma cell är separerade med \"; \".")
+
+# How each encoding is explained to the model, after the system prompt (JSON needs no explanation)
+CONTEXT_FORMATS: Dict[str, str] = {
+    "json": "",
+    "tabular": _TABULAR_FORMAT,
+    "tabular-compact": _TABULAR_FORMAT + (
+        " Före tabellen kan det finnas listor under rubriken \"kolumnnamn:\" med ett kort id och ett värde per rad, "
+        "t.ex. \"L1\" och en plats; i tabellen står då id:t i stället för värdet. Skriv alltid ut värdet, aldrig id:t. "
+        "Raden \"uri-prefix:\" anger den gemensamma början på alla uri:er i tabellen; sätt alltid prefixet framför uri:n "
+        "och ange den fullständiga uri:n i svaret."),
+}
+
+
+def describe_encoding(name: str) -> str:
+    """Explanation of an encoding's format for the prompt, empty for JSON"""
+    return CONTEXT_FORMATS.get(name, "")
+
+
+def get_encoder(name: str) -> Callable[[List[Dict[str, Any]]], str]:
+    """Look up a context encoder by name"""
+    try:
+        return CONTEXT_ENCODERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown context encoding '{name}', expected one of {', '.join(CONTEXT_ENCODERS)}") from None
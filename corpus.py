@@ -0,0 +1,56 @@
+import time
+import hashlib
+from typing import List
+
+from record_store import Record, encode_records
+
+
+class PreparedCorpus:
+    """Reduced CMS records and the prompt context built from them.
+
+    A corpus is built once per refresh and only read by the ask_* methods,
+    so the HTML reduction and token counting never run on the request path.
+    The serialized context is not kept here; the requests that need the
+    whole corpus share one static prompt per version and encoding
+    (StaticPromptCache), and full concatenated prompts are only built when
+    no cached content holds the corpus.
+    """
+
+    def __init__(self, kind: str, records: List[Record], context: str,
+                 original_tokens: int, reduced_tokens: int, built_at: float = None, version: str = None):
+        self.kind = kind
+        self.records = records
+        self.original_tokens = original_tokens
+        self.reduced_tokens = reduced_tokens
+        self.built_at = built_at if built_at is not None else time.time()
+        # Optional retrieval index built alongside the records (e.g. PageIndex)
+        self.index = None
+        # Content-derived version, stable across processes for the same data (given when
+        # the corpus is loaded rather than built)
+        self.version = version or hashlib.sha1(context.encode("utf-8")).hexdigest()[:12]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def context(self) -> str:
+        """All records in the JSON prompt format"""
+        return encode_records(self.records)
+
+    @property
+    def token_reduction(self) -> int:
+        return self.original_tokens - self.reduced_tokens
+
+    @property
+    def token_reduction_percent(self) -> float:
+        if self.original_tokens <= 0:
+            return 0.0
+        return self.token_reduction / self.original_tokens * 100
+
+    def token_stats(self) -> str:
+        """Human readable token statistics, as logged at refresh time"""
+        return (
+            f"{self.kind.capitalize()} tokens - Original: {self.original_tokens}, "
+            f"Reduced: {self.reduced_tokens}, "
+            f"Saved: {self.token_reduction} ({self.token_reduction_percent:.1f}%)"
+        )
@@ -0,0 +1,172 @@
+import re
+import heapq
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+# rcrWeekDay may come as English or Swedish day names
+WEEKDAYS = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+    "måndag": 0, "tisdag": 1, "onsdag": 2, "torsdag": 3, "fredag": 4, "lördag": 5, "söndag": 6,
+}
+
+# Upper bound on occurrences expanded from a single recurrence rule
+MAX_RULE_OCCURRENCES = 520
+
+# Occurrences spanning more days than this (season-long exhibitions etc.) are kept apart
+# and always checked, so they do not widen the scan window of every lookup
+LONG_OCCURRENCE_DAYS = 31
+
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+
+
+def parse_date(value) -> Optional[date]:
+    """Parse CMS date values like 2025-07-01, 2025-07-01 18:00 or 20250701"""
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip()
+    for fmt, length in (("%Y-%m-%d", 10), ("%Y%m%d", 8)):
+        try:
+            return datetime.strptime(value[:length], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_date_window(query: str) -> Optional[Tuple[date, date]]:
+    """Find an explicit ISO date or date range in a query, e.g. the weekend
+    range added by process_date_references in app.py"""
+    found = []
+    for match in ISO_DATE_RE.finditer(query):
+        try:
+            found.append(date(int(match.group(1)), int(match.group(2)), int(match.group(3))))
+        except ValueError:
+            continue
+    if not found:
+        return None
+    return min(found), max(found)
+
+
+def expand_occasions(occasions) -> List[Tuple[date, date, str]]:
+    """Concrete (start, end, label) tuples for individual occasions"""
+    expanded = []
+    for occ in occasions or []:
+        if not isinstance(occ, dict):
+            continue
+        start = parse_date(occ.get('startDate'))
+        if not start:
+            continue
+        end = max(parse_date(occ.get('endDate')) or start, start)
+        # Same labels as GeminiTools.format_dates
+        label = occ['startDate'] if end == start else f"{occ['startDate']} to {occ.get('endDate')}"
+        expanded.append((start, end, label))
+    return expanded
+
+
+def expand_rule(rule) -> List[Tuple[date, date, str]]:
+    """Concrete (day, day, label) tuples for a weekly recurrence rule"""
+    if not isinstance(rule, dict):
+        return []
+    weekday = WEEKDAYS.get(str(rule.get('rcrWeekDay') or '').strip().lower())
+    start = parse_date(rule.get('rcrStartDate'))
+    end = parse_date(rule.get('rcrEndDate'))
+    if weekday is None or not start or not end:
+        return []
+
+    try:
+        interval = max(int(rule.get('rcrWeeklyInterval') or 1), 1)
+    except (TypeError, ValueError):
+        interval = 1
+
+    exceptions = set()
+    for exc in rule.get('rcrExceptions') or []:
+        if isinstance(exc, dict):
+            exc_date = parse_date(exc.get('rcrExcDate'))
+            if exc_date:
+                exceptions.add(exc_date)
+
+    start_time = rule.get('rcrStartTime') or ''
+    day = start + timedelta(days=(weekday - start.weekday()) % 7)
+    expanded = []
+    while day <= end and len(expanded) < MAX_RULE_OCCURRENCES:
+        if day not in exceptions:
+            label = f"{day.isoformat()} {start_time}".strip()
+            expanded.append((day, day, label))
+        day += timedelta(weeks=interval)
+    return expanded
+
+
+class EventIndex:
+    """Event occurrences sorted by start date for O(log n) range lookups.
+
+    Occurrences are stored as parallel arrays of start/end ordinals, so an
+    overlap query bisects on start and only scans candidates that began at
+    most `max_duration` days before the window. Occurrences longer than
+    LONG_OCCURRENCE_DAYS go to a second set of arrays that every lookup
+    checks in full, which keeps `max_duration` (and the scan) short.
+    """
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.event_ids: List[int] = []
+        self.labels: List[str] = []
+        self.long_starts: List[int] = []
+        self.long_ends: List[int] = []
+        self.long_event_ids: List[int] = []
+        self.long_labels: List[str] = []
+        self.undated: List[int] = []
+        self.max_duration = 0
+
+    @classmethod
+    def build(cls, schedules: List[Dict[str, Any]]) -> "EventIndex":
+        """Build an index from the acfGroupEvent of each event; ids are positions in `schedules`"""
+        index = cls()
+        occurrences = []
+        for event_id, acf_event in enumerate(schedules):
+            acf_event = acf_event or {}
+            expanded = expand_occasions(acf_event.get('occasions'))
+            for rule in acf_event.get('rcrRules') or []:
+                expanded.extend(expand_rule(rule))
+            if not expanded:
+                index.undated.append(event_id)
+            for start, end, label in expanded:
+                occurrences.append((start.toordinal(), end.toordinal(), event_id, label))
+
+        occurrences.sort()
+        for start, end, event_id, label in occurrences:
+            if end - start > LONG_OCCURRENCE_DAYS:
+                index.long_starts.append(start)
+                index.long_ends.append(end)
+                index.long_event_ids.append(event_id)
+                index.long_labels.append(label)
+                continue
+            index.starts.append(start)
+            index.ends.append(end)
+            index.event_ids.append(event_id)
+            index.labels.append(label)
+            index.max_duration = max(index.max_duration, end - start)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.starts) + len(self.long_starts)
+
+    def lookup(self, start: date, end: Optional[date] = None) -> List[Tuple[int, List[str]]]:
+        """Events with an occurrence overlapping [start, end] (open-ended if end is None).
+
+        Returns (event_id, occurrence labels) ordered by first matching occurrence.
+        """
+        window_start = start.toordinal()
+        lo = bisect_left(self.starts, window_start - self.max_duration)
+        hi = bisect_right(self.starts, end.toordinal()) if end else len(self.starts)
+        long_hi = bisect_right(self.long_starts, end.toordinal()) if end else len(self.long_starts)
+
+        # Both sets are sorted by start, so merging them keeps the occurrence order
+        short = ((self.starts[i], self.event_ids[i], self.labels[i])
+                 for i in range(lo, hi) if self.ends[i] >= window_start)
+        long = ((self.long_starts[i], self.long_event_ids[i], self.long_labels[i])
+                for i in range(long_hi) if self.long_ends[i] >= window_start)
+        matches: Dict[int, List[str]] = {}
+        for _, event_id, label in heapq.merge(short, long, key=lambda occurrence: occurrence[0]):
+            matches.setdefault(event_id, []).append(label)
+        return list(matches.items())
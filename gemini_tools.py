@@ -1,38 +1,207 @@
-import os
-import json
 import time
-import re
-import html
+import asyncio
+import threading
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 import requests
 import tiktoken
-from bs4 import BeautifulSoup
 from google.generativeai import GenerativeModel
 import google.generativeai as genai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterator, AsyncIterator, Hashable
+from corpus import PreparedCorpus
+from single_flight import SingleFlight
+from snapshot import save_snapshot, load_snapshot
+from cms_sync import CorpusSync, SyncRun
+from record_store import as_dict, encode_records
+from context_encoding import get_encoder, describe_encoding
+from answer_cache import AnswerCache, normalize_query
+from context_cache import ContextCache, GeminiCacheBackend, Prompt, StaticPromptCache
+from html_reduce import HtmlReducer, extract_text
+from admission import UpstreamLimiter, UpstreamBusy, is_rate_limited
+from tracing import span, start_span, use_span, current_span
+from structured_log import LogWriter
+from shared_corpus import SharedCorpus, SHARED_POLL_INTERVAL
+from page_index import PageIndex
+from event_index import EventIndex, parse_date_window
+
+# Timeout in seconds for each CMS GraphQL request
+CMS_TIMEOUT = 60.0
+
+# Nodes per GraphQL page (WPGraphQL caps connections at 100 by default)
+CMS_PAGE_SIZE = 100
+
+# Seconds to wait before retrying a refresh that failed or returned no data
+REFRESH_RETRY_INTERVAL = 300
+
+# Maximum number of events sent to Gemini after date pre-filtering
+EVENTS_MAX_RECORDS = 200
+
+# Maximum number of concrete occurrence dates listed per event
+EVENT_DATES_PER_RECORD = 10
+
+# Number of page passages retrieved from the page index for each pages query
+PAGE_PASSAGES_TOP_K = 8
+
+# Tool answer when Gemini has no free slot, so GPT-4o can tell the visitor to try again shortly
+GEMINI_BUSY_MESSAGE = "Tjänsten har många förfrågningar just nu. Be besökaren försöka igen om en liten stund."
+
+class CMSFetchError(Exception):
+    """Raised while streaming CMS nodes when a GraphQL request fails"""
+
 
 class GeminiTools:
-    def __init__(self, google_api_key: str, cms_url: str = "https://cms.falkenberg.se/graphql", log_file: str = "gemini_log.txt"):
+    EVENTS_QUERY = """
+        query AllEvent($first: Int!, $after: String) {
+          allEvent(first: $first, after: $after) {
+            pageInfo {
+                endCursor
+                hasNextPage
+            }
+            nodes {
+                databaseId
+                modified
+                content
+                location {
+                    active
+                    name
+                }
+                slug
+                title
+                uri
+                acfGroupEvent {
+                    bookingLink
+                    occasions {
+                        startDate
+                        endDate
+                    }
+                    rcrRules {
+                        rcrStartDate
+                        rcrEndDate
+                        rcrStartTime
+                        rcrEndTime
+                        rcrWeekDay
+                        rcrWeeklyInterval
+                        rcrExceptions {
+                            rcrExcDate
+                        }
+                    }
+                }
+                date
+            }
+          }
+        }
+        """
+    
+    # Incremental syncs filter allEvent on the modification date; full syncs send no where argument,
+    # so they do not depend on the name of the custom connection's where type
+    EVENTS_MODIFIED_QUERY = EVENTS_QUERY.replace(
+        "$after: String)", "$after: String, $where: RootQueryToEventConnectionWhereArgs)").replace(
+        "after: $after)", "after: $after, where: $where)")
+    
+    PAGES_QUERY = """
+        query Pages($first: Int!, $after: String, $where: RootQueryToPageConnectionWhereArgs) {
+          pages(first: $first, after: $after, where: $where) {
+            pageInfo {
+              endCursor
+              hasNextPage
+            }
+            nodes {
+              databaseId
+              modified
+              content
+              date
+              title
+              uri
+            }
+          }
+        }
+        """
+    
+    # Static system prompts, sent first so the prompt prefix is shared across queries
+    EVENTS_SYSTEM_PROMPT = """Du är en expert på evenemang i Falkenbergs kommun. Besvara frågan om evenemang baserat på den data som tillhandahålls.
+
+        VIKTIGT:
+        - Prioritera ALLTID kommande evenemang (händelser från dagens datum och framåt)
+        - Visa endast historiska evenemang om användaren specifikt frågar efter dem
+
+        Format för svar:
+        **Evenemang:**
+        - **[TITEL]**: [BESKRIVNING]. Datum: [DATUM]. Plats: [PLATS]. URI: [URI]
+        - **[TITEL]**: [BESKRIVNING]. Datum: [DATUM]. Plats: [PLATS]. URI: [URI]
+
+        Sortera evenemangen kronologiskt med de närmast kommande först.
+        Prioritera relevans och var koncis men informativ."""
+    
+    PAGES_SYSTEM_PROMPT = """Du är en expert på Falkenbergs kommun och dess webbplats. Besvara frågan baserat på innehållet från webbsidorna på falkenberg.se. 
+
+Fokusera på att ge ett detaljerat och korrekt svar baserat på informationen från webbsidorna. Ange uri/länk till relevanta sidor.
+
+Prioritera relevans och var koncis men informativ."""
+    
+    # Log level per log source (others are INFO)
+    LOG_LEVELS = {"ERROR": "ERROR", "GEMINI": "DEBUG"}
+    
+    def __init__(self, google_api_key: str, cms_url: str = "https://cms.falkenberg.se/graphql", log_file: str = "gemini_log.jsonl",
+                 snapshot_dir: Optional[str] = "snapshots", context_encoding: str = "json",
+                 answer_cache_size: int = 256, answer_cache_ttl: float = 900, context_cache_backend=None,
+                 reduce_workers: int = 0, gemini_limiter: Optional[UpstreamLimiter] = None,
+                 log_writer: Optional[LogWriter] = None, shared_corpus_dir: Optional[str] = None,
+                 gemini_endpoint: Optional[str] = None):
         self.cms_url = cms_url
         self.google_api_key = google_api_key
         self.log_file = log_file
+        # JSON-lines log written in the background (log_file with default rotation unless one is given)
+        self.log_writer = log_writer or LogWriter(log_file)
+        # Directory for on-disk corpus snapshots (None disables them)
+        self.snapshot_dir = snapshot_dir
+        # Processes sharing shared_corpus_dir sync with the CMS once (the leader) and map the leader's corpus
+        self.shared = SharedCorpus(shared_corpus_dir) if shared_corpus_dir else None
+        # Default format of the data sent to Gemini (see context_encoding.py)
+        get_encoder(context_encoding)
+        self.context_encoding = context_encoding
+        # HTML text extraction of refreshed nodes, in worker processes when reduce_workers > 0
+        self.html_reducer = HtmlReducer(reduce_workers)
         
-        # Configure Gemini API
-        genai.configure(api_key=google_api_key)
+        # Configure Gemini API (gemini_endpoint points it at another host, e.g. a stub over plain HTTP)
+        if gemini_endpoint:
+            genai.configure(api_key=google_api_key, transport="rest", client_options={"api_endpoint": gemini_endpoint})
+        else:
+            genai.configure(api_key=google_api_key)
+        generation_config = {
+            "temperature": 0.2,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+        }
         self.model = GenerativeModel(
             model_name="gemini-2.0-flash",
-            generation_config={
-                "temperature": 0.2,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-            }
+            generation_config=generation_config
         )
+        # Concurrent Gemini requests, with a bounded wait queue and 429 backoff
+        self.gemini_limiter = gemini_limiter or UpstreamLimiter("gemini")
+        # The REST transport has no async client, so async calls run the sync client in these threads
+        # (one per Gemini slot, apart from the default executor used by refreshes)
+        self._rest_executor = ThreadPoolExecutor(max_workers=self.gemini_limiter.max_concurrent,
+                                                 thread_name_prefix="gemini-rest") if gemini_endpoint else None
+        # Cached contents of the static corpus prompt prefix (caching needs an explicit model version)
+        self.context_cache = ContextCache(context_cache_backend or GeminiCacheBackend("models/gemini-2.0-flash-001", generation_config))
+        # The static corpus prompts those contents are created from, and their token counts
+        self.static_prompts = StaticPromptCache()
         
         # Cache setup for events
-        self.events_cache = {"data": None, "last_updated": 0, "cache_duration": 1800}
+        self.events_cache = {"name": "events", "data": None, "corpus": None, "last_updated": 0, "cache_duration": 1800,
+                             "retry_after": 0, "flight": SingleFlight(), "sync": CorpusSync()}
         
         # Cache setup for pages
-        self.pages_cache = {"data": None, "last_updated": 0, "cache_duration": 3600}
+        self.pages_cache = {"name": "pages", "data": None, "corpus": None, "last_updated": 0, "cache_duration": 3600,
+                            "retry_after": 0, "flight": SingleFlight(), "sync": CorpusSync()}
+        
+        # Gemini answers per tool, corpus version and normalized query (invalidated when a corpus changes)
+        self.answer_cache = AnswerCache(answer_cache_size, answer_cache_ttl)
+        
+        # Keep references to background refresh tasks so they are not garbage collected
+        self._refresh_tasks = set()
         
         # Setup tokenizer
         try:
@@ -43,21 +212,27 @@ class GeminiTools:
         except Exception as e:
             self._log("ERROR", f"Failed to initialize tokenizer: {str(e)}")
             self.tokenizer = None
-            
+        
         # Initialize log file
         self._log("SYSTEM", "Initialized GeminiTools")
+        if self.shared:
+            role = "leader" if self.shared.try_lead() else "follower"
+            self._log("SYSTEM", f"Sharing the corpus in {shared_corpus_dir} as refresh {role}")
         
-        # Load event data
-        self.refresh_events_data()
+        # Load event data, from the last snapshot if there is one (refreshed in the background when stale)
+        self._load_initial(self.events_cache)
+        self.get_events_data()
         
         # Load pages data
-        self.refresh_pages_data()
+        self._load_initial(self.pages_cache)
+        self.get_pages_data()
+        
+        if self.shared:
+            threading.Thread(target=self._shared_loop, daemon=True).start()
     
-    def _log(self, source: str, message: str):
-        """Simple logging to file"""
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"[{timestamp}] {source}: {message}\n")
+    def _log(self, source: str, message: str, console: bool = False, **fields: Any):
+        """Queue a log record (console: also print it); the file is written in the background"""
+        self.log_writer.write(self.LOG_LEVELS.get(source, "INFO"), source, message, console, **fields)
     
     def count_tokens(self, text: str) -> int:
         """Count the number of tokens in a string"""
@@ -72,78 +247,68 @@ class GeminiTools:
     
     # EVENTS FUNCTIONS
     
-    def fetch_events_data(self) -> List[Dict[str, Any]]:
-        """Fetch events data from CMS GraphQL API"""
-        query = """
-        query AllEvent {
-          allEvent(first: 10000) {
-            nodes {            
-                content
-                location {
-                    active
-                    name
-                }
-                slug
-                title
-                uri
-                acfGroupEvent {
-                    bookingLink
-                    occasions {
-                        startDate
-                        endDate
-                    }
-                    rcrRules {
-                        rcrStartDate
-                        rcrEndDate
-                        rcrStartTime
-                        rcrEndTime
-                        rcrWeekDay
-                        rcrWeeklyInterval
-                        rcrExceptions {
-                            rcrExcDate
-                        }
-                    }
-                }
-                date
-            }
-          }
-        }
-        """
-        
+    def stream_events_data(self, modified_since: Optional[date] = None) -> Iterator[List[Dict[str, Any]]]:
+        """Stream events from CMS GraphQL API one page of nodes at a time, all of them
+        or only nodes modified since a date (raises CMSFetchError on failure)"""
+        if modified_since is None:
+            return self._stream_nodes(self.EVENTS_QUERY, "allEvent", "events")
+        return self._stream_nodes(self.EVENTS_MODIFIED_QUERY, "allEvent", "events", self._where({}, modified_since))
+    
+    def astream_events_data(self, modified_since: Optional[date] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Async version of stream_events_data"""
+        if modified_since is None:
+            return self._astream_nodes(self.EVENTS_QUERY, "allEvent", "events")
+        return self._astream_nodes(self.EVENTS_MODIFIED_QUERY, "allEvent", "events", self._where({}, modified_since))
+    
+    def fetch_events_data(self, modified_since: Optional[date] = None) -> Optional[List[Dict[str, Any]]]:
+        """Fetch events data from CMS GraphQL API (None if a request failed)"""
         try:
-            response = requests.post(
-                self.cms_url,
-                json={"query": query},
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                nodes = data.get("data", {}).get("allEvent", {}).get("nodes", [])
-                return nodes
-            else:
-                self._log("ERROR", f"Failed to fetch events: HTTP {response.status_code}")
-                return []
-        except Exception as e:
-            self._log("ERROR", f"Error fetching events: {str(e)}")
-            return []
+            return [node for nodes in self.stream_events_data(modified_since) for node in nodes]
+        except CMSFetchError:
+            return None
+    
+    async def afetch_events_data(self, modified_since: Optional[date] = None) -> Optional[List[Dict[str, Any]]]:
+        """Fetch events data from CMS GraphQL API without blocking the event loop"""
+        try:
+            return [node async for nodes in self.astream_events_data(modified_since) for node in nodes]
+        except CMSFetchError:
+            return None
     
     def get_events_data(self) -> List[Dict[str, Any]]:
-        """Get events data (from cache if valid)"""
-        current_time = time.time()
+        """Get events data, serving the last snapshot while a stale cache refreshes in the background"""
+        self._revalidate(self.events_cache, self.refresh_events_data)
         
-        if (self.events_cache["data"] is None or 
-            current_time - self.events_cache["last_updated"] > self.events_cache["cache_duration"]):
-            self.refresh_events_data()
+        return self.events_cache["data"] or []
+    
+    async def aget_events_data(self) -> List[Dict[str, Any]]:
+        """Get events data, serving the last snapshot while a stale cache refreshes in the background"""
+        await self._arevalidate(self.events_cache, self.arefresh_events_data)
         
         return self.events_cache["data"] or []
     
+    def get_events_corpus(self) -> Optional[PreparedCorpus]:
+        """Get the prepared events corpus (revalidating the cache if expired)"""
+        self.get_events_data()
+        return self.events_cache["corpus"]
+    
+    async def aget_events_corpus(self) -> Optional[PreparedCorpus]:
+        """Get the prepared events corpus (revalidating asynchronously if expired)"""
+        await self.aget_events_data()
+        return self.events_cache["corpus"]
+    
     def refresh_events_data(self) -> None:
-        """Refresh the events data and update cache"""
-        fresh_data = self.fetch_events_data()
-        self.events_cache["data"] = fresh_data
-        self.events_cache["last_updated"] = time.time()
-        self._log("SYSTEM", f"Refreshed events data. Total events: {len(fresh_data)}")
+        """Sync the events data with the CMS and update cache"""
+        started_at = time.time()
+        modified_since = self.events_cache["sync"].modified_since(started_at)
+        self._run_sync(self.events_cache, self.stream_events_data(modified_since), modified_since, started_at,
+                       self._sync_event, self.build_events_corpus)
+    
+    async def arefresh_events_data(self) -> None:
+        """Sync the events data and update cache without blocking the event loop"""
+        started_at = time.time()
+        modified_since = self.events_cache["sync"].modified_since(started_at)
+        await self._arun_sync(self.events_cache, self.astream_events_data(modified_since), modified_since, started_at,
+                              self._sync_event, self.build_events_corpus)
     
     def format_dates(self, occasions, rcr_rules=None):
         """Format dates concisely, handling both individual occasions and recurring events"""
@@ -200,34 +365,39 @@ class GeminiTools:
         
         return formatted or ["Date not specified"]
     
+    def extract_text(self, html_content):
+        """Convert HTML content to whitespace-normalized plain text"""
+        return extract_text(html_content)
+    
+    def truncate_text(self, text):
+        """Truncate long descriptions, preferably at the end of a sentence"""
+        if len(text) > 200:
+            last_sentence = text[:200].rfind('.')
+            if last_sentence > 50:
+                return text[:last_sentence+1]
+            return text[:197] + "..."
+        
+        return text
+    
     def clean_html(self, html_content):
         """Clean HTML content to plain text"""
         if not html_content:
             return ""
         
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            text = soup.get_text(separator=' ', strip=True)
-            text = html.unescape(text)
-            text = re.sub(r'\s+', ' ', text).strip()
-            
-            # Truncate long descriptions
-            if len(text) > 200:
-                last_sentence = text[:200].rfind('.')
-                if last_sentence > 50:
-                    return text[:last_sentence+1]
-                return text[:197] + "..."
-            
-            return text
+            return self.truncate_text(self.extract_text(html_content))
         except Exception as e:
             self._log("ERROR", f"Error cleaning HTML: {str(e)}")
             return "Error processing content"
     
-    def reduce_event(self, event):
-        """Reduce a single event to essential information"""
+    def reduce_event(self, event, text: Optional[str] = None):
+        """Reduce a single event to essential information (text: already extracted event text)"""
         try:
             title = event.get('title', '')
-            content = self.clean_html(event.get('content', ''))
+            if text is not None:
+                content = self.truncate_text(text)
+            else:
+                content = self.clean_html(event.get('content', ''))
             uri = event.get('uri', '')
             
             location_obj = event.get('location', {})
@@ -253,166 +423,231 @@ class GeminiTools:
     
     def process_events(self, events_data):
         """Process and reduce all events"""
-        reduced_events = []
+        events = [event for event in events_data if isinstance(event, dict)]
+        texts = self.html_reducer.extract_all([event.get('content') or '' for event in events])
+        return [self.reduce_event(event, text) for event, text in zip(events, texts)]
+    
+    def _sync_event(self, event, text: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Reduce a changed event for the sync state, keeping its schedule for the date index"""
+        return self.reduce_event(event, text), event.get('acfGroupEvent') or {}
+    
+    def build_events_corpus(self, sync: CorpusSync) -> PreparedCorpus:
+        """Build the events corpus together with its date index"""
+        corpus = self.prepare_corpus("event", sync)
+        # Index positions line up with the corpus records
+        start_time = time.time()
+        corpus.index = EventIndex.build(sync.index_sources())
+        self._log("SYSTEM", f"Built event index: {len(corpus.index)} occurrences "
+                            f"in {time.time() - start_time:.2f} seconds")
+        return corpus
+    
+    def select_events(self, query: str, corpus: PreparedCorpus, today: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Pre-filter events to the date window in the query, or to upcoming events.
+        
+        The dates of each selected event are replaced by its concrete
+        occurrences in the window, so recurring events are already resolved.
+        """
+        today = today or date.today()
+        window = parse_date_window(query)
+        if window:
+            matches = corpus.index.lookup(*window)
+        else:
+            # Drop past events unless the query asks for specific dates
+            matches = corpus.index.lookup(today)
         
-        for event in events_data:
-            if isinstance(event, dict):
-                reduced_event = self.reduce_event(event)
-                reduced_events.append(reduced_event)
+        selected = []
+        for event_id, labels in matches[:EVENTS_MAX_RECORDS]:
+            record = as_dict(corpus.records[event_id])
+            record["dates"] = labels[:EVENT_DATES_PER_RECORD]
+            selected.append(record)
         
-        return reduced_events
+        # Events without parseable dates may still be current
+        if not window:
+            for event_id in corpus.index.undated[:EVENTS_MAX_RECORDS - len(selected)]:
+                selected.append(as_dict(corpus.records[event_id]))
+        
+        return selected
     
-    def ask_gemini_about_events(self, query: str) -> str:
-        """Ask Gemini about events based on query"""
-        # Log the query
-        self._log("USER", f"Events query: {query}")
+    def _encode_context(self, records: List[Dict[str, Any]], encoding: Optional[str]) -> str:
+        """Encode prompt records with the given or the default context encoding"""
+        return get_encoder(encoding or self.context_encoding)(records)
+    
+    def _system_prompt(self, system_prompt: str, encoding: Optional[str]) -> str:
+        """System prompt followed by an explanation of the context format, unless it is JSON"""
+        description = describe_encoding(encoding or self.context_encoding)
+        return f"{system_prompt}\n\n{description}" if description else system_prompt
+    
+    def _corpus_context(self, corpus: PreparedCorpus, encoding: Optional[str]) -> Tuple[str, Optional[int]]:
+        """Context for the whole corpus and its token count, if counted at refresh time"""
+        if (encoding or self.context_encoding) == "json":
+            return corpus.context, corpus.reduced_tokens
+        return self._encode_context([as_dict(record) for record in corpus.records], encoding), None
+    
+    def _static_corpus_prompt(self, kind: str, corpus: PreparedCorpus, encoding: Optional[str]) -> Tuple[str, int]:
+        """System prompt followed by the whole corpus, and its token count (built once per version and encoding)"""
+        
+        def build() -> Tuple[str, int]:
+            system_prompt, label = (self.EVENTS_SYSTEM_PROMPT, "Eventdata") if kind == "events" else (self.PAGES_SYSTEM_PROMPT, "Webbsidesdata")
+            prefix = f"{self._system_prompt(system_prompt, encoding)}\n\n{label}: "
+            context, context_tokens = self._corpus_context(corpus, encoding)
+            # A JSON context was counted at refresh time
+            tokens = self.count_tokens(prefix) + context_tokens if context_tokens is not None else self.count_tokens(prefix + context)
+            return prefix + context, tokens
         
+        return self.static_prompts.get_or_build((kind, corpus.version, encoding or self.context_encoding), build)
+    
+    def _corpus_prompt(self, kind: str, corpus: PreparedCorpus, encoding: Optional[str], question: str) -> Tuple[Prompt, int]:
+        """Prompt sending the whole corpus as its static, cacheable prefix"""
+        static, static_tokens = self._static_corpus_prompt(kind, corpus, encoding)
+        cache_key = (kind, corpus.version, encoding or self.context_encoding)
+        return Prompt(static, question, cache_key), static_tokens + self.count_tokens(question)
+    
+    def _build_events_prompt(self, query: str, corpus: PreparedCorpus, encoding: Optional[str] = None) -> Prompt:
+        """Build the Gemini prompt for an events query.
+        
+        The static system prompt comes first and the query last, so the
+        prefix is shared across queries (and cached when it holds the corpus).
+        """
         # Get current date
         current_date = time.strftime("%A, %Y-%m-%d")
         
-        # Get and process events data
-        events_data = self.get_events_data()
-        if not events_data:
-            return "Sorry, I couldn't retrieve any event data at this time."
-        
-        # Count tokens in original data
-        original_events_json = json.dumps(events_data, ensure_ascii=False)
-        original_tokens = self.count_tokens(original_events_json)
+        # Create prompt around the prepared context
+        self._log("USER", f"Chat GPT query: {query} (current date: {current_date})", console=True)
+        question = f"\n\nCurrent date: {current_date}\n\nFråga: {query}"
+        if corpus.index is not None:
+            events = self.select_events(query, corpus)
+            self._log("SYSTEM", f"Selected {len(events)} of {len(corpus)} events")
+            prompt = Prompt(self._system_prompt(self.EVENTS_SYSTEM_PROMPT, encoding), f"\n\nEventdata: {self._encode_context(events, encoding)}{question}")
+            prompt_tokens = self.count_tokens(prompt.full)
+        else:
+            prompt, prompt_tokens = self._corpus_prompt("events", corpus, encoding, question)
+        self._log("TOKENS", f"Event prompt tokens: {prompt_tokens}", console=True, prompt_tokens=prompt_tokens)
+        current_span().set(prompt_tokens=prompt_tokens)
         
-        # Reduce events to save tokens
-        reduced_events = self.process_events(events_data)
+        return prompt
+    
+    def ask_gemini_about_events(self, query: str, encoding: Optional[str] = None) -> str:
+        """Ask Gemini about events based on query (encoding: context encoding, default from the constructor)"""
+        # Log the query
+        self._log("USER", f"Events query: {query}")
         
-        # Count tokens in reduced data
-        reduced_events_json = json.dumps(reduced_events, ensure_ascii=False)
-        reduced_tokens = self.count_tokens(reduced_events_json)
+        # Get the events corpus prepared at refresh time
+        corpus = self.get_events_corpus()
+        if not corpus:
+            return "Sorry, I couldn't retrieve any event data at this time."
         
-        # Calculate token reduction
-        token_reduction = original_tokens - reduced_tokens
-        token_reduction_percent = (token_reduction / original_tokens * 100) if original_tokens > 0 else 0
+        key = self._answer_key("events", query, corpus, encoding)
+        return self._generate(key, lambda: self._build_events_prompt(query, corpus, encoding), "event", "events")
+    
+    async def aask_gemini_about_events(self, query: str, encoding: Optional[str] = None) -> str:
+        """Ask Gemini about events based on query without blocking the event loop"""
+        # Log the query
+        self._log("USER", f"Events query: {query}")
         
-        # Log token counts
-        token_stats = (
-            f"Event tokens - Original: {original_tokens}, "
-            f"Reduced: {reduced_tokens}, "
-            f"Saved: {token_reduction} ({token_reduction_percent:.1f}%)"
-        )
-        self._log("TOKENS", token_stats)
-        print(token_stats)
+        # Get the events corpus prepared at refresh time
+        corpus = await self.aget_events_corpus()
+        if not corpus:
+            return "Sorry, I couldn't retrieve any event data at this time."
         
-        # Simplified system prompt
-               # Simplified system prompt
-        system_prompt = f"""Du är en expert på evenemang i Falkenbergs kommun. Besvara frågan om evenemang baserat på den data som tillhandahålls.
-
-        Current date: {current_date}
-
-        VIKTIGT:
-        - Prioritera ALLTID kommande evenemang (händelser från dagens datum och framåt)
-        - Visa endast historiska evenemang om användaren specifikt frågar efter dem
-
-        Format för svar:
-        **Evenemang:**
-        - **[TITEL]**: [BESKRIVNING]. Datum: [DATUM]. Plats: [PLATS]. URI: [URI]
-        - **[TITEL]**: [BESKRIVNING]. Datum: [DATUM]. Plats: [PLATS]. URI: [URI]
-
-        Sortera evenemangen kronologiskt med de närmast kommande först.
-        Prioritera relevans och var koncis men informativ."""
+        key = self._answer_key("events", query, corpus, encoding)
+        return await self._agenerate(key, lambda: self._build_events_prompt(query, corpus, encoding), "event", "events")
+    
+    def stream_gemini_about_events(self, query: str, encoding: Optional[str] = None) -> Iterator[str]:
+        """Ask Gemini about events, yielding the answer in chunks as they are generated"""
+        # Log the query
+        self._log("USER", f"Events query: {query}")
         
-        # Create context and prompt
-        context = reduced_events_json
-        print("Chat GPT query: ", query)
-        print("Current date: ", current_date)
-        full_prompt = f"{system_prompt}\n\nFråga: {query}\n\nEventdata: {context}"
+        corpus = self.get_events_corpus()
+        if not corpus:
+            yield "Sorry, I couldn't retrieve any event data at this time."
+            return
         
-        # Count tokens in prompt
-        prompt_tokens = self.count_tokens(full_prompt)
-        self._log("TOKENS", f"Event prompt tokens: {prompt_tokens}")
-        print(f"Event prompt tokens: {prompt_tokens}")
+        key = self._answer_key("events", query, corpus, encoding)
+        yield from self._stream_generate(key, lambda: self._build_events_prompt(query, corpus, encoding), "event", "events")
+    
+    async def astream_gemini_about_events(self, query: str, encoding: Optional[str] = None) -> AsyncIterator[str]:
+        """Async version of stream_gemini_about_events"""
+        # Log the query
+        self._log("USER", f"Events query: {query}")
         
-        # Log that we're sending a request
-        self._log("SYSTEM", "Sending event request to Gemini")
+        corpus = await self.aget_events_corpus()
+        if not corpus:
+            yield "Sorry, I couldn't retrieve any event data at this time."
+            return
         
-        try:
-            # Generate response
-            start_time = time.time()
-            response = self.model.generate_content(full_prompt)
-            end_time = time.time()
-            
-            # Log response time
-            response_time = end_time - start_time
-            self._log("SYSTEM", f"Gemini event response time: {response_time:.2f} seconds")
-            print(f"Gemini event response time: {response_time:.2f} seconds")
-            
-            # Count tokens in response
-            response_tokens = self.count_tokens(response.text)
-            self._log("TOKENS", f"Event response tokens: {response_tokens}")
-            print(f"Event response tokens: {response_tokens}")
-            
-            # Log the Gemini response (truncated)
-            self._log("GEMINI", response.text[:100] + "..." if len(response.text) > 100 else response.text)
-            
-            return response.text
-        except Exception as e:
-            error_msg = f"Error from Gemini for events: {str(e)}"
-            self._log("ERROR", error_msg)
-            return f"Ett fel uppstod: {str(e)}"
+        key = self._answer_key("events", query, corpus, encoding)
+        async for chunk in self._astream_generate(key, lambda: self._build_events_prompt(query, corpus, encoding), "event", "events"):
+            yield chunk
     
     # PAGES FUNCTIONS
     
-    def fetch_pages_data(self) -> List[Dict[str, Any]]:
-        """Fetch pages data from CMS GraphQL API"""
-        query = """
-        query Pages {
-          pages(first: 2000, where: { status: PUBLISH, language: SV }) {
-            nodes {
-              content
-              date
-              title
-              uri
-            }
-          }
-        }
-        """
-        
+    def stream_pages_data(self, modified_since: Optional[date] = None) -> Iterator[List[Dict[str, Any]]]:
+        """Stream pages from CMS GraphQL API one page of nodes at a time, all of them
+        or only nodes modified since a date (raises CMSFetchError on failure)"""
+        return self._stream_nodes(self.PAGES_QUERY, "pages", "pages", self._where({"status": "PUBLISH", "language": "SV"}, modified_since))
+    
+    def astream_pages_data(self, modified_since: Optional[date] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Async version of stream_pages_data"""
+        return self._astream_nodes(self.PAGES_QUERY, "pages", "pages", self._where({"status": "PUBLISH", "language": "SV"}, modified_since))
+    
+    def fetch_pages_data(self, modified_since: Optional[date] = None) -> Optional[List[Dict[str, Any]]]:
+        """Fetch pages data from CMS GraphQL API (None if a request failed)"""
         try:
-            response = requests.post(
-                self.cms_url,
-                json={"query": query},
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                nodes = data.get("data", {}).get("pages", {}).get("nodes", [])
-                return nodes
-            else:
-                self._log("ERROR", f"Failed to fetch pages: HTTP {response.status_code}")
-                return []
-        except Exception as e:
-            self._log("ERROR", f"Error fetching pages: {str(e)}")
-            return []
+            return [node for nodes in self.stream_pages_data(modified_since) for node in nodes]
+        except CMSFetchError:
+            return None
+    
+    async def afetch_pages_data(self, modified_since: Optional[date] = None) -> Optional[List[Dict[str, Any]]]:
+        """Fetch pages data from CMS GraphQL API without blocking the event loop"""
+        try:
+            return [node async for nodes in self.astream_pages_data(modified_since) for node in nodes]
+        except CMSFetchError:
+            return None
     
     def get_pages_data(self) -> List[Dict[str, Any]]:
-        """Get pages data (from cache if valid)"""
-        current_time = time.time()
+        """Get pages data, serving the last snapshot while a stale cache refreshes in the background"""
+        self._revalidate(self.pages_cache, self.refresh_pages_data)
         
-        if (self.pages_cache["data"] is None or 
-            current_time - self.pages_cache["last_updated"] > self.pages_cache["cache_duration"]):
-            self.refresh_pages_data()
+        return self.pages_cache["data"] or []
+    
+    async def aget_pages_data(self) -> List[Dict[str, Any]]:
+        """Get pages data, serving the last snapshot while a stale cache refreshes in the background"""
+        await self._arevalidate(self.pages_cache, self.arefresh_pages_data)
         
         return self.pages_cache["data"] or []
     
+    def get_pages_corpus(self) -> Optional[PreparedCorpus]:
+        """Get the prepared pages corpus (revalidating the cache if expired)"""
+        self.get_pages_data()
+        return self.pages_cache["corpus"]
+    
+    async def aget_pages_corpus(self) -> Optional[PreparedCorpus]:
+        """Get the prepared pages corpus (revalidating asynchronously if expired)"""
+        await self.aget_pages_data()
+        return self.pages_cache["corpus"]
+    
     def refresh_pages_data(self) -> None:
-        """Refresh the pages data and update cache"""
-        fresh_data = self.fetch_pages_data()
-        self.pages_cache["data"] = fresh_data
-        self.pages_cache["last_updated"] = time.time()
-        self._log("SYSTEM", f"Refreshed pages data. Total pages: {len(fresh_data)}")
-    
-    def reduce_page(self, page):
-        """Reduce a single page to essential information"""
+        """Sync the pages data with the CMS and update cache"""
+        started_at = time.time()
+        modified_since = self.pages_cache["sync"].modified_since(started_at)
+        self._run_sync(self.pages_cache, self.stream_pages_data(modified_since), modified_since, started_at,
+                       self._sync_page, self.build_pages_corpus)
+    
+    async def arefresh_pages_data(self) -> None:
+        """Sync the pages data and update cache without blocking the event loop"""
+        started_at = time.time()
+        modified_since = self.pages_cache["sync"].modified_since(started_at)
+        await self._arun_sync(self.pages_cache, self.astream_pages_data(modified_since), modified_since, started_at,
+                              self._sync_page, self.build_pages_corpus)
+    
+    def reduce_page(self, page, text: Optional[str] = None):
+        """Reduce a single page to essential information (text: already extracted page text)"""
         try:
             title = page.get('title', '')
-            content = self.clean_html(page.get('content', ''))
+            if text is not None:
+                content = self.truncate_text(text)
+            else:
+                content = self.clean_html(page.get('content', ''))
             uri = page.get('uri', '')
             date = page.get('date', '')
             
@@ -428,106 +663,763 @@ class GeminiTools:
     
     def process_pages(self, pages_data):
         """Process and reduce all pages"""
-        reduced_pages = []
+        pages = [page for page in pages_data if isinstance(page, dict)]
+        texts = self.html_reducer.extract_all([page.get('content') or '' for page in pages])
+        return [self.reduce_page(page, text) for page, text in zip(pages, texts)]
+    
+    def _sync_page(self, page, text: Optional[str] = None) -> Tuple[Dict[str, Any], Tuple[str, str, str]]:
+        """Reduce a changed page for the sync state, keeping its full text for the page index"""
+        try:
+            if text is None:
+                text = self.extract_text(page.get('content', ''))
+        except Exception as e:
+            self._log("ERROR", f"Error extracting page text: {str(e)}")
+            return self.reduce_page(page), (page.get('title', ''), page.get('uri', ''), "")
+        return self.reduce_page(page, text), (page.get('title', ''), page.get('uri', ''), text)
+    
+    def build_page_index(self, page_texts) -> PageIndex:
+        """Build a BM25 passage index over (title, uri, full text) of all pages"""
+        start_time = time.time()
+        index = PageIndex.build(page_texts)
+        self._log("SYSTEM", f"Built page index: {len(index)} passages, {len(index.postings)} terms "
+                            f"in {time.time() - start_time:.2f} seconds")
+        return index
+    
+    def build_pages_corpus(self, sync: CorpusSync) -> PreparedCorpus:
+        """Build the pages corpus together with its passage index"""
+        corpus = self.prepare_corpus("page", sync)
+        corpus.index = self.build_page_index(sync.index_sources())
+        return corpus
+    
+    def _build_pages_prompt(self, query: str, corpus: PreparedCorpus, encoding: Optional[str] = None) -> Prompt:
+        """Build the Gemini prompt for a pages query, static system prompt first and query last"""
+        # Send only the passages most relevant to the query, falling back to
+        # the full reduced corpus when nothing in the index matches
+        passages = corpus.index.search_context(query, PAGE_PASSAGES_TOP_K) if corpus.index else None
+        question = f"\n\nFråga: {query}"
+        if passages:
+            prompt = Prompt(self._system_prompt(self.PAGES_SYSTEM_PROMPT, encoding), f"\n\nWebbsidesdata: {self._encode_context(passages, encoding)}{question}")
+            prompt_tokens = self.count_tokens(prompt.full)
+            self._log("SYSTEM", f"Retrieved {len(passages)} page passages")
+        else:
+            prompt, prompt_tokens = self._corpus_prompt("pages", corpus, encoding, question)
+        self._log("TOKENS", f"Pages prompt tokens: {prompt_tokens}", console=True, prompt_tokens=prompt_tokens)
+        current_span().set(prompt_tokens=prompt_tokens, passages=len(passages) if passages else 0)
+        
+        return prompt
+    
+    def ask_gemini_about_pages(self, query: str, encoding: Optional[str] = None) -> str:
+        """Ask Gemini about pages based on query (encoding: context encoding, default from the constructor)"""
+        # Log the query
+        self._log("USER", f"Pages query: {query}")
         
-        for page in pages_data:
-            if isinstance(page, dict):
-                reduced_page = self.reduce_page(page)
-                reduced_pages.append(reduced_page)
+        # Get the pages corpus prepared at refresh time
+        corpus = self.get_pages_corpus()
+        if not corpus:
+            return "Sorry, I couldn't retrieve any page data at this time."
         
-        return reduced_pages
+        key = self._answer_key("pages", query, corpus, encoding)
+        return self._generate(key, lambda: self._build_pages_prompt(query, corpus, encoding), "pages", "pages")
     
-    def ask_gemini_about_pages(self, query: str) -> str:
-        """Ask Gemini about pages based on query"""
+    async def aask_gemini_about_pages(self, query: str, encoding: Optional[str] = None) -> str:
+        """Ask Gemini about pages based on query without blocking the event loop"""
         # Log the query
         self._log("USER", f"Pages query: {query}")
         
-        # Get and process pages data
-        pages_data = self.get_pages_data()
-        if not pages_data:
+        # Get the pages corpus prepared at refresh time
+        corpus = await self.aget_pages_corpus()
+        if not corpus:
             return "Sorry, I couldn't retrieve any page data at this time."
         
-        # Count tokens in original data
-        original_pages_json = json.dumps(pages_data, ensure_ascii=False)
-        original_tokens = self.count_tokens(original_pages_json)
+        key = self._answer_key("pages", query, corpus, encoding)
+        return await self._agenerate(key, lambda: self._build_pages_prompt(query, corpus, encoding), "pages", "pages")
+    
+    def stream_gemini_about_pages(self, query: str, encoding: Optional[str] = None) -> Iterator[str]:
+        """Ask Gemini about pages, yielding the answer in chunks as they are generated"""
+        # Log the query
+        self._log("USER", f"Pages query: {query}")
         
-        # Reduce pages to save tokens
-        reduced_pages = self.process_pages(pages_data)
+        corpus = self.get_pages_corpus()
+        if not corpus:
+            yield "Sorry, I couldn't retrieve any page data at this time."
+            return
         
-        # Count tokens in reduced data
-        reduced_pages_json = json.dumps(reduced_pages, ensure_ascii=False)
-        reduced_tokens = self.count_tokens(reduced_pages_json)
+        key = self._answer_key("pages", query, corpus, encoding)
+        yield from self._stream_generate(key, lambda: self._build_pages_prompt(query, corpus, encoding), "pages", "pages")
+    
+    async def astream_gemini_about_pages(self, query: str, encoding: Optional[str] = None) -> AsyncIterator[str]:
+        """Async version of stream_gemini_about_pages"""
+        # Log the query
+        self._log("USER", f"Pages query: {query}")
         
-        # Calculate token reduction
-        token_reduction = original_tokens - reduced_tokens
-        token_reduction_percent = (token_reduction / original_tokens * 100) if original_tokens > 0 else 0
+        corpus = await self.aget_pages_corpus()
+        if not corpus:
+            yield "Sorry, I couldn't retrieve any page data at this time."
+            return
         
-        # Log token counts
-        token_stats = (
-            f"Page tokens - Original: {original_tokens}, "
-            f"Reduced: {reduced_tokens}, "
-            f"Saved: {token_reduction} ({token_reduction_percent:.1f}%)"
-        )
-        self._log("TOKENS", token_stats)
-        print(token_stats)
+        key = self._answer_key("pages", query, corpus, encoding)
+        async for chunk in self._astream_generate(key, lambda: self._build_pages_prompt(query, corpus, encoding), "pages", "pages"):
+            yield chunk
+    
+    # COMMON FUNCTIONS
+    
+    def _where(self, where: Dict[str, Any], modified_since: Optional[date]) -> Dict[str, Any]:
+        """Connection filter, limited to nodes modified on or after a date if given"""
+        if modified_since is None:
+            return where
+        return {**where, "dateQuery": {
+            "column": "MODIFIED",
+            "inclusive": True,
+            "after": {"year": modified_since.year, "month": modified_since.month, "day": modified_since.day},
+        }}
+    
+    def _variables(self, after: Optional[str], where: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        variables = {"first": CMS_PAGE_SIZE, "after": after}
+        if where is not None:
+            variables["where"] = where
+        return variables
+    
+    def _parse_connection(self, response, root: str, label: str) -> Dict[str, Any]:
+        """Extract the connection under root from a GraphQL response"""
+        if response.status_code != 200:
+            self._log("ERROR", f"Failed to fetch {label}: HTTP {response.status_code}")
+            raise CMSFetchError(f"HTTP {response.status_code}")
+        data = response.json()
+        if data.get("errors"):
+            self._log("ERROR", f"GraphQL errors fetching {label}: {data['errors']}")
+        connection = (data.get("data") or {}).get(root)
+        if connection is None:
+            self._log("ERROR", f"Failed to fetch {label}: no {root} in response")
+            raise CMSFetchError(f"No {root} in response")
+        return connection
+    
+    def _stream_nodes(self, query: str, root: str, label: str, where: Optional[Dict[str, Any]] = None) -> Iterator[List[Dict[str, Any]]]:
+        """Page through a GraphQL connection with cursors, yielding each page of nodes.
         
-        # System prompt for pages
-        system_prompt = """Du är en expert på Falkenbergs kommun och dess webbplats. Besvara frågan baserat på innehållet från webbsidorna på falkenberg.se. 
-
-Fokusera på att ge ett detaljerat och korrekt svar baserat på informationen från webbsidorna. Ange uri/länk till relevanta sidor.
-
-Prioritera relevans och var koncis men informativ."""
+        Only one page of raw nodes is alive at a time, which caps peak memory
+        during a refresh regardless of corpus size. where is only sent when
+        given (the query then declares it).
+        """
+        after = None
+        with requests.Session() as session:
+            while True:
+                try:
+                    response = session.post(
+                        self.cms_url,
+                        json={"query": query, "variables": self._variables(after, where)},
+                        headers={"Content-Type": "application/json"},
+                        timeout=CMS_TIMEOUT
+                    )
+                except Exception as e:
+                    self._log("ERROR", f"Error fetching {label}: {str(e)}")
+                    raise CMSFetchError(str(e)) from e
+                connection = self._parse_connection(response, root, label)
+                del response
+                page_info = connection.get("pageInfo") or {}
+                yield connection.get("nodes") or []
+                if not page_info.get("hasNextPage") or not page_info.get("endCursor"):
+                    return
+                after = page_info["endCursor"]
+    
+    async def _astream_nodes(self, query: str, root: str, label: str, where: Optional[Dict[str, Any]] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Async version of _stream_nodes using httpx"""
+        after = None
+        async with httpx.AsyncClient(timeout=CMS_TIMEOUT) as client:
+            while True:
+                try:
+                    response = await client.post(
+                        self.cms_url,
+                        json={"query": query, "variables": self._variables(after, where)},
+                        headers={"Content-Type": "application/json"}
+                    )
+                except Exception as e:
+                    self._log("ERROR", f"Error fetching {label}: {str(e)}")
+                    raise CMSFetchError(str(e)) from e
+                connection = self._parse_connection(response, root, label)
+                del response
+                page_info = connection.get("pageInfo") or {}
+                yield connection.get("nodes") or []
+                if not page_info.get("hasNextPage") or not page_info.get("endCursor"):
+                    return
+                after = page_info["endCursor"]
+    
+    def _is_expired(self, cache: Dict[str, Any]) -> bool:
+        """Check whether a cache is empty, older than its cache duration or due for a retry"""
+        if cache["data"] is None:
+            return True
+        if cache["retry_after"]:
+            return time.time() >= cache["retry_after"]
+        return time.time() - cache["last_updated"] > cache["cache_duration"]
+    
+    def corpus_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Records, context tokens and age in seconds (None before the first load) of each corpus"""
+        now = time.time()
+        stats = {}
+        for cache in (self.events_cache, self.pages_cache):
+            corpus = cache["corpus"]
+            stats[cache["name"]] = {
+                "records": len(corpus.records) if corpus else 0,
+                "tokens": corpus.reduced_tokens if corpus else 0,
+                "age_seconds": now - cache["last_updated"] if corpus and cache["last_updated"] else None,
+                "expired": self._is_expired(cache),
+            }
+        return stats
+    
+    def _update_cache(self, cache: Dict[str, Any], corpus: PreparedCorpus, last_updated: Optional[float] = None) -> None:
+        """Store a prepared corpus in a cache.
         
-        # Create context and prompt
-        context = reduced_pages_json
-        full_prompt = f"{system_prompt}\n\nFråga: {query}\n\nWebbsidesdata: {context}"
+        The cache keeps the reduced records as its data rather than the raw
+        CMS payload, which is only needed while preparing the corpus.
+        """
+        cache["data"] = corpus.records
+        cache["corpus"] = corpus
+        # Answers about the previous data are keyed by its version and can no longer be hit
+        self.answer_cache.invalidate(cache["name"])
+        cache["last_updated"] = last_updated if last_updated is not None else time.time()
+        # An empty result is stored only when there is nothing better, so retry it soon
+        cache["retry_after"] = 0 if corpus.records else time.time() + REFRESH_RETRY_INTERVAL
+    
+    def _save_snapshot(self, cache: Dict[str, Any]) -> None:
+        """Persist a cache's corpus so the next start can serve it immediately"""
+        if not self.snapshot_dir or not cache["data"]:
+            return
+        try:
+            start_time = time.time()
+            path = save_snapshot(self.snapshot_dir, cache["name"], cache["corpus"], cache["last_updated"], cache["sync"])
+            self._log("SYSTEM", f"Saved {cache['name']} snapshot to {path} in {time.time() - start_time:.2f} seconds")
+        except Exception as e:
+            self._log("ERROR", f"Failed to save {cache['name']} snapshot: {str(e)}")
+    
+    def _load_snapshot(self, cache: Dict[str, Any]) -> bool:
+        """Fill a cache from its on-disk snapshot, keeping the snapshot's age"""
+        if not self.snapshot_dir:
+            return False
+        try:
+            start_time = time.time()
+            payload = load_snapshot(self.snapshot_dir, cache["name"])
+            if payload is None:
+                return False
+            self._update_cache(cache, payload["corpus"], payload["last_updated"])
+            cache["sync"] = payload["sync"]
+            self._prepare_context_cache(cache)
+            self._log("SYSTEM", f"Loaded {cache['name']} snapshot ({len(cache['data'])} records, "
+                                f"version {cache['corpus'].version}) in {time.time() - start_time:.3f} seconds")
+            return True
+        except Exception as e:
+            self._log("ERROR", f"Failed to load {cache['name']} snapshot: {str(e)}")
+            return False
+    
+    def _is_follower(self) -> bool:
+        """Whether another process refreshes the corpus and this one maps what it publishes"""
+        return self.shared is not None and not self.shared.is_leader
+    
+    def _load_initial(self, cache: Dict[str, Any]) -> None:
+        """Fill a cache at startup: a follower maps the published corpus, others load their snapshot"""
+        if self._is_follower():
+            self._adopt_published(cache)
+        else:
+            self._load_snapshot(cache)
+            self._publish(cache)
+    
+    def _publish(self, cache: Dict[str, Any]) -> None:
+        """Publish the leader's corpus to the follower processes, unless that version already is"""
+        if not self.shared or not self.shared.is_leader or not cache["data"]:
+            return
+        corpus = cache["corpus"]
+        if self.shared.published_version(cache["name"]) == corpus.version:
+            return
+        try:
+            start_time = time.time()
+            with span("corpus.publish", corpus=cache["name"], records=len(corpus)):
+                self.shared.publish(cache["name"], corpus, cache["last_updated"])
+            self._log("SYSTEM", f"Published {cache['name']} version {corpus.version} "
+                                f"in {time.time() - start_time:.2f} seconds")
+        except Exception as e:
+            self._log("ERROR", f"Failed to publish {cache['name']}: {str(e)}")
+    
+    def _adopt_published(self, cache: Dict[str, Any]) -> bool:
+        """Map a new corpus version published by the leader into a follower's cache"""
+        published = self.shared.read_if_changed(cache["name"])
+        if published is None:
+            return False
+        corpus, last_updated = published
+        self._update_cache(cache, corpus, last_updated)
+        self._prepare_context_cache(cache)
+        self._log("SYSTEM", f"Mapped {cache['name']} version {corpus.version} published by the refresh leader "
+                            f"({len(corpus)} records)")
+        return True
+    
+    def _await_published(self, cache: Dict[str, Any]) -> None:
+        """Wait (blocking) for a follower's first corpus, as a refreshing process would wait for its sync"""
+        deadline = time.time() + CMS_TIMEOUT * 2
+        while cache["data"] is None and time.time() < deadline:
+            if not self._adopt_published(cache):
+                time.sleep(0.5)
+    
+    async def _aawait_published(self, cache: Dict[str, Any]) -> None:
+        """Async version of _await_published (adopting creates the cached content, a blocking Gemini call)"""
+        deadline = time.time() + CMS_TIMEOUT * 2
+        while cache["data"] is None and time.time() < deadline:
+            if not await asyncio.to_thread(self._adopt_published, cache):
+                await asyncio.sleep(0.5)
+    
+    def _shared_loop(self) -> None:
+        """Followers map new published versions and take over when the leader exits;
+        the leader refreshes expired corpora even when its own sessions are idle"""
+        caches = ((self.events_cache, self.refresh_events_data), (self.pages_cache, self.refresh_pages_data))
+        while True:
+            time.sleep(SHARED_POLL_INTERVAL)
+            try:
+                if not self.shared.is_leader and self.shared.try_lead():
+                    self._log("SYSTEM", "Took over as refresh leader")
+                    for cache, _ in caches:
+                        # The sync state for incremental refreshes comes from the snapshot the last leader saved
+                        self._load_snapshot(cache)
+                for cache, refresh in caches:
+                    if not self.shared.is_leader:
+                        self._adopt_published(cache)
+                    elif self._is_expired(cache):
+                        self._refresh_single_flight(cache, refresh)
+            except Exception as e:
+                self._log("ERROR", f"Shared corpus update failed: {str(e)}")
+    
+    def _keep_snapshot(self, cache: Dict[str, Any], failed: bool) -> bool:
+        """Keep the last good snapshot when a sync failed"""
+        if not failed or not cache["data"]:
+            return False
+        cache["retry_after"] = time.time() + REFRESH_RETRY_INTERVAL
+        self._log("ERROR", f"Refresh of {cache['name']} failed, keeping previous snapshot "
+                           f"({len(cache['data'])} {cache['name']}) and retrying in {REFRESH_RETRY_INTERVAL} seconds")
+        return True
+    
+    def _run_sync(self, cache: Dict[str, Any], pages: Iterator[List[Dict[str, Any]]], modified_since: Optional[date],
+                  started_at: float, sync_node: Callable[[Dict[str, Any]], Tuple[Dict[str, Any], Any]],
+                  build_corpus: Callable[[CorpusSync], PreparedCorpus]) -> None:
+        """Merge streamed pages of nodes into a cache's sync state as they arrive"""
+        with span("cms.refresh", corpus=cache["name"], full=modified_since is None) as refresh_span:
+            run = cache["sync"].begin(modified_since is None, started_at)
+            failed = False
+            try:
+                for nodes in pages:
+                    run.merge(nodes, self._batch_reducer(sync_node), self.count_tokens)
+            except CMSFetchError:
+                failed = True
+            refresh_span.set(fetched=run.fetched, changed=run.changed, failed=failed)
+            self._finish_sync(cache, run, failed, modified_since, build_corpus)
+    
+    async def _arun_sync(self, cache: Dict[str, Any], pages: AsyncIterator[List[Dict[str, Any]]], modified_since: Optional[date],
+                         started_at: float, sync_node: Callable[[Dict[str, Any]], Tuple[Dict[str, Any], Any]],
+                         build_corpus: Callable[[CorpusSync], PreparedCorpus]) -> None:
+        """Async version of _run_sync; reduction is CPU bound, so it runs off the event loop"""
+        with span("cms.refresh", corpus=cache["name"], full=modified_since is None) as refresh_span:
+            run = cache["sync"].begin(modified_since is None, started_at)
+            failed = False
+            try:
+                async for nodes in pages:
+                    await asyncio.to_thread(run.merge, nodes, self._batch_reducer(sync_node), self.count_tokens)
+            except CMSFetchError:
+                failed = True
+            refresh_span.set(fetched=run.fetched, changed=run.changed, failed=failed)
+            await asyncio.to_thread(self._finish_sync, cache, run, failed, modified_since, build_corpus)
+    
+    def _batch_reducer(self, sync_node: Callable[[Dict[str, Any], Optional[str]], Tuple[Dict[str, Any], Any]]
+                       ) -> Callable[[List[Dict[str, Any]]], List[Tuple[Dict[str, Any], Any]]]:
+        """Reduce a batch of changed nodes, extracting their HTML text together (in the reducer's workers)"""
+        def reduce_nodes(nodes: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Any]]:
+            with span("html.reduce", nodes=len(nodes), workers=self.html_reducer.workers):
+                texts = self.html_reducer.extract_all([node.get('content') or '' for node in nodes])
+                return [sync_node(node, text) for node, text in zip(nodes, texts)]
+        return reduce_nodes
+    
+    def _finish_sync(self, cache: Dict[str, Any], run: SyncRun, failed: bool, modified_since: Optional[date],
+                     build_corpus: Callable[[CorpusSync], PreparedCorpus]) -> None:
+        """Complete a sync and rebuild the cache's corpus if anything changed"""
+        # A full sync that returns nothing is treated as a failure, not as an empty CMS
+        failed = failed or (run.full and not run.fetched)
+        if self._keep_snapshot(cache, failed):
+            return
         
-        # Count tokens in prompt
-        prompt_tokens = self.count_tokens(full_prompt)
-        self._log("TOKENS", f"Pages prompt tokens: {prompt_tokens}")
-        print(f"Pages prompt tokens: {prompt_tokens}")
+        if failed:
+            # No previous data to keep: serve what was fetched, without recording a completed sync
+            run.apply()
+        else:
+            run.finish()
+        scope = "full sync" if run.full else f"modified since {modified_since.isoformat()}"
+        self._log("SYSTEM", f"Synced {cache['name']} ({scope}): {run.fetched} fetched, "
+                            f"{run.changed} changed, {run.removed} removed. Total {cache['name']}: {len(run.sync)}")
         
-        # Log that we're sending a request
-        self._log("SYSTEM", "Sending pages request to Gemini")
+        if run.changed or run.removed or cache["corpus"] is None:
+            with span("corpus.build", corpus=cache["name"], records=len(run.sync)) as build_span:
+                corpus = build_corpus(run.sync)
+                build_span.set(context_tokens=corpus.reduced_tokens)
+            self._update_cache(cache, corpus)
+            self._save_snapshot(cache)
+            self._publish(cache)
+        else:
+            # Nothing changed, the current corpus is up to date
+            cache["last_updated"] = time.time()
+            cache["retry_after"] = 0
         
+        if failed:
+            cache["retry_after"] = time.time() + REFRESH_RETRY_INTERVAL
+        self._prepare_context_cache(cache)
+    
+    def _prepare_context_cache(self, cache: Dict[str, Any]) -> None:
+        """Create (or renew) the cached content for the current corpus version.
+        
+        Only corpora whose queries can send the whole corpus get one: pages,
+        as the fallback when no passage matches, and events without a date index.
+        """
+        corpus = cache["corpus"]
+        if not corpus or not corpus.records or (cache["name"] == "events" and corpus.index is not None):
+            return
         try:
-            # Generate response
+            key = (cache["name"], corpus.version, self.context_encoding)
+            static, tokens = self._static_corpus_prompt(cache["name"], corpus, None)
+            if self.context_cache.prepare(key, static, tokens):
+                self._log("SYSTEM", f"Cached {cache['name']} context version {corpus.version} ({tokens} tokens)")
+        except Exception as e:
+            self._log("ERROR", f"Failed to cache {cache['name']} context: {str(e)}")
+    
+    def _refresh_single_flight(self, cache: Dict[str, Any], refresh: Callable[[], None]) -> None:
+        """Run a refresh unless one is already in flight, in which case wait for it"""
+        flight = cache["flight"]
+        if flight.try_acquire():
+            try:
+                refresh()
+            finally:
+                flight.release()
+        else:
+            flight.wait(CMS_TIMEOUT * 2)
+    
+    async def _arefresh_single_flight(self, cache: Dict[str, Any], arefresh: Callable[[], Any]) -> None:
+        """Async version of _refresh_single_flight"""
+        flight = cache["flight"]
+        if flight.try_acquire():
+            try:
+                await arefresh()
+            finally:
+                flight.release()
+        else:
+            await flight.await_idle(CMS_TIMEOUT * 2)
+    
+    def _revalidate(self, cache: Dict[str, Any], refresh: Callable[[], None]) -> None:
+        """Stale-while-revalidate: only block when there is no snapshot at all"""
+        if self._is_follower():
+            # The leader refreshes; a follower only waits for its first corpus
+            if cache["data"] is None:
+                self._await_published(cache)
+        elif cache["data"] is None:
+            self._refresh_single_flight(cache, refresh)
+        elif self._is_expired(cache) and cache["flight"].try_acquire():
+            def run():
+                try:
+                    refresh()
+                finally:
+                    cache["flight"].release()
+            threading.Thread(target=run, daemon=True).start()
+    
+    async def _arevalidate(self, cache: Dict[str, Any], arefresh: Callable[[], Any]) -> None:
+        """Async stale-while-revalidate: refreshes in a background task"""
+        if self._is_follower():
+            if cache["data"] is None:
+                await self._aawait_published(cache)
+        elif cache["data"] is None:
+            await self._arefresh_single_flight(cache, arefresh)
+        elif self._is_expired(cache) and cache["flight"].try_acquire():
+            async def run():
+                try:
+                    await arefresh()
+                except Exception as e:
+                    self._log("ERROR", f"Background refresh failed: {str(e)}")
+                finally:
+                    cache["flight"].release()
+            task = asyncio.create_task(run())
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+    
+    def prepare_corpus(self, kind: str, sync: CorpusSync) -> PreparedCorpus:
+        """Serialize the reduced records of a sync state into a prompt context"""
+        records = sync.records()
+        context = encode_records(records)
+        corpus = PreparedCorpus(kind, records, context, sync.original_tokens(), self.count_tokens(context))
+        self._log("TOKENS", corpus.token_stats())
+        return corpus
+    
+    def _log_response(self, text: str, response_time: float, label: str) -> str:
+        """Log timing and token counts for a Gemini response and return its text"""
+        # Log response time
+        self._log("SYSTEM", f"Gemini {label} response time: {response_time:.2f} seconds", console=True,
+                  response_ms=round(response_time * 1000, 1))
+        
+        # Count tokens in response
+        response_tokens = self.count_tokens(text)
+        current_span().set(response_tokens=response_tokens)
+        self._log("TOKENS", f"{label.capitalize()} response tokens: {response_tokens}", console=True,
+                  response_tokens=response_tokens)
+        
+        # Log the Gemini response (truncated)
+        self._log("GEMINI", text[:100] + "..." if len(text) > 100 else text)
+        
+        return text
+    
+    def _answer_key(self, kind: str, query: str, corpus: PreparedCorpus, encoding: Optional[str]) -> Hashable:
+        """Answer cache key: tool, corpus version, context encoding and normalized query.
+        
+        Date references are already resolved into the query by app.py; event
+        prompts also contain the current date, so event answers are kept per day.
+        """
+        day = date.today().isoformat() if kind == "events" else None
+        return (kind, corpus.version, encoding or self.context_encoding, day, normalize_query(query))
+    
+    def _log_cache_hit(self, label: str) -> None:
+        stats = self.answer_cache.stats()
+        self._log("SYSTEM", f"Answer cache hit for {label} query (hit rate {stats['hit_rate']:.0%}, "
+                            f"{stats['entries']} answers cached)")
+    
+    def _prompt_model(self, prompt: Prompt) -> Tuple[Any, str]:
+        """Model and contents for a prompt, generating from the cached corpus prefix when there is one"""
+        model = self.context_cache.model(prompt.cache_key) if prompt.cache_key else None
+        if model is None:
+            return self.model, prompt.full
+        return model, prompt.dynamic
+    
+    def _send(self, prompt: Prompt, label: str, **kwargs):
+        """Call Gemini with a prompt, falling back to the full prompt if its cached content fails"""
+        model, contents = self._prompt_model(prompt)
+        if model is self.model:
+            return self.model.generate_content(contents, **kwargs)
+        self._log("SYSTEM", f"Using cached {label} context")
+        current_span().set(cached_context=True)
+        try:
+            return model.generate_content(contents, **kwargs)
+        except Exception as e:
+            # A rate limit is retried by the limiter; the cached content is fine
+            if is_rate_limited(e):
+                raise
+            self._log("ERROR", f"Cached {label} context failed, sending the full prompt: {str(e)}")
+            self.context_cache.discard(prompt.cache_key)
+            return self.model.generate_content(prompt.full, **kwargs)
+    
+    async def _agenerate_content(self, model, contents, **kwargs):
+        """generate_content_async, or with the REST transport the sync call in a Gemini thread
+        (a stream is then read chunk by chunk in those threads)"""
+        if self._rest_executor is None:
+            return await model.generate_content_async(contents, **kwargs)
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(self._rest_executor, lambda: model.generate_content(contents, **kwargs))
+        if not kwargs.get("stream"):
+            return response
+        return self._aiterate_chunks(iter(response))
+    
+    async def _aiterate_chunks(self, chunks: Iterator[Any]) -> AsyncIterator[Any]:
+        loop = asyncio.get_running_loop()
+        done = object()
+        while True:
+            chunk = await loop.run_in_executor(self._rest_executor, next, chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+    
+    async def _asend(self, prompt: Prompt, label: str, **kwargs):
+        """Async version of _send"""
+        model, contents = self._prompt_model(prompt)
+        if model is self.model:
+            return await self._agenerate_content(self.model, contents, **kwargs)
+        self._log("SYSTEM", f"Using cached {label} context")
+        current_span().set(cached_context=True)
+        try:
+            return await self._agenerate_content(model, contents, **kwargs)
+        except Exception as e:
+            # A rate limit is retried by the limiter; the cached content is fine
+            if is_rate_limited(e):
+                raise
+            self._log("ERROR", f"Cached {label} context failed, sending the full prompt: {str(e)}")
+            # Deleting the cached content is a blocking Gemini call
+            await asyncio.to_thread(self.context_cache.discard, prompt.cache_key)
+            return await self._agenerate_content(self.model, prompt.full, **kwargs)
+    
+    def _generate(self, key: Hashable, build_prompt: Callable[[], Prompt], label: str, topic: str) -> str:
+        """Return the cached answer for key, or send the prompt to Gemini and cache the response text"""
+        generated = False
+        
+        def generate() -> str:
+            nonlocal generated
+            generated = True
+            with span("gemini.prompt", kind=label):
+                prompt = build_prompt()
+            # Log that we're sending a request
+            self._log("SYSTEM", f"Sending {label} request to Gemini")
             start_time = time.time()
-            response = self.model.generate_content(full_prompt)
-            end_time = time.time()
-            
-            # Log response time
-            response_time = end_time - start_time
-            self._log("SYSTEM", f"Gemini pages response time: {response_time:.2f} seconds")
-            print(f"Gemini pages response time: {response_time:.2f} seconds")
-            
-            # Count tokens in response
-            response_tokens = self.count_tokens(response.text)
-            self._log("TOKENS", f"Pages response tokens: {response_tokens}")
-            print(f"Pages response tokens: {response_tokens}")
-            
-            # Log the Gemini response (truncated)
-            self._log("GEMINI", response.text[:100] + "..." if len(response.text) > 100 else response.text)
-            
-            return response.text
+            with span("gemini.generate", kind=label):
+                response = self.gemini_limiter.call(lambda: self._send(prompt, label))
+                return self._log_response(response.text, time.time() - start_time, label)
+        
+        try:
+            with span("gemini.answer", kind=label) as answer_span:
+                text = self.answer_cache.get_or_compute(key, generate)
+                answer_span.set(cache_hit=not generated)
+        except UpstreamBusy as e:
+            self._log("SYSTEM", f"Gemini busy for {topic}: {str(e)}")
+            return GEMINI_BUSY_MESSAGE
         except Exception as e:
-            error_msg = f"Error from Gemini for pages: {str(e)}"
+            error_msg = f"Error from Gemini for {topic}: {str(e)}"
             self._log("ERROR", error_msg)
             return f"Ett fel uppstod: {str(e)}"
+        if not generated:
+            self._log_cache_hit(label)
+        return text
     
-    # COMMON FUNCTIONS
+    async def _agenerate(self, key: Hashable, build_prompt: Callable[[], Prompt], label: str, topic: str) -> str:
+        """Async version of _generate using the async Gemini client"""
+        generated = False
+        
+        async def generate() -> str:
+            nonlocal generated
+            generated = True
+            with span("gemini.prompt", kind=label):
+                # Off the event loop: a whole-corpus prompt may have to be encoded and counted first
+                prompt = await asyncio.to_thread(build_prompt)
+            # Log that we're sending a request
+            self._log("SYSTEM", f"Sending {label} request to Gemini")
+            start_time = time.time()
+            with span("gemini.generate", kind=label):
+                response = await self.gemini_limiter.acall(lambda: self._asend(prompt, label))
+                return self._log_response(response.text, time.time() - start_time, label)
+        
+        try:
+            with span("gemini.answer", kind=label) as answer_span:
+                text = await self.answer_cache.aget_or_compute(key, generate)
+                answer_span.set(cache_hit=not generated)
+        except UpstreamBusy as e:
+            self._log("SYSTEM", f"Gemini busy for {topic}: {str(e)}")
+            return GEMINI_BUSY_MESSAGE
+        except Exception as e:
+            error_msg = f"Error from Gemini for {topic}: {str(e)}"
+            self._log("ERROR", error_msg)
+            return f"Ett fel uppstod: {str(e)}"
+        if not generated:
+            self._log_cache_hit(label)
+        return text
+    
+    def _stream_generate(self, key: Hashable, build_prompt: Callable[[], Prompt], label: str, topic: str) -> Iterator[str]:
+        """Yield the cached answer for key, or stream Gemini's response text as it is generated"""
+        generated = False
+        
+        def generate() -> Iterator[str]:
+            nonlocal generated
+            generated = True
+            with span("gemini.prompt", kind=label):
+                prompt = build_prompt()
+            self._log("SYSTEM", f"Streaming {label} request to Gemini")
+            start_time = time.time()
+            parts = []
+            # The generator runs in its caller's context, so the span is only made current around calls, not across yields
+            generate_span = start_span("gemini.generate", kind=label, streamed=True)
+            try:
+                # The slot is held until the whole answer has streamed
+                with self.gemini_limiter.slot():
+                    with use_span(generate_span):
+                        response = self.gemini_limiter.retry(lambda: self._send(prompt, label, stream=True))
+                    for chunk in response:
+                        text = chunk.text
+                        if not text:
+                            continue
+                        if not parts:
+                            self._log("SYSTEM", f"Gemini {label} time to first chunk: {time.time() - start_time:.2f} seconds")
+                            generate_span.set(first_chunk_ms=round((time.time() - start_time) * 1000, 1))
+                        parts.append(text)
+                        yield text
+                with use_span(generate_span):
+                    self._log_response("".join(parts), time.time() - start_time, label)
+            except BaseException as e:
+                generate_span.end(e)
+                raise
+            generate_span.end()
+        
+        try:
+            yield from self.answer_cache.stream(key, generate)
+            current_span().set(cache_hit=not generated)
+        except UpstreamBusy as e:
+            self._log("SYSTEM", f"Gemini busy for {topic}: {str(e)}")
+            yield GEMINI_BUSY_MESSAGE
+            return
+        except Exception as e:
+            self._log("ERROR", f"Error from Gemini for {topic}: {str(e)}")
+            yield f"Ett fel uppstod: {str(e)}"
+            return
+        if not generated:
+            self._log_cache_hit(label)
+    
+    async def _astream_generate(self, key: Hashable, build_prompt: Callable[[], Prompt], label: str, topic: str) -> AsyncIterator[str]:
+        """Async version of _stream_generate"""
+        generated = False
+        
+        async def generate() -> AsyncIterator[str]:
+            nonlocal generated
+            generated = True
+            with span("gemini.prompt", kind=label):
+                # Off the event loop: a whole-corpus prompt may have to be encoded and counted first
+                prompt = await asyncio.to_thread(build_prompt)
+            self._log("SYSTEM", f"Streaming {label} request to Gemini")
+            start_time = time.time()
+            parts = []
+            # The generator runs in its caller's context, so the span is only made current around calls, not across yields
+            generate_span = start_span("gemini.generate", kind=label, streamed=True)
+            try:
+                # The slot is held until the whole answer has streamed
+                async with self.gemini_limiter.aslot():
+                    with use_span(generate_span):
+                        response = await self.gemini_limiter.aretry(lambda: self._asend(prompt, label, stream=True))
+                    async for chunk in response:
+                        text = chunk.text
+                        if not text:
+                            continue
+                        if not parts:
+                            self._log("SYSTEM", f"Gemini {label} time to first chunk: {time.time() - start_time:.2f} seconds")
+                            generate_span.set(first_chunk_ms=round((time.time() - start_time) * 1000, 1))
+                        parts.append(text)
+                        yield text
+                with use_span(generate_span):
+                    self._log_response("".join(parts), time.time() - start_time, label)
+            except BaseException as e:
+                generate_span.end(e)
+                raise
+            generate_span.end()
+        
+        try:
+            async for chunk in self.answer_cache.astream(key, generate):
+                yield chunk
+            current_span().set(cache_hit=not generated)
+        except UpstreamBusy as e:
+            self._log("SYSTEM", f"Gemini busy for {topic}: {str(e)}")
+            yield GEMINI_BUSY_MESSAGE
+            return
+        except Exception as e:
+            self._log("ERROR", f"Error from Gemini for {topic}: {str(e)}")
+            yield f"Ett fel uppstod: {str(e)}"
+            return
+        if not generated:
+            self._log_cache_hit(label)
     
     def schedule_refresh(self, interval_hours: int = 3) -> None:
-        """Schedule regular refreshes of both event and page data"""
-        import threading
+        """Schedule regular refreshes of both event and page data.
         
+        Goes through the same single-flight refresh as the request path and
+        skips caches that were already refreshed within their cache duration.
+        """
         def refresh_loop():
             while True:
                 time.sleep(interval_hours * 3600)  # Convert hours to seconds
-                self.refresh_events_data()
-                self.refresh_pages_data()
+                for cache, refresh in ((self.events_cache, self.refresh_events_data),
+                                       (self.pages_cache, self.refresh_pages_data)):
+                    if self._is_expired(cache) and not self._is_follower():
+                        try:
+                            self._refresh_single_flight(cache, refresh)
+                        except Exception as e:
+                            self._log("ERROR", f"Scheduled refresh failed: {str(e)}")
         
         # Start the refresh loop in a background thread
         refresh_thread = threading.Thread(target=refresh_loop, daemon=True)
         refresh_thread.start()
-        self._log("SYSTEM", f"Scheduled refresh every {interval_hours} hours")
\ No newline at end of file
+        self._log("SYSTEM", f"Scheduled refresh every {interval_hours} hours")
@@ -0,0 +1,83 @@
+import json
+from typing import Any, Callable, Dict, List
+
+# Marks the system message that stands in for dropped turns
+SUMMARY_PREFIX = "Earlier in this conversation (older turns were removed), the visitor asked:"
+
+# Marks tool results that were already shortened
+TOOL_STUB_PREFIX = "(Earlier tool result, shortened)"
+
+# Per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class HistoryManager:
+    """Keeps the chat history sent to GPT-4o within a token budget.
+
+    The system message is always kept. Tool results of earlier turns are
+    collapsed into short stubs (the assistant's answer already carries what
+    was used), and when the history is still over budget the oldest turns
+    are dropped, leaving their questions in a one-line-per-turn summary.
+    The current turn is never trimmed.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], budget: int = 12000, tool_stub_chars: int = 200,
+                 summary_questions: int = 10):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.tool_stub_chars = tool_stub_chars
+        self.summary_questions = summary_questions
+
+    def message_tokens(self, message: Dict[str, Any]) -> int:
+        tokens = MESSAGE_OVERHEAD_TOKENS + self.count_tokens(message.get("content") or "")
+        if message.get("tool_calls"):
+            tokens += self.count_tokens(json.dumps(message["tool_calls"], ensure_ascii=False))
+        return tokens
+
+    def history_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        return sum(self.message_tokens(message) for message in messages)
+
+    def collapse_tool_result(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Short stub of a tool message, keeping the fields that pair it with its tool call"""
+        content = message.get("content") or ""
+        if len(content) <= self.tool_stub_chars or content.startswith(TOOL_STUB_PREFIX):
+            return message
+        return dict(message, content=f"{TOOL_STUB_PREFIX} {content[:self.tool_stub_chars].rstrip()}...")
+
+    def trim(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Return the history to send, within the budget (plus the short summary) unless
+        the current turn alone exceeds it"""
+        if not messages:
+            return messages
+        system, rest = messages[:1], messages[1:]
+        questions = []
+        if rest and rest[0].get("role") == "system" and rest[0].get("content", "").startswith(SUMMARY_PREFIX):
+            questions = [line[2:] for line in rest[0]["content"].splitlines()[1:] if line.startswith("- ")]
+            rest = rest[1:]
+
+        # A turn is a user message with the assistant and tool messages that answer it
+        turns: List[List[Dict[str, Any]]] = []
+        for message in rest:
+            if message.get("role") == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+
+        for turn in turns[:-1]:
+            turn[:] = [self.collapse_tool_result(message) if message.get("role") == "tool" else message
+                       for message in turn]
+
+        turn_tokens = [self.history_tokens(turn) for turn in turns]
+        total = self.history_tokens(system) + sum(turn_tokens)
+        while len(turns) > 1 and total > self.budget:
+            dropped = turns.pop(0)
+            total -= turn_tokens.pop(0)
+            if dropped[0].get("role") == "user":
+                questions.append(" ".join(str(dropped[0].get("content", "")).split())[:100])
+
+        trimmed = list(system)
+        if questions:
+            questions = questions[-self.summary_questions:]
+            trimmed.append({"role": "system", "content": "\n".join([SUMMARY_PREFIX] + [f"- {q}" for q in questions])})
+        for turn in turns:
+            trimmed.extend(turn)
+        return trimmed
@@ -0,0 +1,68 @@
+import re
+import html
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from bs4 import BeautifulSoup
+
+# Batches smaller than this are extracted in-process; the pool round trip would cost more
+POOL_MIN_BATCH = 32
+
+
+def extract_text(html_content: str) -> str:
+    """Convert HTML content to whitespace-normalized plain text"""
+    if not html_content:
+        return ""
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+    text = soup.get_text(separator=' ', strip=True)
+    text = html.unescape(text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def extract_texts(contents: List[str]) -> List[Optional[str]]:
+    """Plain text of each HTML content, None where extraction failed"""
+    texts = []
+    for content in contents:
+        try:
+            texts.append(extract_text(content))
+        except Exception:
+            texts.append(None)
+    return texts
+
+
+class HtmlReducer:
+    """Extracts plain text from batches of CMS HTML, in worker processes when workers > 0.
+
+    BeautifulSoup parsing is the main CPU cost of a refresh and holds the
+    GIL while chat sessions stream. A batch is split into chunks that the
+    workers parse in parallel; results come back in input order. Workers are
+    spawned on first use, so the app's threads are not forked.
+    """
+
+    def __init__(self, workers: int = 0, min_batch: int = POOL_MIN_BATCH):
+        self.workers = workers
+        self.min_batch = min_batch
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def extract_all(self, contents: List[str]) -> List[Optional[str]]:
+        """Plain text of each HTML content in order, None where extraction failed"""
+        if self.workers <= 0 or len(contents) < self.min_batch:
+            return extract_texts(contents)
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            pool = self._pool
+        # Two chunks per worker, so a slow chunk does not leave the others idle
+        size = -(-len(contents) // (self.workers * 2))
+        chunks = [contents[i:i + size] for i in range(0, len(contents), size)]
+        return [text for chunk in pool.map(extract_texts, chunks) for text in chunk]
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
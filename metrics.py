@@ -0,0 +1,271 @@
+"""Prometheus-style metrics of the chat service, in the text exposition format.
+
+Stage latencies, tool requests, token counts and CMS refresh outcomes are
+recorded from finished trace spans (MetricsExporter is one of the tracer's
+exporters), so they cost one dictionary update per span. Values kept
+elsewhere (corpus sizes, upstream slots, cache hit rates) are read by
+collectors when the endpoint is scraped.
+"""
+import math
+import bisect
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Upper bounds in seconds of the latency histograms, and in tokens of the token histograms
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (name, type, help, labels, value) read at scrape time
+Sample = Tuple[str, str, str, Dict[str, Any], float]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _label_value(value: Any) -> str:
+    return ("true" if value else "false") if isinstance(value, bool) else str(value)
+
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(_label_value(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, key)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Observations counted per bucket (upper bounds), with their sum and count"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Count per bucket (the last one is +Inf), sum
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        names = self.labels + ("le",)
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics recorded as they happen plus collectors read at scrape time"""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+        """Register a function returning (name, type, help, labels, value) samples when scraped"""
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        grouped: Dict[str, Tuple[str, str, List[str]]] = {}
+        for collect in self._collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                lines.append(f"# collector {getattr(collect, '__name__', collect)} failed: {_escape(e)}")
+                continue
+            for name, kind, help, labels, value in samples:
+                entry = grouped.setdefault(name, (kind, help, []))
+                entry[2].append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        for name, (kind, help, samples) in grouped.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Tracer exporter that turns finished spans into latency, request, token and refresh metrics"""
+
+    def __init__(self, registry: Registry):
+        self.stage_seconds = registry.histogram(
+            "chat_stage_duration_seconds", "Duration of each traced stage (span name) of chat turns and refreshes",
+            ("stage",))
+        self.stage_errors = registry.counter(
+            "chat_stage_errors_total", "Traced stages that ended with an error", ("stage",))
+        self.turns = registry.counter(
+            "chat_turns_total", "Chat turns by how they were answered (without tools, via GPT-4o, direct from a tool, "
+            "busy, error)", ("path",))
+        self.first_token_seconds = registry.histogram(
+            "chat_first_token_seconds", "Time from a visitor's message to the first answer token")
+        self.tool_seconds = registry.histogram(
+            "tool_request_duration_seconds", "Duration of tool calls; the count is the number of requests per tool",
+            ("tool", "outcome"))
+        self.history_tokens = registry.histogram(
+            "chat_history_tokens", "Tokens of the chat history sent to GPT-4o per turn (count_tokens)",
+            buckets=TOKEN_BUCKETS)
+        self.prompt_tokens = registry.histogram(
+            "gemini_prompt_tokens", "Tokens of each Gemini prompt (count_tokens)", ("kind",), TOKEN_BUCKETS)
+        self.response_tokens = registry.histogram(
+            "gemini_response_tokens", "Tokens of each Gemini response (count_tokens)", ("kind",), TOKEN_BUCKETS)
+        self.gemini_requests = registry.counter(
+            "gemini_requests_total", "Gemini requests, by whether they used a cached corpus context",
+            ("kind", "cached_context"))
+        self.answers = registry.counter(
+            "gemini_answers_total", "Tool answers served from the answer cache (hit) or generated (miss)",
+            ("kind", "cache"))
+        self.refresh_seconds = registry.histogram(
+            "cms_refresh_duration_seconds", "Duration of CMS syncs per corpus", ("corpus", "full"))
+        self.refresh_failures = registry.counter(
+            "cms_refresh_failures_total", "CMS syncs that failed or were incomplete", ("corpus",))
+
+    def export(self, span) -> None:
+        seconds = span.duration_ms / 1000
+        name = span.name
+        attributes = span.attributes
+        self.stage_seconds.observe(seconds, stage=name)
+        if span.error:
+            self.stage_errors.inc(stage=name)
+        if name == "chat_turn":
+            self.turns.inc(path=attributes.get("path") or ("error" if span.error else "unknown"))
+            if "first_token_ms" in attributes:
+                self.first_token_seconds.observe(attributes["first_token_ms"] / 1000)
+            if "history_tokens" in attributes:
+                self.history_tokens.observe(attributes["history_tokens"])
+        elif name.startswith("tool."):
+            outcome = "error" if span.error else "cancelled" if attributes.get("cancelled") else "ok"
+            self.tool_seconds.observe(seconds, tool=name[len("tool."):], outcome=outcome)
+        elif name == "gemini.prompt":
+            if "prompt_tokens" in attributes:
+                self.prompt_tokens.observe(attributes["prompt_tokens"], kind=attributes.get("kind"))
+        elif name == "gemini.generate":
+            self.gemini_requests.inc(kind=attributes.get("kind"), cached_context=bool(attributes.get("cached_context")))
+            if "response_tokens" in attributes:
+                self.response_tokens.observe(attributes["response_tokens"], kind=attributes.get("kind"))
+        elif name == "gemini.answer":
+            if "cache_hit" in attributes:
+                self.answers.inc(kind=attributes.get("kind"), cache="hit" if attributes["cache_hit"] else "miss")
+        elif name == "cms.refresh":
+            self.refresh_seconds.observe(seconds, corpus=attributes.get("corpus"), full=bool(attributes.get("full")))
+            if span.error or attributes.get("failed"):
+                self.refresh_failures.inc(corpus=attributes.get("corpus"))
+
+
+def _help(prefix: str, key: str) -> str:
+    return f"{prefix} {key}".replace("_", " ").capitalize() + " (from stats())"
+
+
+def stats_samples(prefix: str, stats: Dict[str, Any], counters: Sequence[str], gauges: Sequence[str],
+                  labels: Dict[str, Any] = None) -> List[Sample]:
+    """Samples of the numeric entries of a stats() dict: counters as prefix_key_total, gauges as prefix_key"""
+    labels = labels or {}
+    samples = []
+    for key in counters:
+        if key in stats:
+            samples.append((f"{prefix}_{key}_total", "counter", _help(prefix, key), labels, stats[key]))
+    for key in gauges:
+        if key in stats:
+            samples.append((f"{prefix}_{key}", "gauge", _help(prefix, key), labels, stats[key]))
+    return samples
+
+
+def mount(app, registry: Registry, path: str = "/metrics") -> None:
+    """Serve the registry at path on a Starlette/FastAPI app (Chainlit's server), ahead of its catch-all route"""
+    from starlette.routing import Route
+    from starlette.responses import Response
+
+    async def metrics_endpoint(request):
+        return Response(registry.render(), media_type=CONTENT_TYPE)
+
+    app.router.routes.insert(0, Route(path, metrics_endpoint, methods=["GET"]))
+
+
+# Configured and served by app.py
+registry = Registry()
@@ -0,0 +1,188 @@
+import re
+import math
+import heapq
+from functools import lru_cache
+from collections import Counter
+from typing import List, Dict, Tuple, Iterable, Optional
+
+# Common Swedish (and a few English) words that carry no retrieval signal
+STOPWORDS = set("""
+alla allt andra att av blev bli blir blivit de dem den denna deras dess dessa det detta dig din dina ditt du där då efter
+ej eller en er era ert ett från för ha hade han hans har henne hennes hon honom hur här i icke ingen inom inte jag ju kan
+kunde man med mellan men mig min mina mitt mot mycket ni nu när någon något några och om oss på samma sedan sig sin sina
+sitt själv skulle som så sådan till under upp ut utan vad var vara varför varit varje vars vart vem vi vid vilka vilken
+vilket våra vårt än är över finns får kommer också även hos
+a an and are at be by for from in is it of on or the to what where which with
+""".split())
+
+VOWELS = "aeiouyäåö"
+S_ENDINGS = "bcdfghjklmnoprtvy"
+
+# Snowball Swedish step 1 suffixes, longest first
+STEP1_SUFFIXES = sorted("""
+heterna hetens anden heten heter arnas ernas ornas andes arens andet arna erna orna ande arne aste aren ades erns
+ad e ade en ern ar er or are as es ens at het ast a
+""".split(), key=len, reverse=True)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _r1(word: str) -> int:
+    """Start of the Snowball R1 region (at least position 3)"""
+    for i in range(1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return max(i + 1, 3)
+    return len(word)
+
+
+@lru_cache(maxsize=200000)
+def stem(word: str) -> str:
+    """Swedish Snowball stemmer (memoized, the vocabulary is small compared to the text)
+
+    word                 stem
+    klubbarna            klubb
+    restaurangerna       restaurang
+    badplatser           badplats
+    vandringsleder       vandringsled
+    fiskare              fisk
+    läkare               läk
+    kulturella           kulturell
+    vänligheten          vän
+    lyckliga             lyck
+    """
+    r1 = _r1(word)
+
+    # Step 1: inflectional suffixes
+    for suffix in STEP1_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= r1:
+            word = word[:-len(suffix)]
+            break
+    else:
+        if word.endswith("s") and len(word) - 1 >= r1 and len(word) > 1 and word[-2] in S_ENDINGS:
+            word = word[:-1]
+
+    # Step 2: undouble consonant endings
+    if any(word.endswith(s) and len(word) - 2 >= r1 for s in ("dd", "gd", "nn", "dt", "gt", "kt", "tt")):
+        word = word[:-1]
+
+    # Step 3: derivational suffixes
+    if word.endswith("fullt") and len(word) - 5 >= r1:
+        word = word[:-1]
+    elif word.endswith("löst") and len(word) - 4 >= r1:
+        word = word[:-1]
+    else:
+        for suffix in ("lig", "els", "ig"):
+            if word.endswith(suffix) and len(word) - len(suffix) >= r1:
+                word = word[:-len(suffix)]
+                break
+
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, split on word characters, drop stopwords and stem"""
+    return [stem(token) for token in TOKEN_RE.findall(text.lower())
+            if token not in STOPWORDS and not token.isdigit()]
+
+
+def split_passages(text: str, passage_words: int = 120, overlap: int = 30) -> List[str]:
+    """Split text into overlapping windows of roughly passage_words words"""
+    words = text.split()
+    if len(words) <= passage_words:
+        return [text] if words else []
+
+    step = max(passage_words - overlap, 1)
+    passages = []
+    for start in range(0, len(words), step):
+        passages.append(" ".join(words[start:start + passage_words]))
+        if start + passage_words >= len(words):
+            break
+    return passages
+
+
+class Passage:
+    __slots__ = ("title", "uri", "text")
+
+    def __init__(self, title: str, uri: str, text: str):
+        self.title = title
+        self.uri = uri
+        self.text = text
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"title": self.title, "uri": self.uri, "content": self.text}
+
+
+class PageIndex:
+    """Inverted index with BM25 scoring over page passages"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.passages: List[Passage] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.idf: Dict[str, float] = {}
+        self.avg_length = 0.0
+
+    @classmethod
+    def build(cls, pages: Iterable[Tuple[str, str, str]], passage_words: int = 120, overlap: int = 30,
+              k1: float = 1.5, b: float = 0.75) -> "PageIndex":
+        """Build an index from (title, uri, full text) tuples"""
+        index = cls(k1=k1, b=b)
+        for title, uri, text in pages:
+            for passage_text in split_passages(text, passage_words, overlap):
+                index._add(Passage(title, uri, passage_text))
+        index._finalize()
+        return index
+
+    def _add(self, passage: Passage) -> None:
+        passage_id = len(self.passages)
+        # Index the title with every passage so page topics always match
+        terms = Counter(tokenize(f"{passage.title} {passage.text}"))
+        for term, tf in terms.items():
+            self.postings.setdefault(term, []).append((passage_id, tf))
+        self.passages.append(passage)
+        self.lengths.append(sum(terms.values()))
+
+    def _finalize(self) -> None:
+        count = len(self.passages)
+        self.avg_length = (sum(self.lengths) / count) if count else 0.0
+        self.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def _lookup(self, term: str) -> Optional[Tuple[float, Iterable[Tuple[int, int]]]]:
+        """IDF and (passage id, term frequency) postings of a term, None if no passage has it"""
+        postings = self.postings.get(term)
+        if not postings:
+            return None
+        return self.idf[term], postings
+
+    def search(self, query: str, top_k: int = 8) -> List[Tuple[float, Passage]]:
+        """Return the top_k passages for a query as (score, passage), best first"""
+        if not self.passages:
+            return []
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            found = self._lookup(term)
+            if found is None:
+                continue
+            idf, postings = found
+            for passage_id, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[passage_id] / self.avg_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, self.passages[passage_id]) for passage_id, score in best]
+
+    def search_context(self, query: str, top_k: int = 8) -> Optional[List[Dict[str, str]]]:
+        """Top passages as prompt records, or None if nothing matched"""
+        results = self.search(query, top_k)
+        if not results:
+            return None
+        return [passage.to_dict() for _, passage in results]
@@ -0,0 +1,161 @@
+import re
+import json
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from tracing import span
+from event_index import parse_date_window
+
+# Words (or word beginnings, so Swedish compounds and plurals match) that point at each tool
+EVENT_TERMS = [
+    "evenemang", "event", "händer", "konsert", "festival", "marknad", "aktivitet", "föreställning",
+    "teater", "utställning", "program", "helg", "weekend", "veckoslut", "ikväll", "idag", "imorgon",
+    "concert", "happening", "tonight", "today", "tomorrow", "veranstaltung", "konzert", "wochenende",
+    "januari", "februari", "mars", "april", "maj", "juni", "juli", "augusti", "september", "oktober",
+    "november", "december",
+]
+PAGE_TERMS = [
+    "restaurang", "äta", "mat", "café", "kafé", "hotell", "boende", "camping", "vandrarhem", "strand",
+    "bad", "parkering", "öppettider", "museum", "butik", "handla", "cykel", "vandring", "hamn",
+    "toalett", "tåg", "buss", "restaurant", "eat", "hotel", "accommodation", "beach", "parking",
+    "opening", "shop", "hike", "unterkunft", "essen", "parken",
+]
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def guess_tool(message: str) -> Optional[str]:
+    """The tool GPT-4o will most likely call for message, or None when the words do not tell"""
+    words = WORD_PATTERN.findall(message.lower())
+    events = sum(1 for word in words if any(word.startswith(term) for term in EVENT_TERMS))
+    pages = sum(1 for word in words if any(word.startswith(term) for term in PAGE_TERMS))
+    if events > pages:
+        return "ask_gemini_about_events"
+    if pages > events:
+        return "ask_gemini_about_pages"
+    return None
+
+
+class Prefetch:
+    """A tool call started before GPT-4o has chosen a tool"""
+    __slots__ = ("tool", "query", "task", "started", "finished", "claimed")
+
+    def __init__(self, tool: str, query: str, started: float):
+        self.tool = tool
+        # The visitor's message with its date references resolved
+        self.query = query
+        self.task: Optional[asyncio.Task] = None
+        self.started = started
+        self.finished: Optional[float] = None
+        self.claimed = False
+
+
+class SpeculativePrefetcher:
+    """Starts the likely tool for a visitor's message while GPT-4o is still deciding.
+
+    The tool is asked the visitor's own message. When GPT-4o then calls that
+    tool, the prefetched answer is used for its first call, unless that call
+    asks about other dates. GPT-4o rewrites the question (dates formatted,
+    page queries in Swedish), so the wording is not compared: the dates are,
+    after resolve_query (app.py's process_date_references) has made date
+    references explicit. An unclaimed prefetch is cancelled; it cost one
+    Gemini call, counted in `unclaimed` and `wasted_seconds`.
+    """
+
+    def __init__(self, functions: Dict[str, Callable[..., Awaitable[str]]],
+                 classify: Callable[[str], Optional[str]] = guess_tool,
+                 resolve_query: Callable[[str], str] = lambda query: query):
+        self.functions = functions
+        self.classify = classify
+        self.resolve_query = resolve_query
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.started = 0
+        self.hits = 0
+        self.unclaimed = 0
+        # Calls of the guessed tool that asked about other dates than the visitor's message
+        self.window_mismatches = 0
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    def start(self, message: str, query: str) -> Optional[Prefetch]:
+        """Start the guessed tool for message, asking it query; None if there is no guess"""
+        with self._lock:
+            self.messages += 1
+        tool = self.classify(message)
+        if tool not in self.functions:
+            return None
+        with self._lock:
+            self.started += 1
+        prefetch = Prefetch(tool, query, time.perf_counter())
+
+        async def run():
+            try:
+                with span("prefetch", tool=tool):
+                    return await self.functions[tool](query=query)
+            finally:
+                prefetch.finished = time.perf_counter()
+
+        prefetch.task = asyncio.ensure_future(run())
+        return prefetch
+
+    def claim(self, prefetch: Optional[Prefetch], tool_call: Dict[str, Any]) -> bool:
+        """Whether tool_call is answered by the prefetch: the first call of the guessed tool
+        about the same dates claims it"""
+        if prefetch is None or prefetch.claimed or tool_call["function"]["name"] != prefetch.tool:
+            return False
+        try:
+            args = json.loads(tool_call["function"]["arguments"] or "{}")
+        except json.JSONDecodeError:
+            args = {}
+        query = str(args.get("query") or "") if isinstance(args, dict) else ""
+        if parse_date_window(self.resolve_query(query)) != parse_date_window(prefetch.query):
+            # GPT-4o asked about other dates: settle() cancels the prefetch
+            with self._lock:
+                self.window_mismatches += 1
+            return False
+        prefetch.claimed = True
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def settle(self, prefetch: Optional[Prefetch]) -> None:
+        """Once all tool calls are known: cancel a prefetch that no call claimed"""
+        if prefetch is None or prefetch.claimed:
+            return
+        self.cancel(prefetch)
+        # The Gemini time (and upstream slot) the prefetch took for nothing
+        wasted = (prefetch.finished or time.perf_counter()) - prefetch.started
+        with self._lock:
+            self.unclaimed += 1
+            self.wasted_seconds += wasted
+
+    def cancel(self, prefetch: Optional[Prefetch]) -> None:
+        if prefetch is not None and not prefetch.task.done():
+            prefetch.task.cancel()
+
+    async def result(self, prefetch: Prefetch) -> str:
+        """Await a claimed prefetch, counting the time it saved"""
+        claimed = time.perf_counter()
+        answer = await prefetch.task
+        # The tool would only have started now, and taken as long as it did
+        saved = min(prefetch.finished, claimed) - prefetch.started
+        with self._lock:
+            self.saved_seconds += saved
+        return answer
+
+    def stats(self) -> Dict[str, Any]:
+        """Prefetch hit rate, latency saved per hit and Gemini time spent on unclaimed prefetches"""
+        with self._lock:
+            return {
+                "messages": self.messages,
+                "started": self.started,
+                "hits": self.hits,
+                "unclaimed": self.unclaimed,
+                "window_mismatches": self.window_mismatches,
+                "wasted_seconds": self.wasted_seconds,
+                "hit_rate": self.hits / self.started if self.started else 0.0,
+                "avg_saved_ms": self.saved_seconds / self.hits * 1000 if self.hits else 0.0,
+            }
@@ -0,0 +1,101 @@
+import json
+from typing import List, Dict, Any, Iterable, Union
+
+EVENT_FIELDS = ("title", "summary", "location", "dates", "uri")
+PAGE_FIELDS = ("title", "content", "uri", "date")
+
+
+class StringTable:
+    """Strings shared by the records of a corpus, so equal values are stored once.
+
+    Locations and date labels repeat across thousands of events; interning
+    them makes every record point at the same string object.
+    """
+
+    def __init__(self):
+        self.strings: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def intern(self, value):
+        if not isinstance(value, str):
+            return value
+        return self.strings.setdefault(value, value)
+
+    def retain(self, records: Iterable[Any]) -> None:
+        """Drop strings no longer referenced by any of the records"""
+        live = {}
+        for record in records:
+            if isinstance(record, (EventRecord, PageRecord)):
+                for value in record.shared_strings():
+                    live[value] = value
+        self.strings = live
+
+
+class EventRecord:
+    """Reduced event, serialized with the same keys as reduce_event"""
+    __slots__ = EVENT_FIELDS
+
+    def __init__(self, title: str, summary: str, location: str, dates: tuple, uri: str):
+        self.title = title
+        self.summary = summary
+        self.location = location
+        self.dates = dates
+        self.uri = uri
+
+    def shared_strings(self) -> Iterable[str]:
+        yield self.location
+        yield from self.dates
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "title": self.title,
+            "summary": self.summary,
+            "location": self.location,
+            "dates": list(self.dates),
+            "uri": self.uri
+        }
+
+
+class PageRecord:
+    """Reduced page, serialized with the same keys as reduce_page"""
+    __slots__ = PAGE_FIELDS
+
+    def __init__(self, title: str, content: str, uri: str, date: str):
+        self.title = title
+        self.content = content
+        self.uri = uri
+        self.date = date
+
+    def shared_strings(self) -> Iterable[str]:
+        yield self.date
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"title": self.title, "content": self.content, "uri": self.uri, "date": self.date}
+
+
+Record = Union[EventRecord, PageRecord, Dict[str, Any]]
+
+
+def compact_record(record: Dict[str, Any], strings: StringTable) -> Record:
+    """Store a reduced event or page dict as a slotted record with interned strings.
+
+    Anything else (e.g. the error records of reduce_event) is kept as is.
+    """
+    if tuple(record) == EVENT_FIELDS:
+        return EventRecord(record["title"], record["summary"], strings.intern(record["location"]),
+                           tuple(strings.intern(label) for label in record["dates"]), record["uri"])
+    if tuple(record) == PAGE_FIELDS:
+        return PageRecord(record["title"], record["content"], record["uri"], strings.intern(record["date"]))
+    return record
+
+
+def as_dict(record: Record) -> Dict[str, Any]:
+    """A new dict in the prompt format, safe to modify"""
+    return dict(record) if isinstance(record, dict) else record.to_dict()
+
+
+def encode_records(records: List[Record]) -> str:
+    """Serialize records to the JSON prompt format"""
+    return json.dumps([as_dict(record) for record in records], ensure_ascii=False)
@@ -0,0 +1,321 @@
+"""One corpus shared by several app processes on a host.
+
+The process holding an exclusive lock on `refresh.lock` is the refresh
+leader: it alone syncs with the CMS and publishes each prepared corpus as a
+flat file. The other processes (followers) memory-map the published file and
+read its records and indexes in place, so neither CMS requests nor the
+corpus memory grow with the number of processes. A new version is written
+to a temporary file and renamed over the old one; followers map it when they
+notice the change, and their previous views stay valid until dropped.
+"""
+import os
+import json
+import math
+import mmap
+import tempfile
+import threading
+from array import array
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from corpus import PreparedCorpus
+from record_store import as_dict
+from page_index import PageIndex, Passage
+from event_index import EventIndex
+
+# Bump when the layout of published corpus files changes
+SHARED_FORMAT = 2
+MAGIC = b"FBGCORP1"
+
+# Seconds between checks for a new published version (followers) or an expired corpus (leader)
+SHARED_POLL_INTERVAL = 5.0
+
+
+def published_path(shared_dir: str, name: str) -> str:
+    return os.path.join(shared_dir, f"{name}.corpus")
+
+
+class MappedStrings(Sequence):
+    """Strings stored as one UTF-8 blob with an offsets array, decoded on access"""
+
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+
+class MappedRecords(Sequence):
+    """Corpus records stored as JSON strings; each access returns a new dict in the prompt format"""
+
+    def __init__(self, strings: MappedStrings):
+        self._strings = strings
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [json.loads(value) for value in self._strings[i]]
+        return json.loads(self._strings[i])
+
+
+class MappedPassages(Sequence):
+    def __init__(self, titles: MappedStrings, uris: MappedStrings, texts: MappedStrings):
+        self._titles = titles
+        self._uris = uris
+        self._texts = texts
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def __getitem__(self, i) -> Passage:
+        return Passage(self._titles[i], self._uris[i], self._texts[i])
+
+
+class MappedPageIndex(PageIndex):
+    """PageIndex read from a published file: postings are arrays in the mapping and
+    terms are found by binary search, so no per-term objects are built"""
+
+    def __init__(self, k1: float, b: float, avg_length: float, passages: MappedPassages, lengths: memoryview,
+                 terms: MappedStrings, posting_starts: memoryview, posting_ids: memoryview, posting_tfs: memoryview):
+        super().__init__(k1=k1, b=b)
+        self.avg_length = avg_length
+        self.passages = passages
+        self.lengths = lengths
+        self.terms = terms
+        self._starts = posting_starts
+        self._ids = posting_ids
+        self._tfs = posting_tfs
+
+    def _lookup(self, term: str) -> Optional[Tuple[float, Iterable[Tuple[int, int]]]]:
+        lo, hi = 0, len(self.terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.terms[mid] < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(self.terms) or self.terms[lo] != term:
+            return None
+        start, end = self._starts[lo], self._starts[lo + 1]
+        count, found = len(self.passages), end - start
+        # Same IDF as PageIndex._finalize
+        idf = math.log(1 + (count - found + 0.5) / (found + 0.5))
+        return idf, zip(self._ids[start:end], self._tfs[start:end])
+
+
+def _strings_sections(prefix: str, values: Iterable[str], sections: Dict[str, Tuple[str, bytes]]) -> None:
+    offsets = array("Q", [0])
+    blob = bytearray()
+    for value in values:
+        blob += value.encode("utf-8")
+        offsets.append(len(blob))
+    sections[f"{prefix}.offsets"] = ("Q", offsets.tobytes())
+    sections[f"{prefix}.blob"] = ("B", bytes(blob))
+
+
+def _page_index_sections(index: PageIndex, sections: Dict[str, Tuple[str, bytes]]) -> Dict[str, Any]:
+    _strings_sections("passage_titles", (p.title for p in index.passages), sections)
+    _strings_sections("passage_uris", (p.uri for p in index.passages), sections)
+    _strings_sections("passage_texts", (p.text for p in index.passages), sections)
+    sections["lengths"] = ("I", array("I", index.lengths).tobytes())
+    terms = sorted(index.postings)
+    _strings_sections("terms", terms, sections)
+    starts, ids, tfs = array("Q", [0]), array("I"), array("I")
+    for term in terms:
+        for passage_id, tf in index.postings[term]:
+            ids.append(passage_id)
+            tfs.append(tf)
+        starts.append(len(ids))
+    sections["posting_starts"] = ("Q", starts.tobytes())
+    sections["posting_ids"] = ("I", ids.tobytes())
+    sections["posting_tfs"] = ("I", tfs.tobytes())
+    return {"type": "page", "k1": index.k1, "b": index.b, "avg_length": index.avg_length}
+
+
+def _event_index_sections(index: EventIndex, sections: Dict[str, Tuple[str, bytes]]) -> Dict[str, Any]:
+    sections["starts"] = ("i", array("i", index.starts).tobytes())
+    sections["ends"] = ("i", array("i", index.ends).tobytes())
+    sections["event_ids"] = ("I", array("I", index.event_ids).tobytes())
+    sections["undated"] = ("I", array("I", index.undated).tobytes())
+    _strings_sections("labels", index.labels, sections)
+    sections["long_starts"] = ("i", array("i", index.long_starts).tobytes())
+    sections["long_ends"] = ("i", array("i", index.long_ends).tobytes())
+    sections["long_event_ids"] = ("I", array("I", index.long_event_ids).tobytes())
+    _strings_sections("long_labels", index.long_labels, sections)
+    return {"type": "event", "max_duration": index.max_duration}
+
+
+def write_published(path: str, corpus: PreparedCorpus, last_updated: float) -> None:
+    """Write a corpus with its index as a flat file, replacing the previous version atomically.
+
+    Layout: magic, 8-byte header length, JSON header (metadata and the offset,
+    size and array type of each section), then the 8-byte aligned sections.
+    """
+    sections: Dict[str, Tuple[str, bytes]] = {}
+    _strings_sections("records", (json.dumps(as_dict(record), ensure_ascii=False) for record in corpus.records),
+                      sections)
+    index_meta = None
+    if isinstance(corpus.index, PageIndex):
+        index_meta = _page_index_sections(corpus.index, sections)
+    elif isinstance(corpus.index, EventIndex):
+        index_meta = _event_index_sections(corpus.index, sections)
+
+    header = {
+        "format": SHARED_FORMAT, "kind": corpus.kind, "version": corpus.version, "last_updated": last_updated,
+        "built_at": corpus.built_at, "original_tokens": corpus.original_tokens,
+        "reduced_tokens": corpus.reduced_tokens, "index": index_meta, "sections": {},
+    }
+    offset = 0
+    for name, (typecode, data) in sections.items():
+        header["sections"][name] = [offset, len(data), typecode]
+        offset += len(data) + (-len(data) % 8)
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-(len(MAGIC) + 8 + len(header_bytes)) % 8)
+
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".corpus.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            for _, data in sections.values():
+                f.write(data)
+                f.write(b"\0" * (-len(data) % 8))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_published(path: str) -> Optional[Tuple[PreparedCorpus, float]]:
+    """Map a file written by write_published as a corpus (and its last update time), or None if it
+    is missing or of another format"""
+    try:
+        with open(path, "rb") as f:
+            return _map_published(f)
+    except FileNotFoundError:
+        return None
+
+
+def _map_published(f) -> Optional[Tuple[PreparedCorpus, float]]:
+    try:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty file
+        return None
+    view = memoryview(mapping)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        return None
+    header_length = int.from_bytes(view[len(MAGIC):len(MAGIC) + 8], "little")
+    data_start = len(MAGIC) + 8 + header_length
+    header = json.loads(bytes(view[len(MAGIC) + 8:data_start]))
+    if header.get("format") != SHARED_FORMAT:
+        return None
+
+    def section(name: str) -> memoryview:
+        offset, size, typecode = header["sections"][name]
+        return view[data_start + offset:data_start + offset + size].cast(typecode)
+
+    def strings(prefix: str) -> MappedStrings:
+        return MappedStrings(section(f"{prefix}.offsets"), section(f"{prefix}.blob"))
+
+    corpus = PreparedCorpus(header["kind"], MappedRecords(strings("records")), "", header["original_tokens"],
+                            header["reduced_tokens"], header["built_at"], version=header["version"])
+    index_meta = header["index"]
+    if index_meta and index_meta["type"] == "page":
+        passages = MappedPassages(strings("passage_titles"), strings("passage_uris"), strings("passage_texts"))
+        corpus.index = MappedPageIndex(index_meta["k1"], index_meta["b"], index_meta["avg_length"], passages,
+                                       section("lengths"), strings("terms"), section("posting_starts"),
+                                       section("posting_ids"), section("posting_tfs"))
+    elif index_meta and index_meta["type"] == "event":
+        index = EventIndex()
+        index.starts = section("starts")
+        index.ends = section("ends")
+        index.event_ids = section("event_ids")
+        index.undated = section("undated")
+        index.labels = strings("labels")
+        index.long_starts = section("long_starts")
+        index.long_ends = section("long_ends")
+        index.long_event_ids = section("long_event_ids")
+        index.long_labels = strings("long_labels")
+        index.max_duration = index_meta["max_duration"]
+        corpus.index = index
+    return corpus, header["last_updated"]
+
+
+class SharedCorpus:
+    """Leader election and corpus publication between the app processes sharing shared_dir.
+
+    Leadership is an exclusive flock on refresh.lock, held for the life of the
+    process; when the leader exits, the lock is released and the next follower
+    to call try_lead() takes over.
+    """
+
+    def __init__(self, shared_dir: str):
+        self.shared_dir = shared_dir
+        os.makedirs(shared_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(shared_dir, "refresh.lock"), "a+")
+        self.is_leader = False
+        # File identity (inode, mtime) of the version each corpus was last read from
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def try_lead(self) -> bool:
+        """Become the refresh leader if no other process is; True if this process leads"""
+        if self.is_leader:
+            return True
+        # Imported here so the module (and gemini_tools, which imports it) still loads where
+        # fcntl does not exist, such as Windows; only sharing a corpus needs flock
+        import fcntl
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.is_leader = True
+        return True
+
+    def publish(self, name: str, corpus: PreparedCorpus, last_updated: float) -> None:
+        write_published(published_path(self.shared_dir, name), corpus, last_updated)
+
+    def published_version(self, name: str) -> Optional[str]:
+        """Version of the published corpus, without mapping its data"""
+        try:
+            with open(published_path(self.shared_dir, name), "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    return None
+                header = json.loads(f.read(int.from_bytes(f.read(8), "little")))
+        except (OSError, ValueError):
+            return None
+        return header.get("version") if header.get("format") == SHARED_FORMAT else None
+
+    def read_if_changed(self, name: str) -> Optional[Tuple[PreparedCorpus, float]]:
+        """Map the published corpus if a new version appeared since the last call, else None"""
+        path = published_path(self.shared_dir, name)
+        with self._lock:
+            try:
+                with open(path, "rb") as f:
+                    # Identity of the opened file, so a version renamed in meanwhile is not skipped
+                    stat = os.fstat(f.fileno())
+                    identity = (stat.st_ino, stat.st_mtime_ns)
+                    if self._seen.get(name) == identity:
+                        return None
+                    published = _map_published(f)
+            except FileNotFoundError:
+                return None
+            if published is not None:
+                self._seen[name] = identity
+            return published
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from typing import List, Optional, Tuple
+
+
+class SingleFlight:
+    """Allows at most one refresh of a cache to be in flight at a time.
+
+    Works across the background refresh thread, sync callers and the async
+    Chainlit handlers: the flag is claimed under a threading lock and sync
+    waiters block on a threading event. Async waiters await a future of their
+    own event loop, which release() resolves with call_soon_threadsafe, so
+    they hold no thread while they wait.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def in_flight(self) -> bool:
+        return not self._idle.is_set()
+
+    def try_acquire(self) -> bool:
+        """Claim the refresh slot; False if another refresh is already running"""
+        with self._lock:
+            if not self._idle.is_set():
+                return False
+            self._idle.clear()
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._idle.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # The waiter's event loop has been closed
+                pass
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the in-flight refresh to finish"""
+        return self._idle.wait(timeout)
+
+    async def await_idle(self, timeout: Optional[float] = None) -> bool:
+        """Async version of wait that does not block the event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._idle.is_set():
+                return True
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(True)
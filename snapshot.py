@@ -0,0 +1,82 @@
+import os
+import json
+import tempfile
+from typing import Optional, Dict, Any
+
+from corpus import PreparedCorpus
+from cms_sync import CorpusSync, SyncedNode
+from record_store import as_dict, compact_record
+from event_index import EventIndex
+from page_index import PageIndex
+
+# Bump when the snapshot layout or the reduced record format changes
+SNAPSHOT_FORMAT = 4
+
+
+def snapshot_path(snapshot_dir: str, name: str) -> str:
+    return os.path.join(snapshot_dir, f"{name}.snapshot.json")
+
+
+def save_snapshot(snapshot_dir: str, name: str, corpus: PreparedCorpus, last_updated: float,
+                  sync: CorpusSync) -> str:
+    """Write a corpus's sync state to disk atomically, as plain JSON.
+
+    Only data is stored (the reduced records, content hashes, token counts
+    and index sources of the nodes), never objects, so a snapshot file cannot
+    run code when it is loaded. The indexes are rebuilt on load.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = snapshot_path(snapshot_dir, name)
+    payload = {
+        "format": SNAPSHOT_FORMAT, "name": name, "kind": corpus.kind, "version": corpus.version,
+        "last_updated": last_updated, "built_at": corpus.built_at, "reduced_tokens": corpus.reduced_tokens,
+        "last_sync": sync.last_sync, "last_full_sync": sync.last_full_sync,
+        "nodes": [[key, node.hash, as_dict(node.record), node.index_source, node.tokens]
+                  for key, node in sync.nodes.items()],
+    }
+
+    # Write to a temporary file and rename so readers never see a partial snapshot
+    fd, tmp_path = tempfile.mkstemp(dir=snapshot_dir, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def load_snapshot(snapshot_dir: str, name: str) -> Optional[Dict[str, Any]]:
+    """Load a snapshot written by save_snapshot (last_updated, corpus with its index, sync state),
+    or None if it is missing, of another format or unreadable"""
+    path = snapshot_path(snapshot_dir, name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        if not isinstance(payload, dict) or payload.get("format") != SNAPSHOT_FORMAT:
+            return None
+        return _restore(payload)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _restore(payload: Dict[str, Any]) -> Dict[str, Any]:
+    sync = CorpusSync()
+    sync.last_sync = float(payload["last_sync"])
+    sync.last_full_sync = float(payload["last_full_sync"])
+    page = payload["kind"] == "page"
+    for key, digest, record, index_source, tokens in payload["nodes"]:
+        if page:
+            # (title, uri, full text) of the page index
+            index_source = tuple(index_source)
+        sync.nodes[key] = SyncedNode(digest, compact_record(record, sync.strings), index_source, int(tokens))
+
+    # The version and token count were computed from the same records when the corpus was built
+    corpus = PreparedCorpus(payload["kind"], sync.records(), "", sync.original_tokens(), payload["reduced_tokens"],
+                            payload["built_at"], version=payload["version"])
+    corpus.index = PageIndex.build(sync.index_sources()) if page else EventIndex.build(sync.index_sources())
+    return {"last_updated": payload["last_updated"], "corpus": corpus, "sync": sync}
@@ -0,0 +1,179 @@
+"""Buffered JSON-lines logging with a background writer and file rotation.
+
+Each record is one JSON line with a timestamp, level, source, message, the
+request id of the current chat turn (its trace id) and any extra fields.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+from typing import Any, Dict, List, Tuple
+
+from tracing import current_span
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+# Rotate at 10 MiB by default, keeping this many older files (path.1 is the newest)
+MAX_BYTES = 10 * 1024 * 1024
+BACKUPS = 5
+
+# Records written per batch, and the longest a record waits for its batch
+BATCH_SIZE = 512
+FLUSH_INTERVAL = 0.5
+
+
+def process_path(path: str) -> str:
+    """path with this process's id before its extension, for processes that would share one file"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{extension}"
+
+
+class _Flush:
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class LogWriter:
+    """Writes log records from a background thread, so logging never blocks a chat turn.
+
+    Records are queued (at most max_queue; further records are dropped and
+    counted rather than waited for) and written in batches to a file kept
+    open between batches. The file is rotated when it reaches max_bytes or
+    has been written to for rotate_interval seconds, keeping `backups` older
+    files. Records with console=True are also printed to stdout. Only one
+    process may write a path: rotation renames the file under any other
+    writer (see process_path).
+    """
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES, backups: int = BACKUPS,
+                 rotate_interval: float = 0, level: str = "DEBUG", max_queue: int = 10000,
+                 batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.rotate_interval = rotate_interval
+        self.level = LEVELS[level.upper()]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._file = None
+        self._opened_at = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.write_errors = 0
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def write(self, level: str, source: str, message: str, console: bool = False, **fields: Any) -> None:
+        """Queue a record for the current request (returns at once)"""
+        if LEVELS.get(level, LEVELS["INFO"]) < self.level:
+            return
+        record = {"ts": time.time(), "level": level, "source": source, "message": message}
+        request_id = current_span().trace_id
+        if request_id:
+            record["request_id"] = request_id
+        record.update(fields)
+        self.put(record, console)
+
+    def put(self, record: Dict[str, Any], console: bool = False) -> None:
+        """Queue a ready-made record (e.g. a finished trace span)"""
+        try:
+            self._queue.put_nowait((record, console))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait until the records queued so far are written"""
+        marker = _Flush()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.done.wait(timeout)
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened_at = time.time()
+
+    def _rotate(self) -> None:
+        """Move path to path.1 (and path.N to path.N+1, dropping the oldest) and start a new file"""
+        self._file.close()
+        self._file = None
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{index}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+    def _due_for_rotation(self) -> bool:
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _write_batch(self, batch: List[Tuple[Dict[str, Any], bool]]) -> None:
+        lines = []
+        for record, console in batch:
+            lines.append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            if console:
+                print(record.get("message", ""))
+        try:
+            if self._file is not None and self._due_for_rotation():
+                self._rotate()
+            if self._file is None:
+                self._open()
+            self._file.write("".join(lines))
+            self._file.flush()
+            self.written += len(lines)
+        except OSError as e:
+            self.write_errors += 1
+            print(f"Writing {self.path} failed: {str(e)}", file=sys.stderr)
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch, markers = [], []
+            deadline = time.time() + self.flush_interval
+            while True:
+                if isinstance(item, _Flush):
+                    markers.append(item)
+                    # Write what is queued now instead of waiting out the interval
+                    deadline = 0
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.time(), 0)) if deadline else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+            for marker in markers:
+                marker.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Records written, dropped because the queue was full, queued and file rotations"""
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "rotations": self.rotations,
+            "write_errors": self.write_errors,
+        }
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from admission import UpstreamBusy, UpstreamLimiter, queue_listener
+
+
+def test_queue_full_is_refused():
+    limiter = UpstreamLimiter("test", max_concurrent=1, max_queue=0)
+    limiter.acquire("a")
+    with pytest.raises(UpstreamBusy):
+        limiter.acquire("b")
+    limiter.release()
+    assert limiter.stats()["active"] == 0
+
+
+def test_slots_rotate_between_sessions():
+    async def main():
+        limiter = UpstreamLimiter("test", max_concurrent=1, max_queue=10)
+        await limiter.aacquire("holder")
+        order = []
+
+        async def request(session):
+            await limiter.aacquire(session)
+            order.append(session)
+            limiter.release()
+
+        tasks = []
+        for session in ["a", "a", "a", "b", "c"]:
+            tasks.append(asyncio.create_task(request(session)))
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order, limiter.stats()
+
+    order, stats = asyncio.run(main())
+    assert order == ["a", "b", "c", "a", "a"]
+    assert (stats["active"], stats["queued"]) == (0, 0)
+
+
+def test_wait_timeout_raises_busy():
+    async def main():
+        limiter = UpstreamLimiter("test", max_concurrent=1, max_wait=0.05)
+        await limiter.aacquire("a")
+        with pytest.raises(UpstreamBusy):
+            await limiter.aacquire("b")
+        return limiter.stats()
+
+    stats = asyncio.run(main())
+    assert (stats["queued"], stats["rejected"]) == (0, 1)
+
+
+def test_slot_released_when_the_listener_fails():
+    async def main():
+        limiter = UpstreamLimiter("test", max_concurrent=1)
+        await limiter.aacquire("a")
+
+        async def listener(name, position):
+            if position == 0:
+                raise RuntimeError("message update failed")
+
+        async def waiter():
+            queue_listener.set(listener)
+            await limiter.aacquire("b")
+
+        task = asyncio.create_task(waiter())
+        await asyncio.sleep(0.05)
+        limiter.release()
+        with pytest.raises(RuntimeError):
+            await task
+        return limiter.stats()
+
+    stats = asyncio.run(main())
+    assert (stats["active"], stats["queued"]) == (0, 0)
+
+
+def test_rate_limited_calls_are_retried():
+    limiter = UpstreamLimiter("test", backoff_base=0.001)
+    attempts = []
+
+    class RateLimited(Exception):
+        status_code = 429
+
+    def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RateLimited()
+        return "ok"
+
+    assert limiter.call(call) == "ok"
+    assert len(attempts) == 3
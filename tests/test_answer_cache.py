@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from answer_cache import AnswerCache
+
+
+def test_concurrent_requests_share_one_generation():
+    cache = AnswerCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "svar"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute(("events", "q"), compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["svar"] * 8
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] + stats["hits"] >= 7
+
+
+def test_async_requests_share_one_generation():
+    cache = AnswerCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "svar"
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_compute(("pages", "q"), compute) for _ in range(8)))
+
+    assert asyncio.run(main()) == ["svar"] * 8
+    assert len(calls) == 1
+
+
+def test_failures_are_not_cached():
+    cache = AnswerCache()
+
+    def fail():
+        raise RuntimeError("Gemini error")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("key", fail)
+    assert cache.get_or_compute("key", lambda: "svar") == "svar"
+
+
+def test_stream_caches_the_joined_answer():
+    cache = AnswerCache()
+    assert list(cache.stream("key", lambda: iter(["hej ", "då"]))) == ["hej ", "då"]
+    assert list(cache.stream("key", lambda: iter(["annat"]))) == ["hej då"]
+
+
+def test_lru_and_invalidate():
+    cache = AnswerCache(max_entries=2)
+    cache.put(("events", 1), "a")
+    cache.put(("pages", 2), "b")
+    cache.get(("events", 1))
+    cache.put(("pages", 3), "c")
+    assert cache.get(("pages", 2)) is None
+    assert cache.invalidate("pages") == 1
+    assert cache.get(("events", 1)) == "a"
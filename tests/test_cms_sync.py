@@ -0,0 +1,75 @@
+import pytest
+
+from cms_sync import CorpusSync
+
+NOW = 1_750_000_000.0
+
+
+def node(database_id, title):
+    return {"databaseId": database_id, "title": title, "content": f"<p>{title}</p>"}
+
+
+def reduce_nodes(nodes):
+    return [({"title": n["title"]}, n["title"]) for n in nodes]
+
+
+def count_tokens(text):
+    return len(text) // 4
+
+
+def sync_pages(sync, pages, full, started_at, fail_after=None):
+    run = sync.begin(full, started_at)
+    for i, page in enumerate(pages):
+        if fail_after is not None and i == fail_after:
+            raise ConnectionError("CMS went away")
+        run.merge(page, reduce_nodes, count_tokens)
+    run.finish()
+    return run
+
+
+def test_full_sync_then_only_changes_are_reduced():
+    sync = CorpusSync()
+    assert sync.modified_since(NOW) is None
+    first = sync_pages(sync, [[node(1, "a"), node(2, "b")], [node(3, "c")]], True, NOW)
+    assert (first.fetched, first.changed, len(sync)) == (3, 3, 3)
+
+    second = sync_pages(sync, [[node(1, "a"), node(2, "B")]], False, NOW + 60)
+    assert (second.fetched, second.changed, second.removed) == (2, 1, 0)
+    assert sorted(sync.index_sources()) == ["B", "a", "c"]
+    assert sync.modified_since(NOW + 120) is not None
+
+
+def test_full_sync_prunes_unseen_nodes():
+    sync = CorpusSync()
+    sync_pages(sync, [[node(1, "a"), node(2, "b")]], True, NOW)
+    run = sync_pages(sync, [[node(2, "b")]], True, NOW + 60)
+    assert run.removed == 1
+    assert sync.index_sources() == ["b"]
+    assert sync.last_full_sync == NOW + 60
+
+
+def test_failed_sync_leaves_state_and_retry_sees_changes():
+    sync = CorpusSync()
+    sync_pages(sync, [[node(1, "a"), node(2, "b")]], True, NOW)
+    pages = [[node(1, "A")], [node(2, "B")]]
+
+    with pytest.raises(ConnectionError):
+        sync_pages(sync, pages, False, NOW + 60, fail_after=1)
+    # Nothing of the failed run was applied, and the sync time did not move
+    assert sorted(sync.index_sources()) == ["a", "b"]
+    assert sync.last_sync == NOW
+
+    retry = sync_pages(sync, pages, False, NOW + 120)
+    assert retry.changed == 2
+    assert sorted(sync.index_sources()) == ["A", "B"]
+    assert sync.last_sync == NOW + 120
+
+
+def test_apply_keeps_pages_of_a_failed_first_sync():
+    sync = CorpusSync()
+    run = sync.begin(True, NOW)
+    run.merge([node(1, "a")], reduce_nodes, count_tokens)
+    run.apply()
+    assert len(sync) == 1
+    # Not a completed sync, so a full sync is still due
+    assert sync.modified_since(NOW) is None
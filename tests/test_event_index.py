@@ -0,0 +1,74 @@
+import random
+from datetime import date, timedelta
+
+from event_index import EventIndex, expand_occasions, expand_rule, parse_date_window
+
+
+def random_schedules(count, seed=7):
+    rng = random.Random(seed)
+    first = date(2025, 1, 1)
+    schedules = []
+    for _ in range(count):
+        occasions = []
+        for _ in range(rng.randint(0, 3)):
+            start = first + timedelta(days=rng.randint(0, 364))
+            # Mostly single days, some season-long occurrences past LONG_OCCURRENCE_DAYS
+            length = rng.choice([0, 0, 0, 2, 6, 40, 120])
+            occasions.append({"startDate": start.isoformat(), "endDate": (start + timedelta(days=length)).isoformat()})
+        rules = []
+        if rng.random() < 0.3:
+            start = first + timedelta(days=rng.randint(0, 200))
+            rules.append({
+                "rcrWeekDay": rng.choice(["monday", "lördag", "Sunday"]),
+                "rcrStartDate": start.isoformat(),
+                "rcrEndDate": (start + timedelta(days=rng.randint(0, 150))).isoformat(),
+                "rcrWeeklyInterval": rng.choice([1, 2]),
+                "rcrStartTime": "18:00",
+            })
+        schedules.append({"occasions": occasions, "rcrRules": rules})
+    return schedules
+
+
+def brute_force(schedules, start, end):
+    """Expand every event and keep occurrences overlapping [start, end], in the index's order"""
+    occurrences = []
+    for event_id, schedule in enumerate(schedules):
+        expanded = expand_occasions(schedule.get("occasions"))
+        for rule in schedule.get("rcrRules") or []:
+            expanded.extend(expand_rule(rule))
+        for occ_start, occ_end, label in expanded:
+            if occ_end >= start and (end is None or occ_start <= end):
+                occurrences.append((occ_start.toordinal(), occ_end.toordinal(), event_id, label))
+    matches = {}
+    for _, _, event_id, label in sorted(occurrences):
+        matches.setdefault(event_id, []).append(label)
+    return list(matches.items())
+
+
+def test_lookup_matches_brute_force():
+    schedules = random_schedules(400)
+    index = EventIndex.build(schedules)
+    assert index.long_starts, "the data should include long occurrences"
+    rng = random.Random(11)
+    for _ in range(200):
+        start = date(2024, 12, 1) + timedelta(days=rng.randint(0, 420))
+        end = None if rng.random() < 0.1 else start + timedelta(days=rng.choice([0, 1, 2, 6, 30]))
+        assert index.lookup(start, end) == brute_force(schedules, start, end)
+
+
+def test_undated_events():
+    index = EventIndex.build([{"occasions": []}, None, {"occasions": [{"startDate": "2025-07-01"}]}])
+    assert index.undated == [0, 1]
+    assert index.lookup(date(2025, 7, 1), date(2025, 7, 1)) == [(2, ["2025-07-01"])]
+
+
+def test_rule_exceptions_are_skipped():
+    rule = {"rcrWeekDay": "tisdag", "rcrStartDate": "2025-06-01", "rcrEndDate": "2025-06-30",
+            "rcrExceptions": [{"rcrExcDate": "2025-06-10"}]}
+    days = [start.isoformat() for start, _, _ in expand_rule(rule)]
+    assert days == ["2025-06-03", "2025-06-17", "2025-06-24"]
+
+
+def test_parse_date_window():
+    assert parse_date_window("evenemang 2025-07-05 till 2025-07-06") == (date(2025, 7, 5), date(2025, 7, 6))
+    assert parse_date_window("vad händer i helgen") is None
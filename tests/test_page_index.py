@@ -0,0 +1,30 @@
+import pytest
+
+from page_index import PageIndex, stem
+
+# The examples of the stem docstring
+STEMS = [
+    ("klubbarna", "klubb"),
+    ("restaurangerna", "restaurang"),
+    ("badplatser", "badplats"),
+    ("vandringsleder", "vandringsled"),
+    ("fiskare", "fisk"),
+    ("läkare", "läk"),
+    ("kulturella", "kulturell"),
+    ("vänligheten", "vän"),
+    ("lyckliga", "lyck"),
+]
+
+
+@pytest.mark.parametrize("word, expected", STEMS)
+def test_stem(word, expected):
+    assert stem(word) == expected
+
+
+def test_search_finds_inflected_forms():
+    index = PageIndex.build([
+        ("Badplatser", "/bad/", "Kommunens badplatser har bryggor och sandstränder."),
+        ("Bibliotek", "/bibliotek/", "Biblioteket har öppet alla vardagar."),
+    ])
+    results = index.search("badplats med brygga")
+    assert results and results[0][1].uri == "/bad/"
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import time
+
+from single_flight import SingleFlight
+
+
+def test_only_one_holder():
+    flight = SingleFlight()
+    assert flight.try_acquire()
+    assert not flight.try_acquire()
+    assert flight.in_flight
+    flight.release()
+    assert not flight.in_flight
+    assert flight.try_acquire()
+
+
+def test_async_waiters_resumed_from_another_thread():
+    flight = SingleFlight()
+    flight.try_acquire()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        ticks = 0
+
+        async def tick():
+            # Keeps running while the waiters wait, so they do not block the loop
+            nonlocal ticks
+            while flight.in_flight:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        threading.Timer(0.2, flight.release).start()
+        started = loop.time()
+        results = await asyncio.gather(*(flight.await_idle(5) for _ in range(20)), tick())
+        return results[:-1], loop.time() - started, ticks
+
+    results, elapsed, ticks = asyncio.run(main())
+    assert results == [True] * 20
+    assert elapsed < 2
+    assert ticks >= 5
+
+
+def test_await_idle_timeout():
+    flight = SingleFlight()
+    flight.try_acquire()
+    assert asyncio.run(flight.await_idle(0.05)) is False
+    # The timed out waiter is not left behind
+    assert flight._waiters == []
+    flight.release()
+    assert asyncio.run(flight.await_idle(0.05)) is True
+
+
+def test_sync_wait():
+    flight = SingleFlight()
+    flight.try_acquire()
+    assert not flight.wait(0.01)
+    threading.Timer(0.05, flight.release).start()
+    started = time.perf_counter()
+    assert flight.wait(5)
+    assert time.perf_counter() - started < 2
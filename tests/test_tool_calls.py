@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+from tool_calls import ToolCallAssembler, arguments_complete
+
+
+def delta(index, id=None, name=None, arguments=None):
+    return SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def test_arguments_complete():
+    assert not arguments_complete('{"query": "konsert')
+    assert not arguments_complete('{"query": {"a": 1}')
+    assert arguments_complete('{"query": "konsert"} ')
+
+
+def test_calls_complete_as_their_arguments_parse():
+    assembler = ToolCallAssembler()
+    assert assembler.add(delta(0, id="call_1", name="get_events", arguments="")) == []
+    assert assembler.add(delta(0, arguments='{"query": ')) == []
+    done = assembler.add(delta(0, arguments='"konsert"}'))
+    assert [call["id"] for call in done] == ["call_1"]
+    assert done[0]["function"] == {"name": "get_events", "arguments": '{"query": "konsert"}'}
+
+    assert assembler.add(delta(1, id="call_2", name="get_pages", arguments='{"query": "bad')) == []
+    assert [call["id"] for call in assembler.finish()] == ["call_2"]
+    assert assembler.finish() == []
+
+
+def test_next_call_completes_the_previous_one():
+    assembler = ToolCallAssembler()
+    assembler.add(delta(0, id="call_1", name="get_events", arguments='{"query": "x"'))
+    done = assembler.add(delta(1, id="call_2", name="get_pages"))
+    assert [call["id"] for call in done] == ["call_1"]
@@ -0,0 +1,57 @@
+import json
+from typing import Any, Dict, List
+
+
+def arguments_complete(arguments: str) -> bool:
+    """Whether streamed tool call arguments already form their whole JSON object"""
+    text = arguments.strip()
+    if not text.endswith("}"):
+        return False
+    try:
+        # A JSON object cannot be extended once it parses
+        return isinstance(json.loads(text), dict)
+    except json.JSONDecodeError:
+        return False
+
+
+class ToolCallAssembler:
+    """Builds tool calls from streamed deltas and tells when each one is complete.
+
+    A call is complete when its arguments parse as a JSON object, or at the
+    latest when the next call starts or the stream ends, so it can be run
+    while later calls are still streaming.
+    """
+
+    def __init__(self):
+        self.tool_calls: List[Dict[str, Any]] = []
+        self._completed = 0
+
+    def add(self, tcchunk) -> List[Dict[str, Any]]:
+        """Add a tool call delta; returns the calls it completed, in order"""
+        while len(self.tool_calls) <= tcchunk.index:
+            self.tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+        tc = self.tool_calls[tcchunk.index]
+
+        if tcchunk.id:
+            tc["id"] += tcchunk.id
+        if tcchunk.function and tcchunk.function.name:
+            tc["function"]["name"] += tcchunk.function.name
+        if tcchunk.function and tcchunk.function.arguments:
+            tc["function"]["arguments"] += tcchunk.function.arguments
+
+        # Calls before the one being streamed are done; the current one is once its arguments parse
+        done = tcchunk.index
+        if arguments_complete(tc["function"]["arguments"]):
+            done += 1
+        return self._complete_up_to(done)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """End of the stream: the calls not completed yet"""
+        return self._complete_up_to(len(self.tool_calls))
+
+    def _complete_up_to(self, end: int) -> List[Dict[str, Any]]:
+        if end <= self._completed:
+            return []
+        completed = self.tool_calls[self._completed:end]
+        self._completed = end
+        return completed
@@ -0,0 +1,263 @@
+"""Request tracing: spans around each stage of a chat turn, exported to JSONL
+or an OpenTelemetry collector (OTLP/HTTP JSON).
+
+Print p50/p95/p99 per stage from a trace file:
+
+    python -m tracing traces.jsonl
+"""
+import json
+import time
+import math
+import uuid
+import queue
+import asyncio
+import argparse
+import threading
+import contextlib
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+# Spans sent per OTLP request, and the longest a finished span waits to be sent
+OTLP_BATCH_SIZE = 256
+OTLP_FLUSH_INTERVAL = 2.0
+
+
+class Span:
+    """One timed stage; spans of a chat turn share the turn's trace id (its request id)"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "started", "duration_ms",
+                 "attributes", "error", "_tracer")
+
+    def __init__(self, tracer: Optional["Tracer"], name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        """Finish the span (once) and hand it to the exporters"""
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self._tracer is not None:
+            self._tracer.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+# Span that attributes can be set on when no span is active; it is never exported
+_DETACHED = Span(None, "detached", "", None, {})
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Span:
+    """The innermost active span of this request (attributes set outside any span are dropped)"""
+    span = _current.get()
+    if span is None:
+        _DETACHED.attributes.clear()
+        return _DETACHED
+    return span
+
+
+class JsonlExporter:
+    """Writes one JSON line per finished span through a structured_log.LogWriter,
+    which writes them in batches from its own thread"""
+
+    def __init__(self, writer: Any):
+        self.writer = writer
+
+    def export(self, span: Span) -> None:
+        self.writer.put(span.to_dict())
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter:
+    """Sends spans in batches to an OpenTelemetry collector over OTLP/HTTP (JSON encoding).
+
+    Spans are queued and posted from a background thread, so exporting
+    never waits on the collector; if it is down, spans are dropped.
+    """
+
+    def __init__(self, endpoint: str, service_name: str = "falkenberg-chat"):
+        self.url = endpoint.rstrip("/")
+        if not self.url.endswith("/v1/traces"):
+            self.url += "/v1/traces"
+        self.service_name = service_name
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=10000)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def _otlp_span(self, span: Span) -> Dict[str, Any]:
+        start_ns = int(span.start * 1e9)
+        otlp = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(span.duration_ms * 1e6)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp["parentSpanId"] = span.parent_id
+        return otlp
+
+    def _post(self, spans: List[Span]) -> None:
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [self._otlp_span(span) for span in spans]}],
+        }]}
+        try:
+            requests.post(self.url, json=payload, timeout=5)
+        except Exception as e:
+            print(f"Trace export to {self.url} failed: {str(e)}")
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + OTLP_FLUSH_INTERVAL
+            while len(batch) < OTLP_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            self._post(batch)
+
+
+class Tracer:
+    """Creates spans and passes finished ones to the configured exporters"""
+
+    def __init__(self):
+        self.exporters: List[Any] = []
+
+    def configure(self, exporters: List[Any]) -> None:
+        self.exporters = list(exporters)
+
+    def export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                print(f"Trace export failed: {str(e)}")
+
+    def start_span(self, name: str, new_trace: bool = False, **attributes: Any) -> Span:
+        """Start a span under the current one without making it current (for generators,
+        whose body runs in their caller's context between yields); call end() on it"""
+        parent = None if new_trace else _current.get()
+        if parent is None:
+            return Span(self, name, uuid.uuid4().hex, None, attributes)
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    @contextlib.contextmanager
+    def use(self, span: Span) -> Iterator[Span]:
+        """Make a started span current for the block, without ending it"""
+        token = _current.set(span)
+        try:
+            yield span
+        finally:
+            _current.reset(token)
+
+    @contextlib.contextmanager
+    def span(self, name: str, new_trace: bool = False, **attributes: Any) -> Iterator[Span]:
+        """Time the block as a span under the current one; new_trace starts a new request id"""
+        span = self.start_span(name, new_trace, **attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except asyncio.CancelledError:
+            # A cancelled stage (e.g. an unused prefetch) is not a failure
+            span.set(cancelled=True)
+            raise
+        except BaseException as e:
+            span.end(e)
+            raise
+        finally:
+            span.end()
+            _current.reset(token)
+
+
+# Shared by app.py and GeminiTools, configured by app.py
+tracer = Tracer()
+span = tracer.span
+start_span = tracer.start_span
+use_span = tracer.use
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency percentiles per stage from JSONL trace files")
+    parser.add_argument("trace_files", nargs="*", default=["traces.jsonl"],
+                        help="Trace files, e.g. traces.*.jsonl of several processes")
+    parser.add_argument("--since", type=float, default=0, help="Only spans of the last N hours")
+    args = parser.parse_args()
+
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    since = time.time() - args.since * 3600 if args.since else 0
+    for trace_file in args.trace_files:
+        with open(trace_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record["start"] < since:
+                    continue
+                durations[record["name"]].append(record["duration_ms"])
+                if record.get("error"):
+                    errors[record["name"]] += 1
+
+    print(f"{'stage':28} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in sorted(durations):
+        values = sorted(durations[name])
+        print(f"{name:28} {len(values):7} {errors[name]:7} {percentile(values, 0.5):9.1f} "
+              f"{percentile(values, 0.95):9.1f} {percentile(values, 0.99):9.1f}")
+
+
+if __name__ == "__main__":
+    main()